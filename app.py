@@ -3,53 +3,102 @@
 #----------------------------------------------------------------------------#
 
 import json
+import hashlib
+import flask.json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+import pytz
+from itertools import groupby
+from functools import lru_cache
+from flask import Flask, Blueprint, current_app, g, render_template, request, Response, flash, redirect, url_for, abort, jsonify
+from werkzeug.exceptions import HTTPException
+from werkzeug.local import LocalProxy
 from flask_migrate import Migrate
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
-from sqlalchemy import create_engine
+from pagination import keyset_page, InvalidCursor
+from search import search_query
+from cache import ViewCache
+from output_cache import OutputCache, cached_page
+from jobs import JobQueue
+from edits import EDITABLE_COLUMNS, StaleEdit, apply_edit, cache_tags, editable_values
+from seed import seed_cli
+from export import FORMATS as EXPORT_FORMATS, export_chunks, export_cli, parse_updated_since
+from changes import (ExpiredToken, changes_cli, check_retention, decode_token, encode_token, feed_horizon,
+                     read_changes, record_deletes, start_position)
+from geo import InvalidLocation, distance_km, geo_cli, geocode, load_gazetteer, nearby_query, parse_location
+from bootstrap import bootstrap_command
+from partitions import shows_partitions_cli
+from show_counters import OWNER_KEYS, show_counters_cli, upcoming_shows_count, count_new_show, refresh_show_counters
+from booking import proposal, as_utc, lock_bookings, check_bookings, describe_problem
+from instrumentation import RequestMetrics
+from database import init_engine_config, pool_status, utcnow
+from routing import RoutingSQLAlchemy, ReplicaRouter, use_primary, use_replica
+from sqlalchemy.orm import defaultload, joinedload
 from sqlalchemy.dialects.postgresql import JSONB
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-# initialize migrate instance
-migrate = Migrate(app, db)
-
-# Done: connect to a local postgresql database
-engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'].replace(app.config['DB_NAME'], ''))
-# Find all the existing dbs
-cursor = engine.execute(f'SELECT datname FROM pg_database;')
-all_dbs = [rowproxy[0] for rowproxy in cursor.fetchall()]
-# Create db only if not exists
-if app.config['DB_NAME'] not in all_dbs:
-  from sqlalchemy.orm import sessionmaker
-  session = sessionmaker(bind=engine)()
-  session.connection().connection.set_isolation_level(0)
-  session.execute(f'CREATE DATABASE {app.config["DB_NAME"]}')
-  session.connection().connection.set_isolation_level(1)
+# extensions are created unbound and attached to each app in create_app. Nothing at import
+# touches the db: the engine is created on the first query, and creating the database/ schema
+# is left to `flask bootstrap` (see bootstrap.py), run once per deploy instead of per worker
+moment = Moment()
+# reads of GET views go to the read replica when one is configured, see routing.py
+db = RoutingSQLAlchemy()
+migrate = Migrate()
+# the extensions below keep per app state (caches, counters, job store), create_app builds one of each
+# into app.extensions and these names resolve to those of the current app
+replica_router = LocalProxy(lambda: current_app.extensions['replica_router'])
+# view data cache, write handlers invalidate the tags they touch after commit
+view_cache = LocalProxy(lambda: current_app.extensions['view_cache'])
+# rendered pages/ template fragments, keyed by the data versions the write handlers bump
+output_cache = LocalProxy(lambda: current_app.extensions['output_cache'])
+# per route statement counts, db/ template time and slow query log, served at /metrics
+request_metrics = LocalProxy(lambda: current_app.extensions['request_metrics'])
+# background jobs for requests too large to answer inline, see jobs.py
+job_queue = LocalProxy(lambda: current_app.extensions['job_queue'])
+# every route, filter and error handler below is registered on this blueprint
+main = Blueprint('main', __name__)
+# versioned JSON mirror of the pages, see the API section
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 from datetime import datetime
+# genres are normalized into a lookup table shared by venues and artists, the association
+# tables are also indexed on genre_id so "all Jazz venues" filters don't scan
+venue_genres = db.Table('venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_venue_genres_genre_id_venue_id', 'genre_id', 'venue_id'),
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_artist_genres_genre_id_artist_id', 'genre_id', 'artist_id'),
+)
+
+class Genre(db.Model):
+    __tablename__ = 'genres'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
 class Venue(db.Model):
     __tablename__ = 'venues'
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
+    # not null, /venues keyset paginates on them (see migration d83f5b2a6c19)
+    city = db.Column(db.String(120), nullable=False)
+    state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
@@ -57,12 +106,38 @@ class Venue(db.Model):
 
     # Done: implement any missing fields, as a database migration using Flask-Migrate
     seeking_talent = db.Column(db.Boolean, default = False)
-    genres = db.Column(db.String(120))
+    # selectin so a list of venues loads all of their genres in one extra query
+    genres = db.relationship('Genre', secondary=venue_genres, lazy='selectin', order_by=Genre.name)
     seeking_description = db.Column(db.String(500))
     website = db.Column(db.String(120))
     venue_shows = db.relationship('Show', backref='Venue', cascade='all,delete,delete-orphan', lazy=True)
     # let's create created_at for sorting instead of sorting by id (might not be apt if id seq is resets)
-    created_at = db.Column(db.DateTime, default = datetime.now(), nullable=False)
+    # set by the db, ties are broken by id
+    created_at = db.Column(db.DateTime(timezone=True), server_default=utcnow(), nullable=False)
+    # kept up to date as shows are added/ removed, read through show_counters.upcoming_shows_count
+    upcoming_shows_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    past_shows_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    next_show_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    # bumped by every edit changing the row, edits of an older version are refused, see edits.py
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+    # set by the db on insert and by every edit, the change feed reads rows by it, see changes.py
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=utcnow(), nullable=False)
+    # those of its city unless given, read by the "venues near" search, see geo.py
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (
+        # /venues groups and keyset paginates by area
+        db.Index('ix_venues_state_city_id', 'state', 'city', 'id'),
+        # recent listings on the home page
+        db.Index('ix_venues_created_at_id', 'created_at', 'id'),
+        # rows whose next show has started, recounted by `flask show-counters refresh`
+        db.Index('ix_venues_next_show_at', 'next_show_at'),
+        # the change feed
+        db.Index('ix_venues_updated_at_id', 'updated_at', 'id'),
+        # venues near a point without earthdistance, the GiST index of migration c6a4f19e2b73 serves it otherwise
+        db.Index('ix_venues_latitude_longitude', 'latitude', 'longitude'),
+    )
 
 class Artist(db.Model):
     __tablename__ = 'artists'
@@ -72,7 +147,7 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=artist_genres, lazy='selectin', order_by=Genre.name)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
 
@@ -82,9 +157,42 @@ class Artist(db.Model):
     seeking_description = db.Column(db.String(500))
     artist_shows = db.relationship('Show', backref='Artist', cascade='all, delete, delete-orphan', lazy=True)
     # # let's create created_at for sorting instead of sorting by id (might not be apt if id seq is resets)
-    created_at = db.Column(db.DateTime, default = datetime.now(), nullable=False)
-    available_from = db.Column(db.DateTime, nullable=True)
-    available_to = db.Column(db.DateTime, nullable=True)
+    # set by the db, ties are broken by id
+    created_at = db.Column(db.DateTime(timezone=True), server_default=utcnow(), nullable=False)
+    # windows the artist can be booked in, none means always available, see booking.py
+    availability = db.relationship('ArtistAvailability', lazy='selectin', cascade='all, delete-orphan',
+                                   order_by='ArtistAvailability.starts_at')
+    # kept up to date as shows are added/ removed, read through show_counters.upcoming_shows_count
+    upcoming_shows_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    past_shows_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    next_show_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    # bumped by every edit changing the row, edits of an older version are refused, see edits.py
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+    # set by the db on insert and by every edit, the change feed reads rows by it, see changes.py
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=utcnow(), nullable=False)
+
+    __table_args__ = (
+        # recent listings on the home page and the /artists keyset
+        db.Index('ix_artists_created_at_id', 'created_at', 'id'),
+        # rows whose next show has started, recounted by `flask show-counters refresh`
+        db.Index('ix_artists_next_show_at', 'next_show_at'),
+        # the change feed
+        db.Index('ix_artists_updated_at_id', 'updated_at', 'id'),
+    )
+
+class ArtistAvailability(db.Model):
+    __tablename__ = 'artist_availability'
+
+    id = db.Column(db.Integer, primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), nullable=False)
+    starts_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    ends_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        db.CheckConstraint('ends_at > starts_at', name='ck_artist_availability_ends_after_start'),
+        # booking checks read the windows of a batch's artists
+        db.Index('ix_artist_availability_artist_id_starts_at', 'artist_id', 'starts_at'),
+    )
 
 # Done Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 class Show(db.Model):
@@ -92,284 +200,444 @@ class Show(db.Model):
   id = db.Column(db.Integer, primary_key=True)
   artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), nullable=False)
   venue_id =  db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), nullable=False)
-  start_time = db.Column(db.DateTime(timezone=True))
+  # on postgres the table is partitioned by range of start_time, its primary key there is (id, start_time)
+  # and the partitions are managed with `flask shows-partitions`, see partitions.py
+  start_time = db.Column(db.DateTime(timezone=True), nullable=False)
+  # the artist and the venue are booked until then, shows last at most booking.MAX_SHOW_DURATION
+  end_time = db.Column(db.DateTime(timezone=True), nullable=False)
+  # set by the db on insert, shows aren't edited, see changes.py
+  updated_at = db.Column(db.DateTime(timezone=True), server_default=utcnow(), nullable=False)
+
+  __table_args__ = (
+    db.CheckConstraint('end_time > start_time', name='ck_shows_end_after_start'),
+    # detail pages filter shows by venue/ artist and a start_time range
+    db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    # the change feed
+    db.Index('ix_shows_updated_at_id', 'updated_at', 'id'),
+  )
 
   # let's create created_at for sorting instead of sorting by id (might not be apt if id seq is resets)
   # created_at = db.Column(db.DateTime, default = datetime.now(), nullable=False)
-# Create tables
-db.create_all()
+
+class Tombstone(db.Model):
+  # one row per deleted venue/ artist/ show, so the change feed can report deletes, see changes.py
+  __tablename__ = 'tombstones'
+  id = db.Column(db.Integer, primary_key=True)
+  table_name = db.Column(db.String(20), nullable=False)
+  row_id = db.Column(db.Integer, nullable=False)
+  deleted_at = db.Column(db.DateTime(timezone=True), server_default=utcnow(), nullable=False)
+
+  __table_args__ = (
+    db.Index('ix_tombstones_deleted_at_id', 'deleted_at', 'id'),
+  )
+
+
+def genres_by_name(names):
+    """
+    Resolves genre names to Genre rows, creating the missing ones
+    :param names: genre names, duplicates and blanks are dropped
+    :return: (list) Genre in the given order
+    """
+    names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+    if not names:
+        return []
+    existing = {genre.name: genre for genre in db.session.query(Genre).filter(Genre.name.in_(names))}
+    for name in names:
+        if name not in existing:
+            existing[name] = Genre(name=name)
+            db.session.add(existing[name])
+    db.session.flush()
+    return [existing[name] for name in names]
+
+
+def replace_genres(association, owner_key, owner_id, names):
+    """
+    Swaps the genres of one venue/ artist without loading the entity
+    :param association: venue_genres or artist_genres
+    :param owner_key: 'venue_id' or 'artist_id'
+    :param owner_id: id of the venue/ artist
+    :param names: new genre names
+    """
+    db.session.execute(association.delete().where(association.c[owner_key] == owner_id))
+    rows = [{owner_key: owner_id, 'genre_id': genre.id} for genre in genres_by_name(names)]
+    if rows:
+        db.session.execute(association.insert(), rows)
+
+
+def current_genres(association, owner_key, owner_id):
+    """
+    :return: (list) genre names of one venue/ artist, sorted
+    """
+    return [name for name, in db.session.query(Genre.name)
+            .join(association, association.c.genre_id == Genre.id)
+            .filter(association.c[owner_key] == owner_id).order_by(Genre.name)]
+
+
+def genre_changes(association, owner_key, owner_id, names):
+    """
+    Compares submitted genre names with the stored ones of one venue/ artist, nothing is written
+    :return: (dict) {'genres': (old names, new names)} when they differ, else empty
+    """
+    current = current_genres(association, owner_key, owner_id)
+    submitted = sorted(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+    return {'genres': (current, submitted)} if submitted != current else {}
+
+
+def gazetteer():
+    return load_gazetteer(current_app.config['GAZETTEER_PATH'])
+
+
+def venue_coordinates(current, changes):
+    """
+    Re-geocodes a venue moved to another city/ state, unless the edit sets its coordinates too
+    :param current: editable values of the venue
+    :param changes: name -> (old, new) of the edit
+    :return: (dict) latitude and longitude, empty when they stay
+    """
+    if not {'city', 'state'} & changes.keys() or {'latitude', 'longitude'} & changes.keys():
+        return {}
+    city, state = (changes[name][1] if name in changes else current[name] for name in ('city', 'state'))
+    latitude, longitude = geocode(gazetteer(), city, state) or (None, None)
+    return {'latitude': latitude, 'longitude': longitude}
+
+
+# cache tags of the listings showing each edited value, the detail pages go by their own tag
+# (the home page lists the recent venues/ artists with their images under the 'venues'/ 'artists' tags)
+VENUE_LISTINGS = {'venues': ('name', 'city', 'state', 'genres', 'image_link', 'latitude', 'longitude'),
+                  'shows': ('name',)}
+ARTIST_LISTINGS = {'artists': ('name', 'city', 'state', 'genres', 'image_link'), 'shows': ('name', 'image_link')}
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------
-def format_datetime(value, format='medium'):
-  from babel.dates import format_datetime
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  formatted_date = format_datetime(date, 'medium', locale='en_US')
-  return formatted_date
+# named formats of the datetime filter, anything else is used as a babel pattern
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+
+@lru_cache(maxsize=128)
+def datetime_formatter(format='medium', locale='en_US', timezone='UTC'):
+    """
+    Builds the formatter for one (format, locale, timezone), the pattern, locale and timezone are
+    parsed once here instead of on every call
+    :return: callable formatting a datetime, naive values are taken as utc
+    """
+    pattern = babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+    babel_locale = babel.Locale.parse(locale)
+    tz = pytz.timezone(timezone)
+
+    def format_value(value):
+        if value.tzinfo is None:
+            value = pytz.utc.localize(value)
+        return pattern.apply(value.astimezone(tz), babel_locale)
+    return format_value
+
 
-app.jinja_env.filters['datetime'] = format_datetime
+def format_datetime(value, format='medium', locale=None, timezone=None):
+  """
+  Jinja `datetime` filter
+  :param value: datetime, strings are still parsed for old callers
+  :param format: 'full', 'medium' or a babel pattern
+  :param locale: defaults to DATETIME_LOCALE
+  :param timezone: display timezone, defaults to DISPLAY_TIMEZONE
+  """
+  if value is None:
+    return ''
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  config = current_app.config
+  return datetime_formatter(format, locale or config['DATETIME_LOCALE'], timezone or config['DISPLAY_TIMEZONE'])(value)
+
+main.add_app_template_filter(format_datetime, 'datetime')
+
+
+def paginate(query, sort_columns, descending=False):
+  """
+  Keyset paginates a listing query using the cursor and per_page request args
+  :param query: unordered listing query
+  :param sort_columns: unique sort key of the listing
+  :param descending: sort direction
+  :return: (dict) page with items, next_cursor and prev_cursor
+  """
+  per_page = request.args.get('per_page', current_app.config['PAGE_SIZE'], type=int)
+  per_page = max(1, min(per_page, current_app.config['MAX_PAGE_SIZE']))
+  try:
+    return keyset_page(query, sort_columns, cursor=request.args.get('cursor'),
+                       per_page=per_page, descending=descending)
+  except InvalidCursor as e:
+    logging.error(f"Invalid cursor for [{request.endpoint}]>>>> Reason: {str(e)}")
+    abort(400)
+
+
+def page_links(page):
+  """
+  :param page: page built by paginate
+  :return: (dict) the cursors the pager needs, without the row objects
+  """
+  return {'next_cursor': page['next_cursor'], 'prev_cursor': page['prev_cursor']}
+
+
+def cached_view_data(build, tags, key=None):
+  """
+  Returns the view data for the current url from view_cache, building it on a miss
+  :param build: callable building the view data
+  :param tags: tags to invalidate the entry with, or a callable taking the built data
+  :param key: cache key, defaults to the request path and query string
+  """
+  if key is None:
+    # pages cached by @cached_page key on the data versions they are rendered from
+    key = (request.full_path, g.get('page_versions'))
+  return view_cache.get_or_build(key, build, tags)
+
+
+def invalidate_cached(*tags):
+  """
+  Called by the write handlers after their commit: drops the view data carrying any of the tags and
+  bumps their data versions, which turns the cached pages rendered from them stale
+  """
+  view_cache.invalidate(*tags)
+  output_cache.bump(*tags)
 
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@main.route('/')
+@cached_page('venues', 'artists')
 def index():
-  venues = db.session.query(Venue).order_by(Venue.created_at.desc()).limit(10)
-  artists = db.session.query(Artist).order_by(Artist.created_at.desc()).limit(10)
-  return render_template('pages/home.html', venues = venues, artists = artists)
+  def build():
+    recent = {}
+    for key, model in [('venues', Venue), ('artists', Artist)]:
+      # a backward scan of the (created_at, id) index, same order every time
+      rows = db.session.query(model.id, model.name, model.image_link)\
+        .order_by(model.created_at.desc(), model.id.desc()).limit(10)
+      recent[key] = [{'id': row.id, 'name': row.name, 'image_link': row.image_link} for row in rows]
+    return recent
+  recent = cached_view_data(build, tags=['venues', 'artists'])
+  return render_template('pages/home.html', venues = recent['venues'], artists = recent['artists'])
 
 
 #  Venues
 #  ----------------------------------------------------------------
-def insert_dummy_values(model, dummy_values):
-    instance = None
-    if 'genres' in dummy_values:
-      dummy_values['genres'] = ",".join(dummy_values['genres'])
-    if model == 'Venue':
-      instance = Venue(**dummy_values)
-    if model == 'Artist':
-      instance = Artist(**dummy_values)
-
-    if model == 'Show' and type(dummy_values) == list:
-      result = []
-      for sample in dummy_values:
-        show = Show(**sample)
-        if show is not None:
-          result.append(show)
-      db.session.add_all(result)
-      db.session.commit()
-    if instance is not None:
-      db.session.add(instance)
-      db.session.commit()
-# dummy samples for data seed!!!!
-# venue_sample_1 = {
-#     "name": "The Musical Hop",
-#     "genres": ["Jazz", "Reggae", "Swing", "Classical", "Folk"],
-#     "address": "1015 Folsom Street",
-#     "city": "San Francisco",
-#     "state": "CA",
-#     "phone": "123-123-1234",
-#     "website": "https://www.themusicalhop.com",
-#     "facebook_link": "https://www.facebook.com/TheMusicalHop",
-#     "seeking_talent": True,
-#     "seeking_description": "We are on the lookout for a local artist to play every two weeks. Please call us.",
-#     "image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60"}
-# venue_sample_2 = {
-#   "name": "The Dueling Pianos Bar",
-#   "genres": ["Classical", "R&B", "Hip-Hop"],
-#   "address": "335 Delancey Street",
-#   "city": "New York",
-#   "state": "NY",
-#   "phone": "914-003-1132",
-#   "website": "https://www.theduelingpianos.com",
-#   "facebook_link": "https://www.facebook.com/theduelingpianos",
-#   "seeking_talent": False,
-#   "image_link": "https://images.unsplash.com/photo-1497032205916-ac775f0649ae?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=750&q=80"
-# }
-# venue_sample_3 = {
-#   "name": "Park Square Live Music & Coffee",
-#   "genres": ["Rock n Roll", "Jazz", "Classical", "Folk"],
-#   "address": "34 Whiskey Moore Ave",
-#   "city": "San Francisco",
-#   "state": "CA",
-#   "phone": "415-000-1234",
-#   "website": "https://www.parksquarelivemusicandcoffee.com",
-#   "facebook_link": "https://www.facebook.com/ParkSquareLiveMusicAndCoffee",
-#   "seeking_talent": False,
-#   "image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80"
-# }
-# # Artists----------
-# artist_sample_1 = {
-#     "name": "Guns N Petals",
-#     "genres": ["Rock n Roll"],
-#     "city": "San Francisco",
-#     "state": "CA",
-#     "phone": "326-123-5000",
-#     "website": "https://www.gunsnpetalsband.com",
-#     "facebook_link": "https://www.facebook.com/GunsNPetals",
-#     "seeking_venue": True,
-#     "seeking_description": "Looking for shows to perform at in the San Francisco Bay Area!",
-#     "image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80"}
-# artist_sample_2 = {
-#     "name": "Matt Quevedo",
-#     "genres": ["Jazz"],
-#     "city": "New York",
-#     "state": "NY",
-#     "phone": "300-400-5000",
-#     "facebook_link": "https://www.facebook.com/mattquevedo923251523",
-#     "seeking_venue": False,
-#     "image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80"}
-#
-# artist_sample_3 = {
-#     "name": "The Wild Sax Band",
-#     "genres": ["Jazz", "Classical"],
-#     "city": "San Francisco",
-#     "state": "CA",
-#     "phone": "432-325-5432",
-#     "seeking_venue": False,
-#     "image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80"}
-#
-# show_samples = [{
-#     "venue_id": 1,
-#     "artist_id": 1,
-#     "start_time": "2019-05-21T21:30:00.000Z"
-#   }, {
-#     "venue_id": 3,
-#     "artist_id": 2,
-#     "start_time": "2019-06-15T23:00:00.000Z"
-#   }, {
-#     "venue_id": 3,
-#     "artist_id": 3,
-#     "start_time": "2035-04-01T20:00:00.000Z"
-#   }, {
-#     "venue_id": 3,
-#     "artist_id": 3,
-#     "start_time": "2035-04-08T20:00:00.000Z"
-#   }, {
-#     "venue_id": 3,
-#     "artist_id": 3,
-#     "start_time": "2035-04-15T20:00:00.000Z"
-#   }]
-# -------------------End of samples ---------------------------
-
-@app.route('/venues')
+@main.route('/venues')
+@cached_page('venues')
 def venues():
   # Done: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
-  venues_list = []
-  for state, city in db.session.query(Venue.state, Venue.city).group_by(Venue.state, Venue.city).all():
-    venues = db.session.query(Venue).filter_by(state=state).filter_by(city=city).all()
-    venues_template = {'state': state, 'city': city, 'venues': []}
-    for venue in venues:
-      venues_template['venues'].append({
-        'id': venue.id,
-        'name': venue.name,
-        'num_upcoming_shows': calculate_upcoming_past_shows(venue.venue_shows)
+  def build():
+    # One aggregated query per page, ordered by area so the rows can be grouped in a single pass.
+    venue_rows, page = venues_page(genre=request.args.get('genre'))
+    venues_list = []
+    for (state, city), area_rows in groupby(venue_rows, key=lambda row: (row['state'], row['city'])):
+      venues_list.append({
+        'state': state,
+        'city': city,
+        'venues': [{'id': row['id'], 'name': row['name'], 'num_upcoming_shows': row['num_upcoming_shows']}
+                   for row in area_rows]
       })
-    venues_list.append(venues_template)
-  return render_template('pages/venues.html', areas=venues_list)
+    return venues_list, page
+  venues_list, page = cached_view_data(build, tags=['venues'])
+  return render_template('pages/venues.html', areas=venues_list, page=page)
 
 
-def calculate_upcoming_past_shows(shows, for_upcoming = True):
+def venues_page(genre=None):
     """
-    Returns upcoming/ past shows count
-    :param shows: shows dbo
-    :param for_upcoming: True for upcoming/ false for past
-    :return: count (int)
+    One page of the venues listing, ordered by area
+    :param genre: only venues with this genre name
+    :return: (list) venue dicts, (dict) page cursors
     """
-    import pytz
-    if for_upcoming:
-        num_upcoming_shows = sum([1 for show in shows if show.start_time > datetime.now(pytz.utc)])
-        return num_upcoming_shows
-    else:
-        num_past_shows = sum([1 for show in shows if show.start_time > datetime.now(pytz.utc)])
-        return num_past_shows
+    page = paginate(get_venues_with_upcoming_count(genre=genre), [Venue.state, Venue.city, Venue.id])
+    venue_rows = [{'id': row.id, 'name': row.name, 'city': row.city, 'state': row.state,
+                   'num_upcoming_shows': row.num_upcoming_shows} for row in page['items']]
+    return venue_rows, page_links(page)
+
+
+def get_venues_with_upcoming_count(now=None, genre=None):
+    """
+    Builds the venues listing query, upcoming shows are read from the venues' show counters instead
+    of being counted per request. The ordering comes straight from ix_venues_state_city_id
+    :param now: reference timestamp for upcoming shows, defaults to current utc time
+    :param genre: only venues with this genre name
+    :return: query of (id, name, city, state, num_upcoming_shows) rows, unordered
+    """
+    query = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state,
+                             upcoming_shows_count(Venue.__table__, now).label('num_upcoming_shows'))
+    if genre:
+        query = query.filter(Venue.genres.any(Genre.name == genre))
+    return query
 
 
+def record_new_show(show):
+    """
+    Adds the show to its venue's and artist's show counters, call after adding it to the session
+    """
+    for table, owner_id in [(Venue.__table__, show.venue_id), (Artist.__table__, show.artist_id)]:
+        count_new_show(db.session, table, owner_id, show.start_time)
 
-@app.route('/venues/search', methods=['POST'])
+
+@main.route('/venues/search', methods=['POST'])
+@use_replica
 def search_venues():
   # Done: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
   search_term = request.form.get('search_term', '')
   city_state_text = request.form.get('search_by_city_state', '')
-  clause = None
-  if not search_term:
-      from sqlalchemy import and_
-      result = city_state_text.split(',')
-      if len(result) == 2:
-          city = result[0].strip()
-          state = result[1].strip()
-          clause = and_(Venue.city.ilike(f'%{city}%'), Venue.state.ilike(f'%{state}%'))
-  if clause is None and search_term is not None:
-      clause = Venue.name.ilike(f'%{search_term}%')
-  venues = db.session.query(Venue).filter(clause).all()
-  count = len(venues)
-  venue_list = []
-  for venue in venues:
-      selected_venue = {'id': venue.id, 'name': venue.name,
-                         'num_upcoming_shows': calculate_upcoming_past_shows(venue.venue_shows)}
-      venue_list.append(selected_venue)
-  response = {
-      "count": count,
-      "data": venue_list
-  }
+  location = request.form.get('location', '').strip()
+  if location:
+    # venues within radius_km of a 'city, state' or 'latitude, longitude'
+    try:
+      latitude, longitude, radius_km = nearby_params(location, request.form.get('radius_km'))
+      response = nearby_results(latitude, longitude, radius_km, genre=request.values.get('genre'))
+    except InvalidLocation as e:
+      flash(f'Cannot search near "{location}": {str(e)}')
+      radius_km = None
+      response = {"count": 0, "data": []}
+    return render_template('pages/search_venues.html', results=response, location=location, radius_km=radius_km)
+  response = search_results(Venue, search_term, city_state_text, genre=request.values.get('genre'))
   return render_template('pages/search_venues.html', results=response, search_term = search_term, city_state_text = city_state_text)
 
 
+def search_results(model, search_term, city_state_text='', genre=None):
+    """
+    Venue/ artist search results with their upcoming show counts
+    :param model: Venue or Artist
+    :param search_term: name search text
+    :param city_state_text: 'city, state' search text
+    :param genre: only rows tagged with this genre name
+    :return: (dict) count and data
+    """
+    rows = search_query(db.session, model, search_term, city_state_text, genre=genre,
+                        limit=current_app.config['SEARCH_RESULT_LIMIT'])\
+        .add_columns(upcoming_shows_count(model.__table__).label('num_upcoming_shows')).all()
+    data = [{'id': row.id, 'name': row.name, 'num_upcoming_shows': num_upcoming_shows}
+            for row, num_upcoming_shows in rows]
+    return {"count": len(data), "data": data}
+
 
-@app.route('/venues/<int:venue_id>')
+def nearby_params(location, radius_km):
+    """
+    :param location: 'city, state' or 'latitude, longitude' text
+    :param radius_km: radius text, NEARBY_RADIUS_KM when empty
+    :return: latitude, longitude and radius_km. Raises InvalidLocation when they are invalid
+    """
+    latitude, longitude = parse_location(location, gazetteer())
+    try:
+        radius_km = float(radius_km) if radius_km else current_app.config['NEARBY_RADIUS_KM']
+    except ValueError:
+        raise InvalidLocation(f'radius must be a number of km, not {radius_km}')
+    max_radius_km = current_app.config['NEARBY_MAX_RADIUS_KM']
+    if not 0 < radius_km <= max_radius_km:
+        raise InvalidLocation(f'radius must be more than 0 and at most {max_radius_km} km')
+    return latitude, longitude, radius_km
+
+
+def nearby_results(latitude, longitude, radius_km, genre=None):
+    """
+    Venues within radius_km of a point with their distance and upcoming show counts, nearest first
+    :param genre: only venues tagged with this genre name
+    :return: (dict) count and data
+    """
+    rows = nearby_query(db.session, Venue, latitude, longitude, radius_km, genre=genre,
+                        limit=current_app.config['SEARCH_RESULT_LIMIT'])\
+        .add_columns(upcoming_shows_count(Venue.__table__).label('num_upcoming_shows')).all()
+    data = []
+    for row, num_upcoming_shows in rows:
+        distance = distance_km(latitude, longitude, row.latitude, row.longitude)
+        # the bounding box query also returns the corners of the box
+        if distance <= radius_km:
+            data.append({'id': row.id, 'name': row.name, 'city': row.city, 'state': row.state,
+                         'distance_km': round(distance, 2), 'num_upcoming_shows': num_upcoming_shows})
+    data.sort(key=lambda venue: venue['distance_km'])
+    return {"count": len(data), "data": data}
+
+
+
+@main.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
-  import pytz
   # shows the venue page with the given venue_id
   # Done: replace with real venue data from the venues table, using venue_id
-  venue = db.session.query(Venue).filter_by(id = venue_id).first()
-  past_clause = (Show.start_time < datetime.now(pytz.utc))
-  upcoming_clause = (Show.start_time > datetime.now(pytz.utc))
-  past_shows = db.session.query(Show).join(Venue).filter(Venue.id == venue_id).filter(past_clause).all()
-  upcoming_shows = db.session.query(Show).join(Venue).filter(Venue.id == venue_id).filter(upcoming_clause).all()
-  past_shows, upcoming_shows = get_past_upcoming_shows(past_shows=past_shows, upcoming_shows=upcoming_shows,
-                                                       for_artists_venue='artist')
-  genres = []
-  if venue.genres is not None:
-      genres = venue.genres.split(',')
-  venue={
-    "id": venue.id,
-    "name": venue.name,
-    "genres": genres,
-    "address": venue.address,
-    "city": venue.city,
-    "state": venue.state,
-    "phone": venue.phone,
-    "website": venue.website,
-    "facebook_link": venue.facebook_link,
-    "seeking_talent": venue.seeking_talent,
-    "seeking_description": venue.seeking_description,
-    "image_link": venue.image_link,
-    "past_shows": past_shows,
-    "upcoming_shows": upcoming_shows,
-    "past_shows_count": len(past_shows),
-    "upcoming_shows_count": len(upcoming_shows),
-  }
+  venue = cached_view_data(lambda: venue_details(venue_id), tags=venue_detail_tags)
   return render_template('pages/show_venue.html', venue=venue)
 
+
+def venue_details(venue_id):
+    """
+    Venue page data, the venue, its shows and each show's artist name/image come back in one joined query
+    :param venue_id: venue id, aborts with 404 when it doesn't exist
+    :return: (dict) venue with its past and upcoming shows
+    """
+    venue = db.session.query(Venue)\
+        .options(joinedload(Venue.venue_shows).joinedload(Show.Artist).load_only('id', 'name', 'image_link')
+                 .lazyload(Artist.genres),
+                 defaultload(Venue.venue_shows).defaultload(Show.Artist).lazyload(Artist.availability))\
+        .filter(Venue.id == venue_id).first()
+    if venue is None:
+        abort(404)
+    past_shows, upcoming_shows = get_past_upcoming_shows(venue.venue_shows, for_artists_venue='artist')
+    genres = [genre.name for genre in venue.genres]
+    return {
+        "id": venue.id,
+        "version": venue.version,
+        "name": venue.name,
+        "genres": genres,
+        "address": venue.address,
+        "city": venue.city,
+        "state": venue.state,
+        "phone": venue.phone,
+        "website": venue.website,
+        "facebook_link": venue.facebook_link,
+        "seeking_talent": venue.seeking_talent,
+        "seeking_description": venue.seeking_description,
+        "image_link": venue.image_link,
+        "past_shows": past_shows,
+        "upcoming_shows": upcoming_shows,
+        "past_shows_count": len(past_shows),
+        "upcoming_shows_count": len(upcoming_shows),
+    }
+
+
+def venue_detail_tags(venue):
+    # the page lists artist names/ images, so artist edits invalidate it too
+    return [f'venue:{venue["id"]}'] + [f'artist:{show["artist_id"]}'
+                                       for show in venue['past_shows'] + venue['upcoming_shows']]
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+def new_venue(data, genre_names):
+    """
+    Builds a Venue from submitted fields, the caller adds and commits it
+    :param data: mapping with the venue form fields
+    :param genre_names: genre names
+    :return: Venue, with the coordinates of its city when the gazetteer knows it
+    """
+    latitude, longitude = geocode(gazetteer(), data['city'], data['state']) or (None, None)
+    return Venue(name=data['name'], city=data['city'], state=data['state'], address=data['address'],
+                 phone=data['phone'], genres=genres_by_name(genre_names), image_link=data['image_link'],
+                 seeking_description=data['seeking_description'], facebook_link=data['facebook_link'],
+                 latitude=latitude, longitude=longitude)
+
+
+@main.route('/venues/create', methods=['GET'])
 def create_venue_form():
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@main.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   # Done: insert form data as a new Venue record in the db, instead
   # Done: modify data to be the data object returned from db insertion
   form_data = request.form.to_dict(flat=False)
   try:
-    name = request.form['name']
-    city = request.form['city']
-    state = request.form['state']
-    address = request.form['address']
-    phone = request.form['phone']
-    genres = ",".join(form_data['genres'])
-    image_link = request.form['image_link']
-    seeking_description = request.form['seeking_description']
-    facebook_link = request.form['facebook_link']
-    venue = Venue(name = name, city = city , state = state ,
-            address = address, phone = phone, genres = genres, image_link = image_link,
-            seeking_description = seeking_description,
-            facebook_link = facebook_link)
+    venue = new_venue(request.form, form_data['genres'])
     db.session.add(venue)
     db.session.commit()
+    invalidate_cached('venues')
     # on successful db insert, flash success
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
   except Exception as e:
@@ -379,15 +647,24 @@ def create_venue_submission():
     flash(f'An error occurred. Reason: {str(e)} Venue ' + request.form['name'] + ' could not be listed.')
   finally:
     db.session.close()
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@main.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   # Done: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   try:
+      # the venue's shows go first so the counters of their artists can be recounted without them
+      artist_ids = [row.artist_id for row in db.session.query(Show.artist_id).filter_by(venue_id = venue_id).distinct()]
+      # tombstones for the change feed
+      record_deletes(db.session, Show.__table__, Show.venue_id == venue_id)
+      record_deletes(db.session, Venue.__table__, Venue.id == venue_id)
+      db.session.query(Show).filter_by(venue_id = venue_id).delete(synchronize_session=False)
       db.session.query(Venue).filter_by(id = venue_id).delete()
+      refresh_show_counters(db.session, Artist.__table__, ids=artist_ids)
       db.session.commit()
+      # artist pages listing its shows carry the venue tag too
+      invalidate_cached(f'venue:{venue_id}', 'venues', 'shows')
       flash('Successfully deleted the venue!!!!')
   except Exception as e:
       db.session.rollback()
@@ -397,56 +674,51 @@ def delete_venue(venue_id):
       db.session.close()
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
-  return redirect(url_for('index'))
+  return redirect(url_for('.index'))
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@main.route('/artists')
+@cached_page('artists')
 def artists():
   # Done: replace with real data returned from querying the database
-  artists = db.session.query(Artist).all()
-  artists_list= []
-  for artist in artists:
-    artists_list.append({'id': artist.id, 'name': artist.name})
-  return render_template('pages/artists.html', artists=artists)
+  artists_list, page = cached_view_data(lambda: artists_page(genre=request.args.get('genre')), tags=['artists'])
+  return render_template('pages/artists.html', artists=artists_list, page=page)
+
+
+def artists_page(genre=None):
+    """
+    One page of the artists listing, newest first, keyset paginated on (created_at, id)
+    :param genre: only artists with this genre name
+    :return: (list) artist dicts, (dict) page cursors
+    """
+    query = db.session.query(Artist.id, Artist.name, Artist.created_at)
+    if genre:
+        query = query.filter(Artist.genres.any(Genre.name == genre))
+    page = paginate(query, [Artist.created_at, Artist.id], descending=True)
+    return [{'id': artist.id, 'name': artist.name} for artist in page['items']], page_links(page)
 
-@app.route('/artists/search', methods=['POST'])
+@main.route('/artists/search', methods=['POST'])
+@use_replica
 def search_artists():
   # Done: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
   search_term = request.form.get('search_term', '')
   city_state_text = request.form.get('search_by_city_state', '')
-  clause = None
-  if not search_term:
-      from sqlalchemy import and_
-      result = city_state_text.split(',')
-      if len(result) == 2:
-          city = result[0].strip()
-          state = result[1].strip()
-          clause = and_(Artist.city.ilike(f'%{city}%'), Artist.state.ilike(f'%{state}%'))
-  if clause is None and search_term is not None:
-      clause = Artist.name.ilike(f'%{search_term}%')
-  artists = db.session.query(Artist).filter(clause).all()
-  count = len(artists)
-  artists_list = []
-  for artist in artists:
-      selected_artist = {'id': artist.id, 'name': artist.name,
-      'num_upcoming_shows': calculate_upcoming_past_shows(artist.artist_shows)}
-      artists_list.append(selected_artist)
-  response={
-    "count": count,
-    "data": artists_list
-  }
+  response = search_results(Artist, search_term, city_state_text, genre=request.values.get('genre'))
   return render_template('pages/search_artists.html', results=response, search_term=search_term, city_state_text= city_state_text )
 
-def get_past_upcoming_shows(past_shows, upcoming_shows, for_artists_venue:str):
+def get_past_upcoming_shows(shows, for_artists_venue:str, now=None):
     """
-    Get past and upcoming artist shows/ venues
-    :param where_clause: Artist or Venue where clause
+    Split eager loaded shows into past and upcoming artist shows/ venues in one pass
+    :param shows: shows dbo with Artist/ Venue already loaded
     :param for_artists_venue: 'artist' or 'venue' events
-    :return: (list)past, (list)upcoming events
+    :param now: reference timestamp, defaults to current utc time
+    :return: (list)past, (list)upcoming events ordered by start time
     """
+    if now is None:
+        now = datetime.now(pytz.utc)
     past_shows_list = []
     upcoming_shows_list = []
     show_keys = ['start_time']
@@ -454,177 +726,241 @@ def get_past_upcoming_shows(past_shows, upcoming_shows, for_artists_venue:str):
         show_keys.extend(['artist_id', 'artist_name', 'artist_image_link'])
     else:
         show_keys.extend(['venue_id', 'venue_name', 'venue_image_link'])
-    for past_show in past_shows:
-
+    for show in sorted((show for show in shows if show.start_time is not None), key=lambda show: show.start_time):
         if for_artists_venue == 'venue':
-            past_show_template = dict(zip(show_keys,
-                                          [str(past_show.start_time), past_show.venue_id, past_show.Venue.name, past_show.Venue.image_link,
-                                           ]))
+            counterpart = show.Venue
         else:
-            past_show_template = dict(zip(show_keys,
-                                          [str(past_show.start_time), past_show.artist_id, past_show.Artist.name, past_show.Artist.image_link,
-                                           ]))
-
-        past_shows_list.append(past_show_template)
-
-    for upcoming_show in upcoming_shows:
-        if for_artists_venue == 'venue':
-            upcoming_show_template = dict(zip(show_keys,
-                                              [str(upcoming_show.start_time), upcoming_show.venue_id, upcoming_show.Venue.name,
-                                               upcoming_show.Venue.image_link,
-                                               ]))
+            counterpart = show.Artist
+        show_template = dict(zip(show_keys, [show.start_time, counterpart.id, counterpart.name,
+                                             counterpart.image_link]))
+        start_time = show.start_time
+        if start_time.tzinfo is None:
+            # naive timestamps are stored as utc
+            start_time = start_time.replace(tzinfo=pytz.utc)
+        if start_time < now:
+            past_shows_list.append(show_template)
         else:
-            upcoming_show_template = dict(zip(show_keys,
-                                              [str(upcoming_show.start_time), upcoming_show.artist_id, upcoming_show.Artist.name,
-                                               upcoming_show.Artist.image_link,
-                                               ]))
-        upcoming_shows_list.append(upcoming_show_template)
+            upcoming_shows_list.append(show_template)
     return past_shows_list, upcoming_shows_list
 
-@app.route('/artists/<int:artist_id>')
+@main.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # Done: replace with real venue data from the venues table, using venue_id
-  import pytz
-  artist = db.session.query(Artist).filter_by(id=artist_id).first()
-  past_clause = (Show.start_time < datetime.now(pytz.utc))
-  upcoming_clause = (Show.start_time > datetime.now(pytz.utc))
-  past_shows = db.session.query(Show).join(Artist).filter(Artist.id == artist_id).filter(past_clause).all()
-  upcoming_shows = db.session.query(Show).join(Artist).filter(Artist.id == artist_id).filter(upcoming_clause).all()
-  past_shows, upcoming_shows = get_past_upcoming_shows(past_shows= past_shows, upcoming_shows= upcoming_shows,
-                                                       for_artists_venue='venue')
-  artist_shows={
-    "id": artist.id,
-    "name": artist.name,
-    "genres": artist.genres.split(',') if artist.genres else [],
-    "city": artist.city,
-    "state": artist.state,
-    "phone": artist.phone,
-    "website": artist.website,
-    "facebook_link": artist.facebook_link,
-    "seeking_venue": artist.seeking_venue,
-    "seeking_description": artist.seeking_description,
-    "image_link": artist.image_link,
-    "past_shows": past_shows,
-    "upcoming_shows": upcoming_shows,
-    "past_shows_count": len(past_shows),
-    "available_from": artist.available_from,
-    "available_to": artist.available_to,
-    "upcoming_shows_count": len(upcoming_shows),
-  }
+  artist_shows = cached_view_data(lambda: artist_details(artist_id), tags=artist_detail_tags)
   return render_template('pages/show_artist.html', artist=artist_shows)
 
+
+def artist_details(artist_id):
+    """
+    Artist page data, the artist, its shows and each show's venue name/image come back in one joined query
+    :param artist_id: artist id, aborts with 404 when it doesn't exist
+    :return: (dict) artist with its past and upcoming shows
+    """
+    artist = db.session.query(Artist)\
+        .options(joinedload(Artist.artist_shows).joinedload(Show.Venue).load_only('id', 'name', 'image_link')
+                 .lazyload(Venue.genres))\
+        .filter(Artist.id == artist_id).first()
+    if artist is None:
+        abort(404)
+    past_shows, upcoming_shows = get_past_upcoming_shows(artist.artist_shows, for_artists_venue='venue')
+    return {
+        "id": artist.id,
+        "version": artist.version,
+        "name": artist.name,
+        "genres": [genre.name for genre in artist.genres],
+        "city": artist.city,
+        "state": artist.state,
+        "phone": artist.phone,
+        "website": artist.website,
+        "facebook_link": artist.facebook_link,
+        "seeking_venue": artist.seeking_venue,
+        "seeking_description": artist.seeking_description,
+        "image_link": artist.image_link,
+        "past_shows": past_shows,
+        "upcoming_shows": upcoming_shows,
+        "past_shows_count": len(past_shows),
+        "availability": [{"starts_at": window.starts_at, "ends_at": window.ends_at} for window in artist.availability],
+        "upcoming_shows_count": len(upcoming_shows),
+    }
+
+
+def artist_detail_tags(artist):
+    # the page lists venue names/ images, so venue edits invalidate it too
+    return [f'artist:{artist["id"]}'] + [f'venue:{show["venue_id"]}'
+                                         for show in artist['past_shows'] + artist['upcoming_shows']]
+
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@main.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@use_primary
 def edit_artist(artist_id):
   form = ArtistForm()
-  artist = db.session.query(Artist).filter(Artist.id == artist_id).first()
-  artist_data = None
-  if artist is None:
+  # the editable columns and the version the form is posted back with, not the whole row
+  artist_data = editable_values(db.session, Artist.__table__, artist_id)
+  if artist_data is None:
       flash(f'No Artist with the the given artist id: {artist_id}, Please try to edit existing artist!!!!')
   else:
-      artist_data = artist.__dict__
-      form.state.data = artist.state
-      form.genres.data = artist.genres.split(",") if artist.genres is not None else []
+      form.state.data = artist_data['state']
+      form.genres.data = current_genres(artist_genres, 'artist_id', artist_id)
   # Done: populate form with fields from artist with ID <artist_id>
   return render_template('forms/edit_artist.html', form=form, artist=artist_data)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@main.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   # Done: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
   form_data = request.form.to_dict(flat=False)
-  form_data['genres'] = ",".join(form_data['genres'])
+  genres = form_data.pop('genres', None)
   form_data = {key:value[0] if type(value) is list else value for key, value in form_data.items()}
+  next_url = url_for('.show_artist', artist_id=artist_id)
   try:
+    version = form_data.pop('version', None)
+    changes = {}
+    # a filled in availability adds a window to the artist's
+    window = availability_window(form_data.pop('available_from', None), form_data.pop('available_to', None))
+    if window is not None:
+      window.artist_id = artist_id
+      db.session.add(window)
+      changes['availability'] = (None, {'starts_at': window.starts_at, 'ends_at': window.ends_at})
+    if genres is not None:
+      changes.update(genre_changes(artist_genres, 'artist_id', artist_id, genres))
+    # empty fields keep the stored values
     valid_keys = {}
     for key, value in form_data.items():
         if value is not None and value !="":
            valid_keys[key] = value
-    db.session.query(Artist).filter(Artist.id == artist_id).update(valid_keys)
-    db.session.commit()
-    flash(f"Successfully update the artist with id: {artist_id}")
+    # only the changed columns are written, and only when nobody edited the artist since the form was loaded
+    change_set = apply_edit(db.session, Artist.__table__, artist_id, valid_keys,
+                            int(version) if version else None, changes)
+    if change_set is None:
+      db.session.rollback()
+      flash(f'No Artist with the the given artist id: {artist_id}, Please try to edit existing artist!!!!')
+    else:
+      if 'genres' in changes:
+        replace_genres(artist_genres, 'artist_id', artist_id, genres)
+      db.session.commit()
+      tags = cache_tags(change_set, f'artist:{artist_id}', ARTIST_LISTINGS)
+      if tags:
+        invalidate_cached(*tags)
+        flash(f"Successfully update the artist with id: {artist_id}")
+      else:
+        flash(f"Nothing to update for the artist with id: {artist_id}")
+  except StaleEdit:
+    db.session.rollback()
+    flash(f"Artist with id: {artist_id} was changed by someone else meanwhile, please review it and edit again")
+    next_url = url_for('.edit_artist', artist_id=artist_id)
   except Exception as e:
     logging.error(f"Error in [edit_artist_submission]>>>>>> Reason: {str(e)}")
     flash(f"Cannot update artist with id: {artist_id}, please try again!!!!")
     db.session.rollback()
   finally:
     db.session.close()
-  return redirect(url_for('show_artist', artist_id=artist_id))
+  return redirect(next_url)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@main.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@use_primary
 def edit_venue(venue_id):
   # Done: populate form with values from venue with ID <venue_id>
   form = VenueForm()
-  venue = db.session.query(Venue).filter(Venue.id == venue_id).first()
-  venue_data = None
-  if venue is None:
+  # the editable columns and the version the form is posted back with, not the whole row
+  venue_data = editable_values(db.session, Venue.__table__, venue_id)
+  if venue_data is None:
      flash(f'No Venue with the the given venue id: {venue_id}, Please try to edit existing venue!!!!')
   else:
-     venue_data = venue.__dict__
-     form.state.data = venue.state
-     form.genres.data = venue.genres.split(",") if venue.genres is not None else []
+     form.state.data = venue_data['state']
+     form.genres.data = current_genres(venue_genres, 'venue_id', venue_id)
   return render_template('forms/edit_venue.html', form=form, venue=venue_data)
 
 
 
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@main.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   # Done: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
   form_data = request.form.to_dict(flat=False)
-  form_data['genres'] = ",".join(form_data['genres'])
+  genres = form_data.pop('genres', None)
   form_data = {key:value[0] if type(value) is list else value for key, value in form_data.items()}
+  next_url = url_for('.show_venue', venue_id=venue_id)
   try:
-    db.session.query(Venue).filter(Venue.id == venue_id).update(form_data)
-    db.session.commit()
-    flash(f"Successfully update the venue with id: {venue_id}")
+    version = form_data.pop('version', None)
+    changes = genre_changes(venue_genres, 'venue_id', venue_id, genres) if genres is not None else {}
+    # only the changed columns are written, and only when nobody edited the venue since the form was loaded
+    change_set = apply_edit(db.session, Venue.__table__, venue_id, form_data, int(version) if version else None,
+                            changes, derived=venue_coordinates)
+    if change_set is None:
+      db.session.rollback()
+      flash(f'No Venue with the the given venue id: {venue_id}, Please try to edit existing venue!!!!')
+    else:
+      if 'genres' in changes:
+        replace_genres(venue_genres, 'venue_id', venue_id, genres)
+      db.session.commit()
+      tags = cache_tags(change_set, f'venue:{venue_id}', VENUE_LISTINGS)
+      if tags:
+        invalidate_cached(*tags)
+        flash(f"Successfully update the venue with id: {venue_id}")
+      else:
+        flash(f"Nothing to update for the venue with id: {venue_id}")
+  except StaleEdit:
+    db.session.rollback()
+    flash(f"Venue with id: {venue_id} was changed by someone else meanwhile, please review it and edit again")
+    next_url = url_for('.edit_venue', venue_id=venue_id)
   except Exception as e:
     logging.error(f"Error in [edit_venue_submission]>>>>>> Reason: {str(e)}")
     flash(f"Cannot update venue with id: {venue_id}, please try again!!!!")
     db.session.rollback()
   finally:
     db.session.close()
-  return redirect(url_for('show_venue', venue_id=venue_id))
+  return redirect(next_url)
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@main.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+def availability_window(starts_at, ends_at):
+    """
+    :param starts_at: datetime or date string, naive values are taken as utc
+    :param ends_at: datetime or date string
+    :return: ArtistAvailability, None unless both ends are given. Raises ValueError when it ends before it starts
+    """
+    if not starts_at or not ends_at:
+        return None
+    starts_at, ends_at = (as_utc(dateutil.parser.parse(value) if isinstance(value, str) else value)
+                          for value in (starts_at, ends_at))
+    if ends_at <= starts_at:
+        raise ValueError('availability has to end after it starts')
+    return ArtistAvailability(starts_at=starts_at, ends_at=ends_at)
+
+def new_artist(data, genre_names):
+    """
+    Builds an Artist from submitted fields, the caller adds and commits it
+    :param data: mapping with the artist form fields, availability is only kept when both ends are given
+    :param genre_names: genre names
+    :return: Artist
+    """
+    window = availability_window(data['available_from'], data['available_to'])
+    return Artist(name=data['name'], city=data['city'], state=data['state'], phone=data['phone'],
+                  genres=genres_by_name(genre_names), image_link=data['image_link'],
+                  seeking_description=data['seeking_description'], facebook_link=data['facebook_link'],
+                  availability=[window] if window is not None else [])
+
+@main.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
   # Done: insert form data as a new Venue(should be artists!!!) record in the db, instead
   # Done: modify data to be the data object returned from db insertion
   form_data = request.form.to_dict(flat=False)
   try:
-      name = request.form['name']
-      city = request.form['city']
-      state = request.form['state']
-      phone = request.form['phone']
-      genres = ",".join(form_data['genres'])
-      image_link = request.form['image_link']
-      facebook_link = request.form['facebook_link']
-      seeking_description = request.form['seeking_description']
-      available_from = request.form['available_from'] if request.form['available_from']!="" else None
-      available_to = request.form['available_to'] if request.form['available_to']!="" else None
-      availability ={}
-      if available_from is not None and available_to is not None:
-          availability['available_from'] = available_from
-          availability['available_to'] = available_to
-      artist = Artist(name=name, city=city, state=state,
-                    phone=phone, genres=genres, image_link = image_link,
-                    seeking_description = seeking_description,
-                    facebook_link=facebook_link, **availability)
+      artist = new_artist(request.form, form_data['genres'])
       db.session.add(artist)
       db.session.commit()
+      invalidate_cached('artists')
       # on successful db insert, flash success
       flash('Artist ' + request.form['name'] + ' was successfully listed!')
   except Exception as e:
@@ -634,38 +970,110 @@ def create_artist_submission():
       flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
   finally:
       db.session.close()
-      return redirect(url_for('index'))
+      return redirect(url_for('.index'))
 
 
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@main.route('/shows')
+@cached_page('shows')
 def shows():
   # displays list of shows at /shows
   # Done: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
-  shows = db.session.query(Show).all()
-  shows_list = []
-  for show in shows:
-    show_template ={
-      "venue_id": show.venue_id,
-      "venue_name": show.Venue.name,
-      "artist_id": show.Artist.id,
-      "artist_name": show.Artist.name,
-      "artist_image_link": show.Artist.image_link,
-      "start_time": str(show.start_time)
-    }
-    shows_list.append(show_template)
-  return render_template('pages/shows.html', shows=shows_list)
+  shows_list, page = cached_view_data(shows_page, tags=['shows'])
+  return render_template('pages/shows.html', shows=shows_list, page=page)
+
+
+def shows_page():
+    """
+    One page of the shows listing, venue/ artist columns are joined in so a page is one query,
+    keyset paginated on (start_time, id)
+    :return: (list) show dicts, (dict) page cursors
+    """
+    shows_query = db.session.query(Show.id, Show.start_time, Show.venue_id, Venue.name.label('venue_name'),
+                                   Show.artist_id, Artist.name.label('artist_name'),
+                                   Artist.image_link.label('artist_image_link'))\
+        .join(Venue, Show.venue_id == Venue.id)\
+        .join(Artist, Show.artist_id == Artist.id)
+    page = paginate(shows_query, [Show.start_time, Show.id])
+    shows_list = []
+    for show in page['items']:
+        shows_list.append({
+            "venue_id": show.venue_id,
+            "venue_name": show.venue_name,
+            "artist_id": show.artist_id,
+            "artist_name": show.artist_name,
+            "artist_image_link": show.artist_image_link,
+            "start_time": show.start_time
+        })
+    return shows_list, page_links(page)
 
-@app.route('/shows/create')
+@main.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+def book_show(item):
+    """
+    Adds the proposed show unless its artist or venue is taken then, the caller commits
+    :param item: booking.Proposal
+    :return: (Show, None) or (None, list of problems from check_bookings)
+    """
+    # held until the commit/ rollback, concurrent bookings of the same artist/ venue wait for it
+    lock_bookings(db.session, [item])
+    problems = check_bookings(db.session, db.metadata, [item])[0]
+    if problems:
+        return None, problems
+    show = Show(venue_id=item.venue_id, artist_id=item.artist_id, start_time=item.start_time, end_time=item.end_time)
+    db.session.add(show)
+    record_new_show(show)
+    return show, None
+
+def book_shows(proposals):
+    """
+    Adds all of the proposed shows, or none when any of them can't be booked, the caller commits.
+    The rows go in with one executemany and each venue/ artist is recounted once
+    :param proposals: list of booking.Proposal
+    :return: (int) shows added, (dict) index -> problems from check_bookings of the ones that can't be booked
+    """
+    lock_bookings(db.session, proposals)
+    problems = check_bookings(db.session, db.metadata, proposals, chunk_size=current_app.config['BOOKING_CHECK_MAX'])
+    failed = {index: item_problems for index, item_problems in enumerate(problems) if item_problems}
+    if failed:
+        return 0, failed
+    db.session.execute(Show.__table__.insert(), [
+        {'venue_id': item.venue_id, 'artist_id': item.artist_id, 'start_time': item.start_time,
+         'end_time': item.end_time} for item in proposals])
+    for table_name, owner_key in OWNER_KEYS.items():
+        refresh_show_counters(db.session, db.metadata.tables[table_name],
+                              ids={getattr(item, owner_key) for item in proposals})
+    return len(proposals), {}
+
+def book_show_batch(proposals):
+    """
+    Books a batch of shows all or nothing in one transaction, run inline or as a background job
+    :param proposals: list of booking.Proposal
+    :return: (dict) {'created': n}, or {'created': 0, 'problems': {index: problems}} when nothing was booked
+    """
+    try:
+        created, problems = book_shows(proposals)
+        if problems:
+            db.session.rollback()
+            return {'created': 0, 'problems': {str(index): item_problems for index, item_problems in problems.items()}}
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+    invalidate_cached(*{f'venue:{item.venue_id}' for item in proposals},
+                      *{f'artist:{item.artist_id}' for item in proposals}, 'venues', 'shows')
+    return {'created': created}
+
+@main.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # Done: insert form data as a new Show record in the db, instead
@@ -673,20 +1081,17 @@ def create_show_submission():
       form_data = request.form
       venue_id = form_data['venue_id']
       artist_id = form_data['artist_id']
-      start_time = form_data['start_time']
-      artist = db.session.query(Artist).filter(Artist.id == artist_id).first()
-      # Check if artist has availability constraint
-      if artist.available_to is not None and artist.available_from is not None:
-          date_format = '%Y-%m-%d %H:%M:%S'
-          show_starts_at = datetime.strptime(start_time, date_format)
-          if not (show_starts_at >= artist.available_from and show_starts_at <= artist.available_to):
-              av_from = artist.available_from.strftime(date_format)
-              av_to = artist.available_to.strftime(date_format)
-              flash(f'Cannot book shows outside artist availability, Artist is available from {av_from} to {av_to} ')
-              raise Exception("Artist availability exception.....")
-      show = Show(venue_id = venue_id, artist_id = artist_id, start_time = start_time)
-      db.session.add(show)
+      item = proposal(venue_id, artist_id, dateutil.parser.parse(form_data['start_time']),
+                      form_data.get('duration_minutes') or None)
+      # Check the artist's availability and that neither the artist nor the venue is booked then
+      show, problems = book_show(item)
+      if problems:
+          for problem in problems:
+              flash(describe_problem(problem))
+          raise Exception("Booking conflict exception.....")
       db.session.commit()
+      # upcoming counts on /venues change along with both detail pages
+      invalidate_cached(f'venue:{venue_id}', f'artist:{artist_id}', 'venues', 'shows')
       # on successful db insert, flash success
       flash('Show was successfully listed!')
   except Exception as e:
@@ -696,28 +1101,543 @@ def create_show_submission():
       flash('An error occurred. Show could not be listed.')
   finally:
       db.session.close()
-      return redirect(url_for('index'))
+      return redirect(url_for('.index'))
 
   
 
-@app.errorhandler(404)
+#  API
+#  ----------------------------------------------------------------
+# /api/v1 serves the page data as JSON, built by the same functions as the pages. GET responses
+# carry a strong ETag and are cached in view_cache along with it, so a client polling with
+# If-None-Match gets a 304 without the payload being rebuilt or sent. ?fields=id,name keeps only
+# those keys (of each item, for lists), lists take the same cursor/ per_page/ genre args as the pages.
+
+class JSONEncoder(flask.json.JSONEncoder):
+    """
+    Encodes datetimes as ISO 8601 instead of Flask's HTTP date format
+    """
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def api_error(status, message, fields=None):
+    body = {'error': message}
+    if fields:
+        body['fields'] = fields
+    return jsonify(body), status
+
+
+def requested_fields():
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
+def select_fields(payload, fields):
+    """
+    :param payload: detail dict, or dict with a 'data' list of items
+    :param fields: keys to keep, None for all. Aborts with 400 on unknown keys
+    :return: payload with only the selected keys
+    """
+    if not fields:
+        return payload
+    items = payload['data'] if isinstance(payload.get('data'), list) else None
+    sample = (items[0] if items else {}) if items is not None else payload
+    unknown = [field for field in fields if sample and field not in sample]
+    if unknown:
+        abort(400, description=f"unknown fields: {', '.join(unknown)}")
+    if items is None:
+        return {key: value for key, value in payload.items() if key in fields}
+    selected = dict(payload)
+    selected['data'] = [{key: value for key, value in item.items() if key in fields} for item in items]
+    return selected
+
+
+def with_etag(payload):
+    """
+    :return: (payload, strong ETag of its canonical JSON)
+    """
+    body = json.dumps(payload, sort_keys=True, default=str, separators=(',', ':'))
+    return payload, hashlib.sha256(body.encode()).hexdigest()[:32]
+
+
+def api_view_data(build, tags):
+    """
+    Responds with the cached payload of an api GET, or 304 when If-None-Match has its ETag
+    :param build: callable building the payload
+    :param tags: tags to invalidate the entry with, or a callable taking the payload
+    """
+    fields = requested_fields()
+    # one entry per resource and query, the field selection is applied to the cached payload
+    key = ('api', request.path, tuple(sorted((name, value) for name, value in request.args.items(multi=True)
+                                             if name != 'fields')))
+    entry_tags = (lambda entry: tags(entry[0])) if callable(tags) else tags
+    payload, etag = cached_view_data(lambda: with_etag(build()), entry_tags, key=key)
+    if fields:
+        # every field selection is a representation of its own
+        etag = f"{etag}-{hashlib.sha256(','.join(fields).encode()).hexdigest()[:8]}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(select_fields(payload, fields))
+    response.set_etag(etag)
+    # clients may keep the response but have to revalidate it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def api_list_data(page_builder, **kwargs):
+    rows, page = page_builder(**kwargs)
+    return dict(data=rows, **page)
+
+
+@api.errorhandler(HTTPException)
+def api_http_error(error):
+  return api_error(error.code, error.description)
+
+# the app wide 404/ 500 pages are registered per code, which wins over the HTTPException handler above
+api.register_error_handler(404, api_http_error)
+api.register_error_handler(500, api_http_error)
+
+@api.route('/venues')
+def api_venues():
+  return api_view_data(lambda: api_list_data(venues_page, genre=request.args.get('genre')), tags=['venues'])
+
+@api.route('/venues/search')
+def api_search_venues():
+  return api_view_data(lambda: search_results(Venue, request.args.get('q', ''), request.args.get('city_state', ''),
+                                              genre=request.args.get('genre')), tags=['venues'])
+
+@api.route('/venues/near')
+def api_venues_near():
+  # ?location=San Francisco, CA or ?location=37.77,-122.42, &radius_km= defaults to NEARBY_RADIUS_KM
+  try:
+    latitude, longitude, radius_km = nearby_params(request.args.get('location', ''), request.args.get('radius_km'))
+  except InvalidLocation as e:
+    return api_error(400, f'Invalid location: {str(e)}')
+  return api_view_data(lambda: nearby_results(latitude, longitude, radius_km, genre=request.args.get('genre')),
+                       tags=['venues'])
+
+@api.route('/venues/<int:venue_id>')
+def api_venue(venue_id):
+  return api_view_data(lambda: venue_details(venue_id), tags=venue_detail_tags)
+
+@api.route('/venues', methods=['POST'])
+def api_create_venue():
+  # same fields and validation as the venue form, as a JSON object
+  form = VenueForm(meta={'csrf': False})
+  if not form.validate():
+    return api_error(400, 'Invalid venue', form.errors)
+  try:
+    venue = new_venue(form.data, form.genres.data)
+    db.session.add(venue)
+    db.session.commit()
+    venue_id = venue.id
+    invalidate_cached('venues')
+  except Exception as e:
+    db.session.rollback()
+    logging.error(f"Error in [api_create_venue]>>>> Reason: {str(e)}")
+    return api_error(500, 'Venue could not be created')
+  finally:
+    db.session.close()
+  response = jsonify(venue_details(venue_id))
+  response.status_code = 201
+  response.headers['Location'] = url_for('.api_venue', venue_id=venue_id, _external=True)
+  return response
+
+@api.route('/artists')
+def api_artists():
+  return api_view_data(lambda: api_list_data(artists_page, genre=request.args.get('genre')), tags=['artists'])
+
+@api.route('/artists/search')
+def api_search_artists():
+  # upcoming show counts change with the shows, which bump 'shows'
+  return api_view_data(lambda: search_results(Artist, request.args.get('q', ''), request.args.get('city_state', ''),
+                                              genre=request.args.get('genre')), tags=['artists', 'shows'])
+
+@api.route('/artists/<int:artist_id>')
+def api_artist(artist_id):
+  return api_view_data(lambda: artist_details(artist_id), tags=artist_detail_tags)
+
+@api.route('/artists', methods=['POST'])
+def api_create_artist():
+  # same fields and validation as the artist form, as a JSON object
+  form = ArtistForm(meta={'csrf': False})
+  if not form.validate():
+    return api_error(400, 'Invalid artist', form.errors)
+  try:
+    artist = new_artist(form.data, form.genres.data)
+    db.session.add(artist)
+    db.session.commit()
+    artist_id = artist.id
+    invalidate_cached('artists')
+  except ValueError as e:
+    return api_error(400, 'Invalid artist', {'available_to': [str(e)]})
+  except Exception as e:
+    db.session.rollback()
+    logging.error(f"Error in [api_create_artist]>>>> Reason: {str(e)}")
+    return api_error(500, 'Artist could not be created')
+  finally:
+    db.session.close()
+  response = jsonify(artist_details(artist_id))
+  response.status_code = 201
+  response.headers['Location'] = url_for('.api_artist', artist_id=artist_id, _external=True)
+  return response
+
+def api_edit(model, association, owner_key, row_id, listings, derived=None):
+  """
+  Partial update of a venue/ artist from a JSON object of the fields to change, e.g.
+  {"version": 3, "phone": "123-123-1234", "genres": ["Jazz"]}. Without a version the last write wins.
+  :param derived: see edits.apply_edit
+  :return: the change set, 409 with the current version when the row was edited since version
+  """
+  data = request.get_json(silent=True)
+  if not isinstance(data, dict):
+    return api_error(400, 'Expected a JSON object')
+  data = dict(data)
+  version = data.pop('version', None)
+  genres = data.pop('genres', None)
+  unknown = sorted(set(data) - set(EDITABLE_COLUMNS[model.__tablename__]))
+  if unknown:
+    return api_error(400, 'Unknown fields', {name: ['not editable'] for name in unknown})
+  if version is not None and (isinstance(version, bool) or not isinstance(version, int)):
+    return api_error(400, 'Invalid version', {'version': ['must be an integer']})
+  if genres is not None and (not isinstance(genres, list) or not all(isinstance(name, str) for name in genres)):
+    return api_error(400, 'Invalid genres', {'genres': ['must be a list of names']})
+  try:
+    changes = genre_changes(association, owner_key, row_id, genres) if genres is not None else {}
+    change_set = apply_edit(db.session, model.__table__, row_id, data, version, changes, derived)
+    if change_set is None:
+      return api_error(404, f'No {model.__name__.lower()} with id {row_id}')
+    if 'genres' in changes:
+      replace_genres(association, owner_key, row_id, genres)
+    db.session.commit()
+    tags = cache_tags(change_set, f'{model.__name__.lower()}:{row_id}', listings)
+    if tags:
+      invalidate_cached(*tags)
+  except StaleEdit as e:
+    db.session.rollback()
+    return jsonify({'error': f'{model.__name__} was edited meanwhile', 'version': e.current_version}), 409
+  except ValueError as e:
+    db.session.rollback()
+    return api_error(400, f'Invalid {model.__name__.lower()}: {str(e)}')
+  except Exception as e:
+    db.session.rollback()
+    logging.error(f"Error in [{request.endpoint}]>>>> Reason: {str(e)}")
+    return api_error(500, f'{model.__name__} could not be updated')
+  finally:
+    db.session.close()
+  return jsonify(change_set.as_dict())
+
+@api.route('/venues/<int:venue_id>', methods=['PATCH'])
+def api_edit_venue(venue_id):
+  return api_edit(Venue, venue_genres, 'venue_id', venue_id, VENUE_LISTINGS, derived=venue_coordinates)
+
+@api.route('/artists/<int:artist_id>', methods=['PATCH'])
+def api_edit_artist(artist_id):
+  return api_edit(Artist, artist_genres, 'artist_id', artist_id, ARTIST_LISTINGS)
+
+@api.route('/shows')
+def api_shows():
+  return api_view_data(lambda: api_list_data(shows_page), tags=['shows'])
+
+def proposal_from_json(data):
+    """
+    :param data: dict with venue_id, artist_id, start_time (ISO 8601) and optional duration_minutes
+    :return: booking.Proposal, raises KeyError/ TypeError/ ValueError on invalid input
+    """
+    return proposal(data['venue_id'], data['artist_id'], dateutil.parser.isoparse(data['start_time']),
+                    data.get('duration_minutes'))
+
+
+def proposals_from_json(data, limit):
+    """
+    :param data: request json, {"shows": [show objects as taken by POST /api/v1/shows]}
+    :param limit: max number of shows
+    :return: (list) booking.Proposal and None, or None and a 400 response
+    """
+    items = data.get('shows') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, api_error(400, 'Expected a non empty "shows" list')
+    if len(items) > limit:
+        return None, api_error(400, f'At most {limit} shows can be sent at once')
+    proposals = []
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            proposals.append(proposal_from_json(item))
+        except (KeyError, TypeError, ValueError) as e:
+            errors[str(index)] = str(e)
+    if errors:
+        return None, api_error(400, 'Invalid shows', errors)
+    return proposals, None
+
+
+def job_status(job):
+    """
+    :param job: job from job_queue
+    :return: (dict) its api representation
+    """
+    status = {key: job[key] for key in ('id', 'kind', 'status', 'total', 'result', 'error')}
+    for key in ('created_at', 'started_at', 'finished_at'):
+        status[key] = datetime.fromtimestamp(job[key], pytz.utc) if job[key] is not None else None
+    return status
+
+
+def booking_conflict(problems):
+    body = {'error': '; '.join(describe_problem(problem) for problem in problems), 'problems': problems}
+    return jsonify(body), 409
+
+@api.route('/shows', methods=['POST'])
+def api_create_show():
+  # {"venue_id": 1, "artist_id": 2, "start_time": "2035-01-01T20:00:00Z", "duration_minutes": 90}
+  data = request.get_json(silent=True) or {}
+  try:
+    item = proposal_from_json(data)
+  except (KeyError, TypeError, ValueError) as e:
+    return api_error(400, f'Invalid show: {str(e)}')
+  venue_id, artist_id = item.venue_id, item.artist_id
+  try:
+    show, problems = book_show(item)
+    if problems:
+      db.session.rollback()
+      # unknown ids are the client's mistake, the rest are conflicts with the current bookings
+      unknown = [problem for problem in problems if problem['type'] in ('unknown_venue', 'unknown_artist')]
+      if unknown:
+        return api_error(400, 'Unknown venue or artist')
+      return booking_conflict(problems)
+    db.session.commit()
+    body = {'id': show.id, 'venue_id': venue_id, 'artist_id': artist_id, 'start_time': show.start_time,
+            'end_time': show.end_time}
+    invalidate_cached(f'venue:{venue_id}', f'artist:{artist_id}', 'venues', 'shows')
+  except Exception as e:
+    db.session.rollback()
+    logging.error(f"Error in [api_create_show]>>>> Reason: {str(e)}")
+    return api_error(500, 'Show could not be created')
+  finally:
+    db.session.close()
+  return jsonify(body), 201
+
+@api.route('/shows/check', methods=['POST'])
+@use_replica
+def api_check_shows():
+  # {"shows": [{"venue_id": 1, "artist_id": 2, "start_time": "2035-01-01T20:00:00Z", "duration_minutes": 90}, ...]}
+  # answers whether each could be booked, against the current shows and each other, in one query
+  proposals, error = proposals_from_json(request.get_json(silent=True), current_app.config['BOOKING_CHECK_MAX'])
+  if error:
+    return error
+  try:
+    problems = check_bookings(db.session, db.metadata, proposals)
+  except Exception as e:
+    logging.error(f"Error in [api_check_shows]>>>> Reason: {str(e)}")
+    return api_error(500, 'Shows could not be checked')
+  finally:
+    db.session.close()
+  return jsonify(data=[{'venue_id': item.venue_id, 'artist_id': item.artist_id, 'start_time': item.start_time,
+                        'end_time': item.end_time, 'bookable': not item_problems, 'problems': item_problems}
+                       for item, item_problems in zip(proposals, problems)])
+
+@api.route('/shows/batch', methods=['POST'])
+def api_create_shows():
+  # {"shows": [{"venue_id": 1, "artist_id": 2, "start_time": "2035-01-01T20:00:00Z", "duration_minutes": 90}, ...]}
+  # all or nothing: 201 when every show was booked, 409 with the problems by index otherwise. Batches of
+  # more than BULK_SHOWS_SYNC_MAX shows are booked by a background job, answered 202 with its status resource
+  proposals, error = proposals_from_json(request.get_json(silent=True), current_app.config['BULK_SHOWS_MAX'])
+  if error:
+    return error
+  if len(proposals) > current_app.config['BULK_SHOWS_SYNC_MAX']:
+    job = job_queue.submit('create_shows', book_show_batch, proposals, total=len(proposals))
+    response = jsonify(job_status(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('.api_job', job_id=job['id'], _external=True)
+    return response
+  try:
+    result = book_show_batch(proposals)
+  except Exception as e:
+    logging.error(f"Error in [api_create_shows]>>>> Reason: {str(e)}")
+    return api_error(500, 'Shows could not be created')
+  return jsonify(result), 201 if result['created'] else 409
+
+@api.route('/jobs/<job_id>')
+def api_job(job_id):
+  # status of a background job, result holds what the synchronous request would have answered
+  job = job_queue.get(job_id)
+  if job is None:
+    return api_error(404, f'No job with id {job_id}')
+  response = jsonify(job_status(job))
+  response.headers['Cache-Control'] = 'no-store'
+  return response
+
+@api.route('/changes')
+@use_primary
+def api_changes():
+  # ?since=<token of the previous page> or ?updated_since=<ISO 8601>, &limit=
+  config = current_app.config
+  limit = max(1, min(request.args.get('limit', config['CHANGES_PAGE_SIZE'], type=int), config['CHANGES_PAGE_MAX']))
+  try:
+    if request.args.get('since'):
+      position = decode_token(request.args['since'])
+    elif request.args.get('updated_since'):
+      position = start_position(parse_updated_since(request.args['updated_since']))
+    else:
+      position = None
+    check_retention(position, config['CHANGES_RETENTION_DAYS'])
+    horizon = feed_horizon(db.session, config['CHANGES_SETTLE_SECONDS'])
+    changes, position, more = read_changes(db.session, db.metadata, position, limit, horizon)
+  except ExpiredToken as e:
+    # deletes may be missing after it, the consumer has to start over from an export
+    return api_error(410, str(e))
+  except ValueError as e:
+    return api_error(400, f'Invalid position: {str(e)}')
+  finally:
+    db.session.close()
+  response = jsonify(changes=changes, next=encode_token(position) if position else None, more=more)
+  response.headers['Cache-Control'] = 'no-store'
+  return response
+
+@api.route('/artists/<int:artist_id>/availability', methods=['PUT'])
+def api_replace_availability(artist_id):
+  # {"windows": [{"starts_at": "2035-01-01T00:00:00Z", "ends_at": "2035-02-01T00:00:00Z"}, ...]}
+  # replaces the artist's windows, an empty list makes it available any time
+  data = request.get_json(silent=True) or {}
+  try:
+    windows = [availability_window(dateutil.parser.isoparse(window['starts_at']),
+                                   dateutil.parser.isoparse(window['ends_at'])) for window in data['windows']]
+  except (KeyError, TypeError, ValueError) as e:
+    return api_error(400, f'Invalid availability: {str(e)}')
+  try:
+    artist = db.session.query(Artist).filter(Artist.id == artist_id).first()
+    if artist is None:
+      return api_error(404, f'No artist with id {artist_id}')
+    old_windows = [(as_utc(window.starts_at), as_utc(window.ends_at)) for window in artist.availability]
+    artist.availability = windows
+    db.session.flush()
+    new_windows = sorted((as_utc(window.starts_at), as_utc(window.ends_at)) for window in windows)
+    if new_windows != old_windows:
+      # the windows are part of the artist, its version and updated_at move with them
+      apply_edit(db.session, Artist.__table__, artist_id, {}, extra_changes={'availability': (old_windows, new_windows)})
+    db.session.commit()
+    body = [{'starts_at': window.starts_at, 'ends_at': window.ends_at} for window in artist.availability]
+    invalidate_cached(f'artist:{artist_id}')
+  except Exception as e:
+    db.session.rollback()
+    logging.error(f"Error in [api_replace_availability]>>>> Reason: {str(e)}")
+    return api_error(500, 'Availability could not be updated')
+  finally:
+    db.session.close()
+  return jsonify(data=body)
+
+
+@api.route('/export/<any(venues, artists, shows):table_name>')
+def api_export(table_name):
+  # ?format=csv|ndjson&updated_since=<ISO 8601>, streamed as it's read and gzipped for clients accepting it
+  fmt = request.args.get('format', 'ndjson')
+  if fmt not in EXPORT_FORMATS:
+    return api_error(400, f"format must be one of {', '.join(EXPORT_FORMATS)}")
+  gzip = 'gzip' in request.accept_encodings
+  try:
+    # the export holds its own connection after the view returns, a replica one for GET when there is one
+    chunks = export_chunks(db.session.get_bind(), db.metadata, table_name, fmt,
+                           parse_updated_since(request.args.get('updated_since')),
+                           current_app.config['EXPORT_BATCH_SIZE'], gzip=gzip)
+  except ValueError as e:
+    return api_error(400, f'Invalid updated_since: {str(e)}')
+  finally:
+    db.session.close()
+  response = Response(chunks, mimetype=EXPORT_FORMATS[fmt])
+  response.headers['Content-Disposition'] = f'attachment; filename={table_name}.{"csv" if fmt == "csv" else "jsonl"}'
+  response.headers['Cache-Control'] = 'no-store'
+  response.headers['Vary'] = 'Accept-Encoding'
+  if gzip:
+    response.headers['Content-Encoding'] = 'gzip'
+  return response
+
+
+@main.route('/metrics')
+def metrics():
+  # per route sql/ template instrumentation, the view data/ output cache counters, pool saturation/
+  # checkout wait, the primary/ replica routing counts and the background jobs of this process
+  return {'routes': request_metrics.snapshot(), 'cache': view_cache.stats(), 'output_cache': output_cache.stats(),
+          'pool': pool_status(db.engine), 'replica': replica_router.stats(), 'jobs': job_queue.stats()}
+
+@main.route('/metrics/pool')
+def pool_metrics():
+  # checkout wait and saturation of the db connection pool, used to size DB_POOL_SIZE/ DB_MAX_OVERFLOW
+  return pool_status(db.engine)
+
+@main.route('/metrics/cache')
+def cache_metrics():
+  # hit/ miss counters of the view data cache, used to size VIEW_CACHE_SIZE/ VIEW_CACHE_TTL
+  return view_cache.stats()
+
+@main.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@main.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+#----------------------------------------------------------------------------#
+# App factory.
+#----------------------------------------------------------------------------#
+
+def create_app(config_object='config'):
+    """
+    Builds and configures an app, no db round trips happen here. Caches, counters and the job store are
+    created per app, so it can be called again, e.g. for an app with another config
+    :param config_object: import name or object for app.config.from_object
+    :return: Flask app
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    app.json_encoder = JSONEncoder
+    # pool sizing, pgbouncer mode and timeouts from the DB_* settings
+    init_engine_config(app)
+    moment.init_app(app)
+    db.init_app(app)
+    migrate.init_app(app, db)
+    # each registers itself in app.extensions
+    ReplicaRouter(db, app=app)
+    ViewCache(app=app)
+    OutputCache(app=app)
+    RequestMetrics(app=app)
+    JobQueue(app=app)
+    # bulk import/ synthetic data: flask seed --help
+    app.cli.add_command(seed_cli)
+    # stream venues/ artists/ shows out as CSV or JSON Lines: flask export --help
+    app.cli.add_command(export_cli)
+    # drop the tombstones the change feed no longer serves, run on a schedule: flask changes prune
+    app.cli.add_command(changes_cli)
+    # geocode the venues without coordinates from their city: flask geo geocode
+    app.cli.add_command(geo_cli)
+    # create the database/ schema or migrate it: flask bootstrap
+    app.cli.add_command(bootstrap_command)
+    # roll started shows into the past counters, run on a schedule: flask show-counters refresh
+    app.cli.add_command(show_counters_cli)
+    # create the coming shows partitions on a schedule, archive old ones: flask shows-partitions --help
+    app.cli.add_command(shows_partitions_cli)
+    app.register_blueprint(main)
+    app.register_blueprint(api)
+
+    if not app.debug:
+        file_handler = FileHandler('error.log')
+        file_handler.setFormatter(
+            Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+        )
+        app.logger.setLevel(logging.INFO)
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+        app.logger.info('errors')
+    return app
+
+
+# module level app for `flask run`/ `python app.py`/ gunicorn app:app
+app = create_app()
 
 #----------------------------------------------------------------------------#
 # Launch.
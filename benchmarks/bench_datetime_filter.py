@@ -0,0 +1,72 @@
+"""
+Per tile cost of the `datetime` template filter, the old string round trip (str() in the view,
+dateutil parse and an uncached babel call in the filter) against the cached formatter fed
+datetime objects. Also renders /shows sized tile lists through the real template.
+
+Needs no database. Run from the project root: python -m benchmarks.bench_datetime_filter
+"""
+import argparse
+import timeit
+from datetime import datetime, timedelta
+
+import pytz
+from flask import render_template
+
+from app import app, format_datetime, output_cache
+
+
+def legacy_format_datetime(value, format='medium'):
+    # the filter as it was, kept here as the baseline
+    from babel.dates import format_datetime
+    import dateutil.parser
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return format_datetime(date, 'medium', locale='en_US')
+
+
+def tiles(count):
+    start = datetime(2035, 1, 1, 20, tzinfo=pytz.utc)
+    return [{'venue_id': 1, 'venue_name': 'Venue', 'artist_id': 1, 'artist_name': 'Artist',
+             'artist_image_link': '', 'start_time': start + timedelta(hours=i)} for i in range(count)]
+
+
+def per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='datetime filter cost per show tile')
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--tiles', default='100,1000,5000', help='comma separated tile counts to render')
+    args = parser.parse_args(argv)
+
+    value = datetime(2035, 1, 1, 20, tzinfo=pytz.utc)
+    with app.test_request_context('/shows'):
+        legacy = per_call_us(lambda: legacy_format_datetime(str(value), 'full'), args.calls)
+        cached = per_call_us(lambda: format_datetime(value, 'full'), args.calls)
+        print(f"{'filter':<28} {'us/tile':>10}")
+        print(f"{'str + parse + babel (old)':<28} {legacy:>10.1f}")
+        print(f"{'cached formatter (new)':<28} {cached:>10.1f}")
+        print(f'speedup {legacy / cached:.1f}x\n')
+
+        print(f"{'tiles':>8} {'render ms (old)':>16} {'render ms (new)':>16}")
+        for count in [int(count) for count in args.tiles.split(',')]:
+            shows = tiles(count)
+            legacy_shows = [dict(show, start_time=str(show['start_time'])) for show in shows]
+            page = {'next_cursor': None, 'prev_cursor': None}
+            filters = app.jinja_env.filters
+            # the show tiles are cached fragments, every repetition renders them from scratch
+            filters['datetime'] = legacy_format_datetime
+            old_ms = min(timeit.repeat(lambda: render_template('pages/shows.html', shows=legacy_shows, page=page),
+                                       setup=output_cache.fragments.clear, number=1, repeat=3)) * 1000
+            filters['datetime'] = format_datetime
+            new_ms = min(timeit.repeat(lambda: render_template('pages/shows.html', shows=shows, page=page),
+                                       setup=output_cache.fragments.clear, number=1, repeat=3)) * 1000
+            print(f'{count:>8} {old_ms:>16.1f} {new_ms:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
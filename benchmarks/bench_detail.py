@@ -0,0 +1,25 @@
+"""
+Query count and latency of the venue/ artist detail pages as a single artist's show count grows.
+
+Run from the project root: python -m benchmarks.bench_detail
+"""
+from benchmarks.common import app, db, seeded, time_request, Artist, Venue, BENCH_PREFIX
+
+SHOWS_PER_ARTIST = [10, 100, 1000]
+
+
+def main():
+    client = app.test_client()
+    print(f"{'shows':>8} {'page':>8} {'queries':>8} {'ms':>10}")
+    for num_shows in SHOWS_PER_ARTIST:
+        # one artist and one venue so every show lands on the same detail pages
+        with seeded(1, 1, num_shows):
+            artist_id = db.session.query(Artist.id).filter(Artist.name.like(f'{BENCH_PREFIX}%')).scalar()
+            venue_id = db.session.query(Venue.id).filter(Venue.name.like(f'{BENCH_PREFIX}%')).scalar()
+            for page, url in [('artist', f'/artists/{artist_id}'), ('venue', f'/venues/{venue_id}')]:
+                latency, queries = time_request(client, 'GET', url)
+                print(f'{num_shows:>8} {page:>8} {queries:>8} {latency:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
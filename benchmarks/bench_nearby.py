@@ -0,0 +1,35 @@
+"""
+"Venues near" search latency with the earthdistance GiST index against the bounding box fallback on a
+100k row venues table.
+
+Run from the project root after migrating: python -m benchmarks.bench_nearby
+"""
+from benchmarks.bench_search import timed
+from benchmarks.common import db, seeded, BENCH_ORIGIN, Venue
+from geo import earthdistance_available, nearby_query
+
+NUM_VENUES = 100000
+# the bench venues are 0.01 degrees apart, about 1 km
+RADII_KM = [1, 5, 25, 100]
+
+
+def main():
+    paths = [('bbox', False)]
+    if earthdistance_available(db.session):
+        paths.append(('earth', True))
+    else:
+        print('earthdistance is not installed, only the bounding box path is measured')
+    latitude, longitude = BENCH_ORIGIN[0] + 1, BENCH_ORIGIN[1] + 1
+    with seeded(NUM_VENUES, 1, 0):
+        db.session.execute('ANALYZE venues')
+        print(f"{'path':>8} {'radius km':>10} {'rows':>6} {'ms':>10}")
+        for radius_km in RADII_KM:
+            for name, use_earthdistance in paths:
+                query = nearby_query(db.session, Venue, latitude, longitude, radius_km,
+                                     use_earthdistance=use_earthdistance)
+                latency, rows = timed(query)
+                print(f'{name:>8} {radius_km:>10} {rows:>6} {latency:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
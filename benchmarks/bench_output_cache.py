@@ -0,0 +1,81 @@
+"""
+Latency of the cached pages with nothing cached, with only their view data cached and served
+from the output cache, then a burst of concurrent requests right after a write bumped the page's
+data version: with stale-while-revalidate it must cost one render and one round of queries.
+
+Run from the project root: python -m benchmarks.bench_output_cache --clients 16
+"""
+import argparse
+import threading
+import time
+
+from benchmarks.common import app, db, seeded, time_request, view_cache, output_cache, QueryCounter
+from app import invalidate_cached
+
+URLS = ['/', '/venues', '/artists', '/shows']
+
+
+def burst(url, clients):
+    """
+    :return: (statements issued, renders, slowest response ms) for clients concurrent requests
+    """
+    renders = output_cache.stats()['renders']
+    latencies = []
+    barrier = threading.Barrier(clients)
+
+    def request():
+        client = app.test_client()
+        barrier.wait()
+        started = time.perf_counter()
+        response = client.get(url)
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, f'GET {url} failed with {response.status_code}'
+
+    threads = [threading.Thread(target=request) for _ in range(clients)]
+    with QueryCounter(db.engine) as counter:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return counter.count, output_cache.stats()['renders'] - renders, max(latencies)
+
+
+def _timed(func):
+    started = time.perf_counter()
+    func()
+    return (time.perf_counter() - started) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='output cache hit latency and stampede protection')
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=10000)
+    parser.add_argument('--clients', type=int, default=16)
+    args = parser.parse_args(argv)
+
+    client = app.test_client()
+    with seeded(args.venues, args.venues, args.shows):
+        print(f"{'url':<10} {'cold ms':>9} {'data hit ms':>12} {'page hit ms':>12}")
+        for url in URLS:
+            cold, _ = time_request(client, 'GET', url)
+            output_cache.clear()
+            client.get(url)
+            data_hit = min(_timed(lambda: (output_cache.clear(), client.get(url))) for _ in range(5))
+            client.get(url)
+            page_hit, _ = time_request(client, 'GET', url, cold=False)
+            print(f'{url:<10} {cold:>9.1f} {data_hit:>12.1f} {page_hit:>12.2f}')
+
+        print(f"\n{'after write to':<16} {'clients':>8} {'queries':>8} {'renders':>8} {'slowest ms':>11}")
+        for url, tag in [('/venues', 'venues'), ('/shows', 'shows')]:
+            client.get(url)
+            invalidate_cached(tag)
+            queries, renders, slowest = burst(url, args.clients)
+            print(f'{url:<16} {args.clients:>8} {queries:>8} {renders:>8} {slowest:>11.1f}')
+        view_cache.clear()
+        output_cache.clear()
+        queries, renders, slowest = burst('/shows', args.clients)
+        print(f"{'/shows (cold)':<16} {args.clients:>8} {queries:>8} {renders:>8} {slowest:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
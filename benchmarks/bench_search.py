@@ -0,0 +1,42 @@
+"""
+Venue search latency with pg_trgm ranking against the LIKE fallback on a 1M row venues table.
+
+Run from the project root after migrating: python -m benchmarks.bench_search
+"""
+import time
+
+from benchmarks.common import db, seeded, Venue
+from search import search_query, trigram_available
+
+NUM_VENUES = 1000000
+TERMS = [('venue-12345', ''), ('nue-99', ''), ('', 'city-7, CA')]
+
+
+def timed(query, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = query.all()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(rows)
+
+
+def main():
+    paths = [('like', False)]
+    if trigram_available(db.session):
+        paths.append(('trigram', True))
+    else:
+        print('pg_trgm is not installed, only the LIKE path is measured')
+    with seeded(NUM_VENUES, 1, 0):
+        db.session.execute('ANALYZE venues')
+        print(f"{'path':>8} {'term':>16} {'rows':>6} {'ms':>10}")
+        for search_term, city_state_text in TERMS:
+            for name, use_trigram in paths:
+                query = search_query(db.session, Venue, search_term, city_state_text, use_trigram=use_trigram)
+                latency, rows = timed(query)
+                print(f'{name:>8} {search_term or city_state_text:>16} {rows:>6} {latency:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
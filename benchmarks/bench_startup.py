@@ -0,0 +1,72 @@
+"""
+Cold start cost of a worker: time to import app.py and latency of its first request, each
+measured in a fresh interpreter. Also counts db connections and statements made during the
+import, which must be zero (schema setup is `flask bootstrap`'s job). Exits non zero otherwise.
+
+Run from the project root: python -m benchmarks.bench_startup --runs 5 --url /venues
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in a fresh interpreter per sample, prints one json line
+PROBE = '''
+import json, sys, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+counts = {'connects': 0, 'statements': 0}
+event.listen(Pool, 'connect', lambda *args: counts.__setitem__('connects', counts['connects'] + 1))
+event.listen(Engine, 'before_cursor_execute', lambda *args: counts.__setitem__('statements', counts['statements'] + 1))
+
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+import_counts = dict(counts)
+response = app.app.test_client().get(sys.argv[1])
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (finished - imported) * 1000,
+    'status': response.status_code,
+    'import_connects': import_counts['connects'],
+    'import_statements': import_counts['statements'],
+    'request_statements': counts['statements'] - import_counts['statements'],
+}))
+'''
+
+
+def sample(url):
+    output = subprocess.check_output([sys.executable, '-c', PROBE, url], cwd=ROOT)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import time and first request latency of a fresh worker.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--url', default='/', help='url of the first request')
+    args = parser.parse_args(argv)
+
+    samples = [sample(args.url) for _ in range(args.runs)]
+    print(f"{'run':>4} {'import ms':>10} {'first req ms':>13} {'status':>7} {'import conns':>13} "
+          f"{'import sql':>11} {'req sql':>8}")
+    for run, result in enumerate(samples, 1):
+        print(f"{run:>4} {result['import_ms']:>10.1f} {result['first_request_ms']:>13.1f} {result['status']:>7} "
+              f"{result['import_connects']:>13} {result['import_statements']:>11} {result['request_statements']:>8}")
+    print(f"{'p50':>4} {statistics.median(r['import_ms'] for r in samples):>10.1f} "
+          f"{statistics.median(r['first_request_ms'] for r in samples):>13.1f}")
+    round_trips = sum(r['import_connects'] + r['import_statements'] for r in samples)
+    if round_trips:
+        print('importing app.py made db round trips')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,21 @@
+"""
+Query count and latency of the /venues listing as the venues and shows tables grow.
+
+Run from the project root: python -m benchmarks.bench_venues
+"""
+from benchmarks.common import app, seeded, time_request
+
+TIERS = [(100, 1000), (1000, 10000), (5000, 100000)]
+
+
+def main():
+    client = app.test_client()
+    print(f"{'venues':>8} {'shows':>8} {'queries':>8} {'ms':>10}")
+    for num_venues, num_shows in TIERS:
+        with seeded(num_venues, num_venues, num_shows):
+            latency, queries = time_request(client, 'GET', '/venues')
+        print(f'{num_venues:>8} {num_shows:>8} {queries:>8} {latency:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
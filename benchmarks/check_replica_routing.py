@@ -0,0 +1,84 @@
+"""
+Checks the primary/ replica routing of routing.py against two SQLite files standing in for the
+primary and the replica. Each holds a different venue, so every response shows which db it read.
+Exits non zero when a request was routed to the wrong side.
+
+Run from the project root: python -m benchmarks.check_replica_routing
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import config
+from app import create_app, db, Venue
+
+# sqlite has no replication, a negative max lag makes any replica count as lagging
+FORCE_LAG = -1
+
+
+def make_app(directory, **overrides):
+    settings = {key: getattr(config, key) for key in dir(config) if key.isupper()}
+    settings.update({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'primary.db')}",
+        'SQLALCHEMY_BINDS': {'replica': f"sqlite:///{os.path.join(directory, 'replica.db')}"},
+        'VIEW_CACHE_TTL': 0,
+        'OUTPUT_CACHE_TTL': 0,
+        'WTF_CSRF_ENABLED': False,
+    })
+    settings.update(overrides)
+    return create_app(type('ReplicaCheckConfig', (), settings))
+
+
+def create_schemas(app):
+    with app.app_context():
+        for bind in (None, 'replica'):
+            engine = db.get_engine(app, bind=bind)
+            db.Model.metadata.create_all(bind=engine)
+            with engine.begin() as connection:
+                connection.execute(Venue.__table__.insert(), {
+                    'id': 1, 'name': f"{bind or 'primary'}-venue", 'city': 'San Francisco', 'state': 'CA',
+                    'created_at': datetime(2020, 1, 1)})
+
+
+def read_from(response):
+    body = response.get_data(as_text=True)
+    sides = [side for side in ('primary', 'replica') if f'{side}-venue' in body]
+    return sides[0] if len(sides) == 1 else f'unknown ({response.status_code})'
+
+
+def main():
+    failures = []
+
+    def check(name, response, expected):
+        actual = read_from(response)
+        print(f"{'ok' if actual == expected else 'FAIL':>6}  {name:<40} read from {actual}")
+        if actual != expected:
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = make_app(directory)
+        create_schemas(app)
+        client = app.test_client()
+        check('GET /venues', client.get('/venues'), 'replica')
+        check('POST /venues/search (use_replica)', client.post('/venues/search', data={'search_term': 'venue'}),
+              'replica')
+        check('GET /venues/1/edit (use_primary)', client.get('/venues/1/edit'), 'primary')
+        client.post('/venues/create', data={
+            'name': 'new venue', 'city': 'Oakland', 'state': 'CA', 'address': '1 Main St', 'phone': '555-555-5555',
+            'genres': ['Jazz'], 'image_link': '', 'seeking_description': '',
+            'facebook_link': 'https://www.facebook.com/venue'})
+        check('GET /venues after own write (sticky)', client.get('/venues'), 'primary')
+        check('GET /venues from another client', app.test_client().get('/venues'), 'replica')
+
+        lagging = make_app(directory, REPLICA_MAX_LAG_SECONDS=FORCE_LAG)
+        check('GET /venues with a lagging replica', lagging.test_client().get('/venues'), 'primary')
+        with app.app_context():
+            db.session.remove()
+            for bind in (None, 'replica'):
+                db.get_engine(app, bind=bind).dispose()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
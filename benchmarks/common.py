@@ -0,0 +1,115 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks seed rows tagged with BENCH_PREFIX into the configured database and remove them again
+when they are done, so point config.py at a disposable database before running them.
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import event
+
+from app import app, db, view_cache, output_cache, Venue, Artist, Show
+from seed import load_entities, load_shows
+
+BENCH_PREFIX = 'bench-'
+# south west corner of the bench venues
+BENCH_ORIGIN = (37.0, -123.0)
+
+# the scripts query through db.session outside of requests, which needs an app context
+app.app_context().push()
+
+
+class QueryCounter:
+    """
+    Counts the statements sent to the db engine while active
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def seed(num_venues, num_artists, num_shows, areas=50, batch_size=10000):
+    """
+    Bulk loads bench rows through the flask seed loaders, half of the shows are in the past and half upcoming
+    :param num_venues: venues to create
+    :param num_artists: artists to create
+    :param num_shows: shows to create, spread round robin over venues and artists
+    :param areas: number of distinct (state, city) areas for the venues
+    :param batch_size: rows per insert batch
+    """
+    now = datetime.now(pytz.utc)
+    venue_ids = {}
+    artist_ids = {}
+    with app.app_context():
+        # venues on a grid of 0.01 degrees north east of BENCH_ORIGIN
+        load_entities('venues', ({'name': f'{BENCH_PREFIX}venue-{i}', 'city': f'city-{i % areas}', 'state': 'CA',
+                                  'latitude': BENCH_ORIGIN[0] + i % 200 * 0.01,
+                                  'longitude': BENCH_ORIGIN[1] + i // 200 % 200 * 0.01}
+                                 for i in range(num_venues)), batch_size, name_ids=venue_ids)
+        load_entities('artists', ({'name': f'{BENCH_PREFIX}artist-{i}', 'city': f'city-{i % areas}', 'state': 'CA'}
+                                  for i in range(num_artists)), batch_size, name_ids=artist_ids)
+        if not num_shows:
+            return
+        venue_id_list = list(venue_ids.values())
+        artist_id_list = list(artist_ids.values())
+        load_shows(({'venue_id': venue_id_list[i % len(venue_id_list)],
+                     'artist_id': artist_id_list[i % len(artist_id_list)],
+                     'start_time': now + timedelta(days=(i % 365) - 182)} for i in range(num_shows)),
+                   batch_size, venue_ids=venue_ids, artist_ids=artist_ids)
+
+
+def cleanup():
+    """
+    Removes every bench row, shows go with their venues/artists
+    """
+    db.session.query(Show).filter(Show.venue_id.in_(
+        db.session.query(Venue.id).filter(Venue.name.like(f'{BENCH_PREFIX}%')))).delete(synchronize_session=False)
+    db.session.query(Show).filter(Show.artist_id.in_(
+        db.session.query(Artist.id).filter(Artist.name.like(f'{BENCH_PREFIX}%')))).delete(synchronize_session=False)
+    db.session.query(Venue).filter(Venue.name.like(f'{BENCH_PREFIX}%')).delete(synchronize_session=False)
+    db.session.query(Artist).filter(Artist.name.like(f'{BENCH_PREFIX}%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+@contextmanager
+def seeded(num_venues, num_artists, num_shows):
+    seed(num_venues, num_artists, num_shows)
+    try:
+        yield
+    finally:
+        cleanup()
+
+
+def time_request(client, method, url, repeat=5, cold=True, **kwargs):
+    """
+    Issues the request repeat times
+    :param cold: empty the view data and output caches before each request so the db work is measured
+    :return: (best latency in ms, statements issued by the last request)
+    """
+    best = None
+    counter = QueryCounter(db.engine)
+    for _ in range(repeat):
+        if cold:
+            view_cache.clear()
+            output_cache.clear()
+        with counter:
+            started = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            elapsed = (time.perf_counter() - started) * 1000
+        assert response.status_code < 500, f'{method} {url} failed with {response.status_code}'
+        best = elapsed if best is None else min(best, elapsed)
+    return best, counter.count
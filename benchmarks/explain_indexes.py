@@ -0,0 +1,73 @@
+"""
+Runs EXPLAIN on every hot query and checks the planner picks the index declared for it.
+Exits non zero when a query is not backed by its index.
+
+Run from the project root: python -m benchmarks.explain_indexes
+"""
+import sys
+from datetime import datetime
+
+import pytz
+
+from benchmarks.common import db, seeded, BENCH_ORIGIN, Venue, Artist, Show
+from app import get_venues_with_upcoming_count
+from geo import earthdistance_available, nearby_query
+
+
+def explain(query):
+    """
+    :param query: ORM query
+    :return: (str) the plan as reported by the db
+    """
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    if compiled.positional:
+        params = [compiled.params[name] for name in compiled.positiontup]
+    else:
+        params = compiled.params
+    connection = db.session.connection()
+    if db.engine.dialect.name == 'postgresql':
+        # with bench sized tables the planner may still prefer a seq scan, only check the index is usable
+        connection.execute('SET LOCAL enable_seqscan = off')
+        prefix = 'EXPLAIN '
+    else:
+        prefix = 'EXPLAIN QUERY PLAN '
+    rows = connection.execute(prefix + str(compiled), params).fetchall()
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+def hot_queries():
+    now = datetime.now(pytz.utc)
+    return [
+        ('index: recent venues', 'ix_venues_created_at_id',
+         db.session.query(Venue).order_by(Venue.created_at.desc(), Venue.id.desc()).limit(10)),
+        ('index: recent artists', 'ix_artists_created_at_id',
+         db.session.query(Artist).order_by(Artist.created_at.desc(), Artist.id.desc()).limit(10)),
+        ('show_venue: upcoming shows', 'ix_shows_venue_id_start_time',
+         db.session.query(Show).filter(Show.venue_id == 1, Show.start_time > now)),
+        ('show_artist: upcoming shows', 'ix_shows_artist_id_start_time',
+         db.session.query(Show).filter(Show.artist_id == 1, Show.start_time > now)),
+        ('venues: area listing', 'ix_venues_state_city_id',
+         get_venues_with_upcoming_count(now).order_by(Venue.state, Venue.city, Venue.id).limit(50)),
+        ('search_venues: near', 'ix_venues_earth' if earthdistance_available(db.session) else
+         'ix_venues_latitude_longitude',
+         nearby_query(db.session, Venue, BENCH_ORIGIN[0] + 0.1, BENCH_ORIGIN[1] + 0.1, 5)),
+    ]
+
+
+def main():
+    missing = []
+    with seeded(2000, 2000, 20000):
+        db.session.execute('ANALYZE')
+        for name, index, query in hot_queries():
+            plan = explain(query)
+            used = index in plan
+            print(f"{'ok' if used else 'MISSING':>8}  {name:<30} {index}")
+            if not used:
+                print(plan)
+                missing.append(name)
+        db.session.rollback()
+    return 1 if missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Benchmark suite driving every route of the app through the Flask test client at several data scale tiers.
+
+For each tier and route it records p50/p95/p99 latency, SQL statements per request and the peak RSS
+of the process, and writes the run as JSON so runs can be compared:
+
+    python -m benchmarks.suite --tiers 1k,100k --requests 50
+    python -m benchmarks.suite --tiers 1k --compare benchmarks/results/<earlier run>.json
+
+Point config.py at a disposable database first, see benchmarks/common.py.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from app import job_queue
+from benchmarks.common import (app, db, view_cache, output_cache, seeded, QueryCounter, BENCH_PREFIX, BENCH_ORIGIN,
+                               Venue, Artist)
+from seed import load_entities
+
+# tier name -> (venues, artists, shows)
+TIERS = {
+    '1k': (100, 100, 1000),
+    '100k': (2000, 2000, 100000),
+    '1m': (10000, 10000, 1000000),
+}
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def venue_form(name):
+    return {'name': name, 'city': 'city-1', 'state': 'CA', 'address': '1 Bench St', 'phone': '555-555-5555',
+            'genres': ['Jazz', 'Blues'], 'image_link': '', 'seeking_description': '',
+            'facebook_link': 'https://www.facebook.com/bench'}
+
+
+def artist_form(name):
+    return {'name': name, 'city': 'city-1', 'state': 'CA', 'phone': '555-555-5555', 'genres': ['Jazz'],
+            'image_link': '', 'seeking_description': '', 'facebook_link': 'https://www.facebook.com/bench',
+            'available_from': '', 'available_to': ''}
+
+
+def scenarios(context):
+    """
+    One request factory per endpoint, each call returns (method, url, client kwargs)
+    :param context: ids picked from the seeded tier
+    """
+    venue_id = context['venue_id']
+    artist_id = context['artist_id']
+    # the middle of the bench venues grid
+    near = f'{BENCH_ORIGIN[0] + 1},{BENCH_ORIGIN[1] + 0.05}'
+    counter = iter(range(sys.maxsize))
+
+    def show_start():
+        # a new slot per booking, a taken one would only exercise the conflict path
+        return datetime(2035, 1, 1, 20) + timedelta(days=next(counter))
+
+    return {
+        'index': lambda: ('GET', '/', {}),
+        'venues': lambda: ('GET', '/venues', {}),
+        'search_venues': lambda: ('POST', '/venues/search', {'data': {'search_term': 'venue-1'}}),
+        'search_venues_near': lambda: ('POST', '/venues/search', {'data': {'location': near, 'radius_km': '25'}}),
+        'show_venue': lambda: ('GET', f'/venues/{venue_id}', {}),
+        'create_venue_form': lambda: ('GET', '/venues/create', {}),
+        'create_venue_submission': lambda: ('POST', '/venues/create',
+                                            {'data': venue_form(f'{BENCH_PREFIX}new-venue-{next(counter)}')}),
+        'delete_venue': lambda: ('DELETE', f"/venues/{context['spare_venue_ids'].pop()}", {}),
+        'artists': lambda: ('GET', '/artists', {}),
+        'search_artists': lambda: ('POST', '/artists/search', {'data': {'search_term': 'artist-1'}}),
+        'show_artist': lambda: ('GET', f'/artists/{artist_id}', {}),
+        'edit_artist': lambda: ('GET', f'/artists/{artist_id}/edit', {}),
+        'edit_artist_submission': lambda: ('POST', f'/artists/{artist_id}/edit',
+                                           {'data': artist_form(f'{BENCH_PREFIX}artist-edited-{next(counter)}')}),
+        'edit_venue': lambda: ('GET', f'/venues/{venue_id}/edit', {}),
+        'edit_venue_submission': lambda: ('POST', f'/venues/{venue_id}/edit',
+                                          {'data': venue_form(f'{BENCH_PREFIX}venue-edited-{next(counter)}')}),
+        'create_artist_form': lambda: ('GET', '/artists/create', {}),
+        'create_artist_submission': lambda: ('POST', '/artists/create',
+                                             {'data': artist_form(f'{BENCH_PREFIX}new-artist-{next(counter)}')}),
+        'shows': lambda: ('GET', '/shows', {}),
+        'create_shows': lambda: ('GET', '/shows/create', {}),
+        'create_show_submission': lambda: ('POST', '/shows/create', {'data': {
+            'venue_id': venue_id, 'artist_id': artist_id, 'start_time': f'{show_start():%Y-%m-%d %H:%M:%S}'}}),
+        'api_venues': lambda: ('GET', '/api/v1/venues', {}),
+        'api_search_venues': lambda: ('GET', '/api/v1/venues/search?q=venue-1', {}),
+        'api_venues_near': lambda: ('GET', f'/api/v1/venues/near?location={near}&radius_km=25', {}),
+        'api_venue': lambda: ('GET', f'/api/v1/venues/{venue_id}', {}),
+        'api_create_venue': lambda: ('POST', '/api/v1/venues',
+                                     {'json': venue_form(f'{BENCH_PREFIX}api-venue-{next(counter)}')}),
+        'api_artists': lambda: ('GET', '/api/v1/artists', {}),
+        'api_search_artists': lambda: ('GET', '/api/v1/artists/search?q=artist-1', {}),
+        'api_artist': lambda: ('GET', f'/api/v1/artists/{artist_id}?fields=id,name,upcoming_shows', {}),
+        'api_create_artist': lambda: ('POST', '/api/v1/artists',
+                                      {'json': artist_form(f'{BENCH_PREFIX}api-artist-{next(counter)}')}),
+        'api_shows': lambda: ('GET', '/api/v1/shows', {}),
+        'api_create_show': lambda: ('POST', '/api/v1/shows', {'json': {
+            'venue_id': venue_id, 'artist_id': artist_id, 'start_time': f'{show_start():%Y-%m-%dT%H:%M:%S}Z'}}),
+        'api_check_shows': lambda: ('POST', '/api/v1/shows/check', {'json': {'shows': [
+            {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': f'2035-06-{day:02d}T20:00:00Z',
+             'duration_minutes': 90} for day in range(1, 21)]}}),
+        # a tour of 20 dates, under BULK_SHOWS_SYNC_MAX so it's booked within the request
+        'api_create_shows': lambda: ('POST', '/api/v1/shows/batch', {'json': {'shows': [
+            {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': f'{show_start():%Y-%m-%dT%H:%M:%S}Z'}
+            for _ in range(20)]}}),
+        'api_job': lambda: ('GET', f"/api/v1/jobs/{context['job_id']}", {}),
+        # wide enough not to turn the booking scenarios into conflicts
+        'api_replace_availability': lambda: ('PUT', f'/api/v1/artists/{artist_id}/availability', {'json': {'windows': [
+            {'starts_at': '2000-01-01T00:00:00Z', 'ends_at': '2100-01-01T00:00:00Z'}]}}),
+        # a new name per request, resubmitting the same values writes nothing
+        'api_edit_venue': lambda: ('PATCH', f'/api/v1/venues/{venue_id}', {'json': {
+            'name': f'{BENCH_PREFIX}api-venue-edited-{next(counter)}'}}),
+        'api_edit_artist': lambda: ('PATCH', f'/api/v1/artists/{artist_id}', {'json': {
+            'name': f'{BENCH_PREFIX}api-artist-edited-{next(counter)}', 'seeking_venue': True}}),
+        'api_export': lambda: ('GET', '/api/v1/export/shows?format=csv', {'headers': {'Accept-Encoding': 'gzip'}}),
+        'api_changes': lambda: ('GET', '/api/v1/changes?limit=500', {}),
+        'metrics': lambda: ('GET', '/metrics', {}),
+        'pool_metrics': lambda: ('GET', '/metrics/pool', {}),
+        'cache_metrics': lambda: ('GET', '/metrics/cache', {}),
+    }
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest rank percentile of an ascending list
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_route(client, factory, num_requests, warm):
+    latencies = []
+    statements = []
+    counter = QueryCounter(db.engine)
+    for _ in range(num_requests):
+        method, url, kwargs = factory()
+        if not warm:
+            view_cache.clear()
+            output_cache.clear()
+        with counter:
+            started = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            # streamed responses are only produced as they're read
+            response.get_data()
+            latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 500:
+            raise RuntimeError(f'{method} {url} failed with {response.status_code}')
+        statements.append(counter.count)
+    latencies.sort()
+    statements.sort()
+    return {
+        'requests': num_requests,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'statements_p50': percentile(statements, 50),
+        'statements_max': statements[-1],
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_tier(tier, num_requests, warm):
+    num_venues, num_artists, num_shows = TIERS[tier]
+    results = {}
+    with seeded(num_venues, num_artists, num_shows):
+        spare = {}
+        with app.app_context():
+            # venues for delete_venue to remove, one per request
+            load_entities('venues', ({'name': f'{BENCH_PREFIX}spare-{i}', 'city': 'spare', 'state': 'CA'}
+                                     for i in range(num_requests)), num_requests or 1, name_ids=spare)
+        context = {
+            'venue_id': db.session.query(Venue.id).filter(Venue.name == f'{BENCH_PREFIX}venue-0').scalar(),
+            'artist_id': db.session.query(Artist.id).filter(Artist.name == f'{BENCH_PREFIX}artist-0').scalar(),
+            'spare_venue_ids': list(spare.values()),
+        }
+        with app.app_context():
+            # a finished no-op job for api_job to report on
+            context['job_id'] = job_queue.submit('bench', dict)['id']
+        db.session.close()
+        routes = scenarios(context)
+        # scenarios are keyed by view name, endpoints carry the blueprint prefix
+        endpoints = {endpoint.rpartition('.')[2] for endpoint in app.view_functions}
+        missing = sorted(endpoints - set(routes) - {'static'})
+        if missing:
+            print(f'warning: no benchmark scenario for {", ".join(missing)}')
+        client = app.test_client()
+        for endpoint, factory in routes.items():
+            results[endpoint] = run_route(client, factory, num_requests, warm)
+            stats = results[endpoint]
+            print(f"{tier:>5} {endpoint:<26} p50 {stats['p50_ms']:8.1f}ms  p95 {stats['p95_ms']:8.1f}ms  "
+                  f"p99 {stats['p99_ms']:8.1f}ms  sql {stats['statements_p50']:>4}  rss {stats['peak_rss_mb']:7.1f}MB")
+    return {'venues': num_venues, 'artists': num_artists, 'shows': num_shows, 'routes': results}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    """
+    Prints the p95 and statement count change of every (tier, route) present in both runs
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\ncompared with {baseline_path} ({baseline.get('revision')})")
+    for tier, tier_results in current['tiers'].items():
+        base_routes = baseline['tiers'].get(tier, {}).get('routes', {})
+        for endpoint, stats in tier_results['routes'].items():
+            base = base_routes.get(endpoint)
+            if base is None:
+                continue
+            change = (stats['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0.0
+            print(f"{tier:>5} {endpoint:<26} p95 {base['p95_ms']:8.1f} -> {stats['p95_ms']:8.1f}ms ({change:+.0f}%)  "
+                  f"sql {base['statements_p50']} -> {stats['statements_p50']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tiers', default='1k', help=f"comma separated, from {', '.join(TIERS)}")
+    parser.add_argument('--requests', type=int, default=30, help='requests per route and tier')
+    parser.add_argument('--warm', action='store_true', help='keep the view data and output caches between requests')
+    parser.add_argument('--output', help='result file, defaults to benchmarks/results/<timestamp>.json')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    args = parser.parse_args(argv)
+
+    tiers = [tier.strip() for tier in args.tiers.split(',') if tier.strip()]
+    unknown = [tier for tier in tiers if tier not in TIERS]
+    if unknown:
+        parser.error(f"unknown tiers: {', '.join(unknown)}")
+    run = {
+        'started_at': datetime.utcnow().isoformat(),
+        'revision': git_revision(),
+        'dialect': db.engine.dialect.name,
+        'requests': args.requests,
+        'warm_cache': args.warm,
+        'tiers': {tier: run_tier(tier, args.requests, args.warm) for tier in tiers},
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    with open(output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f'results written to {output}')
+    if args.compare:
+        compare(run, args.compare)
+
+
+if __name__ == '__main__':
+    main()
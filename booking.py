@@ -0,0 +1,228 @@
+"""
+Booking checks for new shows.
+
+A show occupies its artist and its venue from start_time to end_time. A proposed show conflicts with
+every existing show of the same artist or venue whose time range overlaps its own, and with the other
+proposals of the same batch doing so. An artist with availability windows can only be booked for
+shows fitting entirely in one of them, one without windows can be booked any time.
+
+check_bookings answers for a whole batch of proposals in one query. Shows last at most
+MAX_SHOW_DURATION, so any show overlapping [start, end) started after start - MAX_SHOW_DURATION and
+the overlap search is a bounded range scan of the (artist_id, start_time)/ (venue_id, start_time)
+indexes, which on postgres also prunes the shows partitions. An exclusion constraint can't do this
+job there: postgres doesn't allow them on a partitioned table unless they include the partition key
+with equality.
+
+Concurrent bookings of the same artist/ venue are serialized instead with transaction level advisory
+locks (lock_bookings), taken before checking and released by the commit/ rollback that follows.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import DateTime, Integer, String, and_, cast, literal, null, select, text, union_all
+
+MAX_SHOW_DURATION = timedelta(hours=24)
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+# pg_advisory_xact_lock(key space, id) key spaces
+ARTIST_LOCK = 74101
+VENUE_LOCK = 74102
+
+
+class InvalidProposal(ValueError):
+    pass
+
+
+Proposal = namedtuple('Proposal', ['venue_id', 'artist_id', 'start_time', 'end_time'])
+
+
+def as_utc(value):
+    """
+    :param value: datetime, naive values are taken as utc
+    :return: aware utc datetime
+    """
+    return pytz.utc.localize(value) if value.tzinfo is None else value.astimezone(pytz.utc)
+
+
+def check_duration(start_time, end_time):
+    """
+    :raises InvalidProposal: unless the show lasts more than 0 and at most MAX_SHOW_DURATION, which
+                             check_bookings relies on to find the shows overlapping another
+    """
+    if not timedelta(0) < as_utc(end_time) - as_utc(start_time) <= MAX_SHOW_DURATION:
+        raise InvalidProposal(f'a show lasts between 1 and {int(MAX_SHOW_DURATION.total_seconds() // 60)} minutes')
+
+
+def proposal(venue_id, artist_id, start_time, duration_minutes=None):
+    """
+    Validates and normalizes one proposed show
+    :param start_time: datetime, naive values are taken as utc
+    :param duration_minutes: length of the show, DEFAULT_SHOW_DURATION when None
+    :return: Proposal
+    """
+    try:
+        venue_id, artist_id = int(venue_id), int(artist_id)
+    except (TypeError, ValueError):
+        raise InvalidProposal('venue_id and artist_id must be integers')
+    if not isinstance(start_time, datetime):
+        raise InvalidProposal('start_time must be a datetime')
+    try:
+        duration = DEFAULT_SHOW_DURATION if duration_minutes is None else timedelta(minutes=int(duration_minutes))
+    except (TypeError, ValueError):
+        raise InvalidProposal('duration_minutes must be an integer')
+    start_time = as_utc(start_time)
+    check_duration(start_time, start_time + duration)
+    return Proposal(venue_id, artist_id, start_time, start_time + duration)
+
+
+def lock_bookings(connection, proposals):
+    """
+    Serializes bookings of the proposals' artists and venues until the end of the transaction, postgres only.
+    Locks are taken in a fixed order so two batches can't deadlock on them.
+    :param connection: db session or connection in the transaction inserting the shows
+    :param proposals: list of Proposal
+    """
+    bind = connection.get_bind() if hasattr(connection, 'get_bind') else connection
+    if bind.dialect.name != 'postgresql':
+        return
+    keys = sorted({(ARTIST_LOCK, item.artist_id) for item in proposals} |
+                  {(VENUE_LOCK, item.venue_id) for item in proposals})
+    if not keys:
+        return
+    params = {}
+    for index, (space, key) in enumerate(keys):
+        params.update({f'space_{index}': space, f'key_{index}': key})
+    rows = ', '.join(f'(:space_{index}, :key_{index})' for index in range(len(keys)))
+    # one round trip for the whole batch, the volatile lock calls are evaluated after the sort
+    connection.execute(text(f'SELECT pg_advisory_xact_lock(space, key) FROM (VALUES {rows}) AS locks (space, key) '
+                            f'ORDER BY space, key'), params)
+
+
+def batch_conflicts(proposals):
+    """
+    :param proposals: list of Proposal
+    :return: (dict) index -> indexes of the other proposals sharing its artist or venue at an overlapping time
+    """
+    conflicts = {}
+    for owner in ('artist_id', 'venue_id'):
+        by_owner = {}
+        for index, item in enumerate(proposals):
+            by_owner.setdefault(getattr(item, owner), []).append(index)
+        for indexes in by_owner.values():
+            indexes.sort(key=lambda index: proposals[index].start_time)
+            # sweep in start order, each proposal only meets the following ones starting before it ends
+            for position, index in enumerate(indexes):
+                for other_index in indexes[position + 1:]:
+                    if proposals[other_index].start_time >= proposals[index].end_time:
+                        break
+                    conflicts.setdefault(index, set()).add(other_index)
+                    conflicts.setdefault(other_index, set()).add(index)
+    return conflicts
+
+
+def _booking_rows(connection, metadata, proposals, offset):
+    """
+    Runs the booking query for proposals, numbered from offset
+    :return: rows of (kind, index, ref_id, starts_at, ends_at)
+    """
+    shows = metadata.tables['shows']
+    windows = metadata.tables['artist_availability']
+    venues = metadata.tables['venues']
+    artists = metadata.tables['artists']
+    timestamp = DateTime(timezone=True)
+    rows = [select([literal(index, Integer).label('idx'), literal(item.venue_id, Integer).label('venue_id'),
+                    literal(item.artist_id, Integer).label('artist_id'),
+                    literal(item.start_time, timestamp).label('start_time'),
+                    literal(item.end_time, timestamp).label('end_time'),
+                    literal(item.start_time - MAX_SHOW_DURATION, timestamp).label('earliest')])
+            for index, item in enumerate(proposals, offset)]
+    batch = (union_all(*rows) if len(rows) > 1 else rows[0]).cte('proposals')
+
+    def overlapping(owner_key, kind):
+        return select([literal(kind, String).label('kind'), batch.c.idx, shows.c.id.label('ref_id'),
+                       shows.c.start_time, shows.c.end_time])\
+            .select_from(batch.join(shows, and_(shows.c[owner_key] == batch.c[owner_key],
+                                                shows.c.start_time > batch.c.earliest,
+                                                shows.c.start_time < batch.c.end_time,
+                                                shows.c.end_time > batch.c.start_time)))
+
+    def existing(table, owner_key, kind):
+        return select([literal(kind, String), batch.c.idx, table.c.id, cast(null(), timestamp).label('start_time'),
+                       cast(null(), timestamp).label('end_time')])\
+            .select_from(batch.join(table, table.c.id == batch.c[owner_key]))
+
+    return connection.execute(union_all(
+        overlapping('artist_id', 'artist_booked'),
+        overlapping('venue_id', 'venue_booked'),
+        select([literal('window', String), batch.c.idx, windows.c.id, windows.c.starts_at, windows.c.ends_at])
+        .select_from(batch.join(windows, windows.c.artist_id == batch.c.artist_id)),
+        existing(venues, 'venue_id', 'venue'),
+        existing(artists, 'artist_id', 'artist'),
+    ))
+
+
+def check_bookings(connection, metadata, proposals, chunk_size=None):
+    """
+    Finds what stands in the way of each proposed show, in one query for the whole batch
+    :param connection: db session or connection
+    :param metadata: metadata holding the shows, venues, artists and artist_availability tables
+    :param proposals: list of Proposal
+    :param chunk_size: proposals per query, None checks them all in one. Overlaps within the batch are
+                       found across chunks either way
+    :return: (list) per proposal, the list of problems as dicts with a 'type' of unknown_venue,
+             unknown_artist, artist_booked, venue_booked, unavailable or batch_conflict. Empty when it can be booked
+    """
+    if not proposals:
+        return []
+    chunk_size = chunk_size or len(proposals)
+    found = [{'venue': False, 'artist': False, 'windows': [], 'problems': []} for _ in proposals]
+    for offset in range(0, len(proposals), chunk_size):
+        for kind, index, ref_id, starts_at, ends_at in _booking_rows(connection, metadata,
+                                                                    proposals[offset:offset + chunk_size], offset):
+            result = found[index]
+            if kind in ('venue', 'artist'):
+                result[kind] = True
+            elif kind == 'window':
+                result['windows'].append((as_utc(starts_at), as_utc(ends_at)))
+            else:
+                result['problems'].append({'type': kind, 'show_id': ref_id, 'start_time': as_utc(starts_at),
+                                           'end_time': as_utc(ends_at)})
+
+    conflicts = batch_conflicts(proposals)
+    problems = []
+    for index, (item, result) in enumerate(zip(proposals, found)):
+        item_problems = []
+        if not result['venue']:
+            item_problems.append({'type': 'unknown_venue'})
+        if not result['artist']:
+            item_problems.append({'type': 'unknown_artist'})
+        item_problems.extend(sorted(result['problems'], key=lambda problem: problem['start_time']))
+        fits = [window for window in result['windows'] if window[0] <= item.start_time and item.end_time <= window[1]]
+        if result['windows'] and not fits:
+            item_problems.append({'type': 'unavailable',
+                                  'windows': [{'starts_at': start, 'ends_at': end}
+                                              for start, end in sorted(result['windows'])]})
+        item_problems.extend({'type': 'batch_conflict', 'index': other_index}
+                             for other_index in sorted(conflicts.get(index, ())))
+        problems.append(item_problems)
+    return problems
+
+
+def describe_problem(problem):
+    """
+    :return: (str) one line for the user about a problem returned by check_bookings
+    """
+    date_format = '%Y-%m-%d %H:%M'
+    if problem['type'] == 'unknown_venue':
+        return 'There is no venue with that id'
+    if problem['type'] == 'unknown_artist':
+        return 'There is no artist with that id'
+    if problem['type'] in ('artist_booked', 'venue_booked'):
+        who = 'Artist' if problem['type'] == 'artist_booked' else 'Venue'
+        return (f"{who} is already booked from {problem['start_time']:{date_format}} "
+                f"to {problem['end_time']:{date_format}} UTC")
+    if problem['type'] == 'unavailable':
+        windows = ', '.join(f"{window['starts_at']:{date_format}} to {window['ends_at']:{date_format}}"
+                            for window in problem['windows'])
+        return f'Cannot book shows outside artist availability, Artist is available from {windows} UTC'
+    return f"Overlaps show #{problem['index'] + 1} of the same request"
@@ -0,0 +1,132 @@
+"""
+One-time database setup, registered on the app as the `flask bootstrap` command.
+
+    flask bootstrap
+
+Run it once per deploy (or release phase) before starting the workers. It creates the database
+when it is missing, then either builds a fresh schema and stamps it with the latest migration or
+upgrades an existing one to it, then creates the shows partitions for the coming months (see
+partitions.py). Importing the app and starting workers makes no db round trips, the engine is
+only created on the first query.
+"""
+import copy
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_migrate import stamp, upgrade
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine.url import make_url
+
+from partitions import create_partitioned_shows, ensure_partitions
+
+# serializes concurrent bootstraps, e.g. several containers running the release step at once
+BOOTSTRAP_LOCK_ID = 7314820116
+
+# trigram indexes of migration 9d4e1a7c3b52, which a freshly stamped schema never runs
+TRIGRAM_INDEXES = [
+    ('venues', 'name'), ('venues', 'city'), ('venues', 'state'),
+    ('artists', 'name'), ('artists', 'city'), ('artists', 'state'),
+]
+
+
+def create_database_if_missing(uri, maintenance_db='postgres'):
+    """
+    Creates the database named in uri, connecting to maintenance_db to do it. Only postgres is handled,
+    other backends (e.g. sqlite) create their database on connect.
+    :param uri: SQLALCHEMY_DATABASE_URI
+    :param maintenance_db: existing database to connect to while the target does not exist yet
+    :return: (bool) True when the database was created
+    """
+    url = make_url(uri)
+    if url.get_backend_name() != 'postgresql':
+        return False
+    maintenance_url = copy.copy(url)
+    maintenance_url.database = maintenance_db
+    # CREATE DATABASE can't run inside a transaction
+    engine = create_engine(maintenance_url, isolation_level='AUTOCOMMIT')
+    try:
+        with engine.connect() as connection:
+            exists = connection.execute(text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                                        name=url.database).scalar()
+            if exists:
+                return False
+            quoted = engine.dialect.identifier_preparer.quote(url.database)
+            connection.execute(text(f'CREATE DATABASE {quoted}'))
+            return True
+    finally:
+        engine.dispose()
+
+
+def create_trigram_indexes(connection):
+    available = connection.execute(
+        text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar()
+    if available is None:
+        return
+    connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    for table, column in TRIGRAM_INDEXES:
+        connection.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm '
+                                f'ON {table} USING gin ({column} gin_trgm_ops)'))
+
+
+def create_earth_index(connection):
+    # venues near a point, as migration c6a4f19e2b73 indexes them
+    available = connection.execute(
+        text("SELECT 1 FROM pg_available_extensions WHERE name = 'earthdistance'")).scalar()
+    if available is None:
+        return
+    connection.execute(text('CREATE EXTENSION IF NOT EXISTS cube'))
+    connection.execute(text('CREATE EXTENSION IF NOT EXISTS earthdistance'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_venues_earth '
+                            'ON venues USING gist (ll_to_earth(latitude, longitude))'))
+
+
+def bootstrap_schema(db):
+    """
+    Builds the schema of an empty database and stamps it, or upgrades a migrated one
+    :param db: flask_sqlalchemy instance bound to the current app
+    :return: 'created' or 'upgraded'
+    """
+    is_postgres = db.engine.dialect.name == 'postgresql'
+    with db.engine.connect() as lock_connection:
+        if is_postgres:
+            lock_connection.execute(text('SELECT pg_advisory_lock(:id)'), id=BOOTSTRAP_LOCK_ID)
+        try:
+            tables = inspect(db.engine).get_table_names()
+            config = current_app.config
+            if 'alembic_version' in tables:
+                upgrade()
+                with db.engine.begin() as connection:
+                    ensure_partitions(connection, config['SHOWS_PARTITION_INTERVAL'], config['SHOWS_PARTITIONS_AHEAD'])
+                return 'upgraded'
+            if tables:
+                # e.g. created by db.create_all() before migrations were tracked, we can't tell its revision
+                raise click.ClickException('the database has tables but no alembic_version, run '
+                                           '`flask db stamp <revision>` for the schema it has, then bootstrap again')
+            # the default bind only, replicas get the schema through replication
+            db.create_all(bind=None)
+            if is_postgres:
+                with db.engine.begin() as connection:
+                    create_trigram_indexes(connection)
+                    create_earth_index(connection)
+                    # shows partitioned by start_time, as migration d2f7a9b4c6e1 leaves it
+                    create_partitioned_shows(connection, db.metadata.tables['shows'],
+                                             config['SHOWS_PARTITION_INTERVAL'], config['SHOWS_PARTITIONS_AHEAD'])
+            stamp()
+            return 'created'
+        finally:
+            if is_postgres:
+                lock_connection.execute(text('SELECT pg_advisory_unlock(:id)'), id=BOOTSTRAP_LOCK_ID)
+
+
+@click.command('bootstrap')
+@with_appcontext
+def bootstrap_command():
+    """Create the database if missing and bring its schema to the latest migration."""
+    config = current_app.config
+    if create_database_if_missing(config['SQLALCHEMY_DATABASE_URI']):
+        click.echo(f"created database {make_url(config['SQLALCHEMY_DATABASE_URI']).database}")
+    db = current_app.extensions['sqlalchemy'].db
+    result = bootstrap_schema(db)
+    click.echo('schema created and stamped with the latest migration' if result == 'created'
+               else 'schema upgraded to the latest migration')
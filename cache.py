@@ -0,0 +1,120 @@
+"""
+In-process cache for the data the read views build.
+
+Entries expire after a TTL and the least recently used one is evicted once the cache is full.
+Each entry carries tags (e.g. 'venues', 'venue:3') and the write handlers invalidate the tags
+they touched right after their commit. The cache is per process, so with several workers the
+TTL bounds how long another worker may serve stale data.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class ViewCache:
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic, app=None):
+        """
+        :param maxsize: max entries kept, least recently used go first
+        :param ttl: seconds an entry stays valid, 0 disables caching
+        :param clock: time source, monotonic seconds
+        :param app: app to size the cache from (VIEW_CACHE_SIZE/ VIEW_CACHE_TTL) and register it on
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, value, tags), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._keys_by_tag = defaultdict(set)
+        # bumped on every invalidation, a build that raced one is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VIEW_CACHE_SIZE', 1024)
+        app.config.setdefault('VIEW_CACHE_TTL', 60)
+        self.maxsize = app.config['VIEW_CACHE_SIZE']
+        self.ttl = app.config['VIEW_CACHE_TTL']
+        app.extensions['view_cache'] = self
+
+    def get_or_build(self, key, build, tags=()):
+        """
+        Returns the cached value for key, or builds and stores it
+        :param key: hashable cache key
+        :param build: no argument callable building the value
+        :param tags: iterable of tags, or a callable taking the built value and returning them
+        :return: cached or freshly built value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        value = build()
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return value
+        entry_tags = frozenset(tags(value) if callable(tags) else tags)
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._remove(key)
+            self._entries[key] = (self._clock() + self.ttl, value, entry_tags)
+            for tag in entry_tags:
+                self._keys_by_tag[tag].add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return value
+
+    def invalidate(self, *tags):
+        """
+        Drops every entry carrying any of the tags
+        """
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def stats(self):
+        """
+        :return: (dict) hit/ miss counters and current size
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
@@ -0,0 +1,194 @@
+"""
+Incremental change feed of venues, artists and shows, served by GET /api/v1/changes.
+
+    GET /api/v1/changes?updated_since=2035-01-01T00:00:00Z  -> {"changes": [...], "next": "<token>", "more": true}
+    GET /api/v1/changes?since=<token>                       -> the changes after the previous page
+
+Venues, artists and shows carry an updated_at, set by the db on insert and by every edit
+(edits.apply_edit). Deleting rows records a tombstone for each of them first (record_deletes), the shows
+going with a deleted venue and those of archived shows partitions included. The feed merges the four
+sources into one sequence ordered by (timestamp, source, id) and pages through it with an opaque token,
+a page costing one range scan of the (updated_at, id)/ (deleted_at, id) index per source however far
+along the token is. An upsert carries the row as export.py writes it, a delete only its table and id, so
+a consumer loads a full export once, then polls the feed from the time it started the export.
+
+updated_at is the start of the writing transaction, so a row may commit after rows stamped later than
+it. The feed only returns changes from before its horizon: CHANGES_SETTLE_SECONDS ago and, on postgres,
+before the start of the oldest transaction still open, which may write yet. Nothing can then commit behind a token already
+handed out. Tombstones are pruned after CHANGES_RETENTION_DAYS (`flask changes prune`), older tokens are
+refused and the consumer starts over from an export.
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+
+import click
+import dateutil.parser
+import pytz
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import literal, select, text, tuple_
+
+from booking import as_utc
+from export import exported_columns, to_records
+from pagination import InvalidCursor
+
+changes_cli = AppGroup('changes', help='Maintain the change feed.')
+
+# in feed order for changes sharing a timestamp
+SOURCES = ('venues', 'artists', 'shows', 'tombstones')
+# any open transaction may still write, stamped with its start, whether it wrote yet (holds an xid) or not
+OLDEST_WRITE_SQL = text("SELECT min(xact_start) FROM pg_stat_activity WHERE datname = current_database() "
+                        "AND state <> 'idle' AND pid <> pg_backend_pid()")
+
+
+class ExpiredToken(ValueError):
+    """
+    The position is older than the retained tombstones, deletes may be missing after it
+    """
+
+
+def encode_token(position):
+    """
+    :param position: (at, source, id) of the last change read
+    :return: (str) opaque url safe token
+    """
+    at, source, row_id = position
+    payload = {'t': at.isoformat(), 's': source, 'i': row_id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_token(token):
+    """
+    Reverse of encode_token
+    :raises InvalidCursor: when the token is malformed
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        position = (as_utc(dateutil.parser.isoparse(payload['t'])), payload['s'], int(payload['i']))
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f'Malformed token: {e}')
+    if position[1] not in SOURCES:
+        raise InvalidCursor('Token does not match this feed')
+    return position
+
+
+def start_position(updated_since):
+    """
+    :param updated_since: datetime, naive values are taken as utc
+    :return: position right before the changes made at updated_since
+    """
+    return as_utc(updated_since), SOURCES[0], 0
+
+
+def record_deletes(connection, table, whereclause):
+    """
+    Records a tombstone for each row of table matching whereclause, call it right before deleting them
+    in the same transaction
+    :param connection: db session or connection
+    :param table: venues, artists or shows table
+    """
+    tombstones = table.metadata.tables['tombstones']
+    connection.execute(tombstones.insert().from_select(
+        ['table_name', 'row_id'], select([literal(table.name), table.c.id]).where(whereclause)))
+
+
+def feed_horizon(connection, settle_seconds, now=None):
+    """
+    :return: aware datetime, every change stamped before it is committed
+    """
+    horizon = (now or datetime.now(pytz.utc)) - timedelta(seconds=settle_seconds)
+    bind = connection.get_bind() if hasattr(connection, 'get_bind') else connection
+    if bind.dialect.name == 'postgresql':
+        oldest_write = connection.execute(OLDEST_WRITE_SQL).scalar()
+        if oldest_write is not None:
+            horizon = min(horizon, oldest_write)
+    return horizon
+
+
+def _after(timestamp, row_id, rank, position):
+    """
+    :return: condition selecting the rows of the source ranked `rank` that come after position
+    """
+    at, source, last_id = position
+    last_rank = SOURCES.index(source)
+    if rank > last_rank:
+        return timestamp >= at
+    if rank == last_rank:
+        return tuple_(timestamp, row_id) > tuple_(at, last_id)
+    return timestamp > at
+
+
+def read_changes(connection, metadata, position=None, limit=500, horizon=None):
+    """
+    Reads the next page of the feed
+    :param connection: db session or connection
+    :param position: (at, source, id) of the last change read, None reads from the start
+    :param limit: max changes
+    :param horizon: aware datetime, only changes stamped before it are read, see feed_horizon
+    :return: (list) changes in order, position of the last one (the given one when there are none),
+             (bool) whether more changes are ready
+    """
+    found = []
+    for rank, source in enumerate(SOURCES):
+        table = metadata.tables[source]
+        if source == 'tombstones':
+            timestamp = table.c.deleted_at
+            query = select([table.c.id, table.c.deleted_at, table.c.table_name, table.c.row_id])
+        else:
+            timestamp = table.c.updated_at
+            query = select(exported_columns(table))
+        if horizon is not None:
+            query = query.where(timestamp < horizon)
+        if position is not None:
+            query = query.where(_after(timestamp, table.c.id, rank, position))
+        # limit + 1 of each source tells whether there are more
+        for row in connection.execute(query.order_by(timestamp, table.c.id).limit(limit + 1)):
+            found.append((as_utc(row[timestamp.name]), rank, row['id'], row))
+    found.sort(key=lambda item: item[:3])
+    page = found[:limit]
+
+    records = {}
+    for rank, source in enumerate(SOURCES[:-1]):
+        rows = [row for _, row_rank, _, row in page if row_rank == rank]
+        records.update(((source, record['id']), record) for record in to_records(connection, metadata, source, rows))
+    changes = []
+    for at, rank, row_id, row in page:
+        if SOURCES[rank] == 'tombstones':
+            changes.append({'table': row['table_name'], 'op': 'delete', 'id': row['row_id'], 'at': at})
+        else:
+            changes.append({'table': SOURCES[rank], 'op': 'upsert', 'id': row_id, 'at': at,
+                            'data': records[(SOURCES[rank], row_id)]})
+    if page:
+        at, rank, row_id, _ = page[-1]
+        position = (at, SOURCES[rank], row_id)
+    return changes, position, len(found) > limit
+
+
+def check_retention(position, retention_days, now=None):
+    """
+    :raises ExpiredToken: when tombstones the position still needs may have been pruned
+    """
+    oldest = (now or datetime.now(pytz.utc)) - timedelta(days=retention_days)
+    if position is not None and position[0] < oldest:
+        raise ExpiredToken(f'changes before {oldest.isoformat()} are no longer kept')
+
+
+def prune_tombstones(connection, metadata, retention_days, now=None):
+    """
+    :return: (int) tombstones deleted, those older than retention_days
+    """
+    tombstones = metadata.tables['tombstones']
+    oldest = (now or datetime.now(pytz.utc)) - timedelta(days=retention_days)
+    return connection.execute(tombstones.delete().where(tombstones.c.deleted_at < oldest)).rowcount
+
+
+@changes_cli.command('prune')
+@click.option('--days', type=int, default=None, help='Tombstones to keep, defaults to CHANGES_RETENTION_DAYS.')
+def prune_command(days):
+    """Delete the tombstones older than the feed keeps."""
+    db = current_app.extensions['sqlalchemy'].db
+    with db.engine.begin() as connection:
+        deleted = prune_tombstones(connection, db.metadata,
+                                   current_app.config['CHANGES_RETENTION_DAYS'] if days is None else days)
+    click.echo(f'{deleted} tombstones deleted')
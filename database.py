@@ -0,0 +1,189 @@
+"""
+Engine and connection pool configuration.
+
+The DB_* settings in config.py are turned into SQLALCHEMY_ENGINE_OPTIONS when the app is created.
+In the default 'session' mode the app keeps its own pool and the statement/ lock timeouts are
+sent once per connection as startup options. In 'transaction' mode (pgbouncer with
+pool_mode=transaction) a server connection is only ours for the length of a transaction, so the
+app keeps no pool of its own and sets the timeouts with SET LOCAL at the start of every transaction.
+
+Pool checkouts are timed and, along with the pool's saturation, served by /metrics.
+
+utcnow() is the db's current time for server side defaults and updates. On sqlite it is written with
+microseconds, the way SQLAlchemy stores the datetimes it binds, so values set by the db and by python
+compare correctly there.
+"""
+import threading
+import time
+
+from sqlalchemy import DateTime, event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql.expression import FunctionElement
+
+POOL_MODES = ('session', 'transaction')
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.timeouts = 0
+
+    def record(self, wait_ms, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            if timed_out:
+                self.timeouts += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'avg_wait_ms': round(self.wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait_ms, 3),
+                'timeouts': self.timeouts,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.wait_ms = 0.0
+            self.max_wait_ms = 0.0
+            self.timeouts = 0
+
+
+# shared by every pool of the process, a pool recreated after a dispose keeps counting here
+pool_stats = PoolStats()
+
+
+class TimedPoolMixin:
+    """
+    Times how long getting a connection from the pool takes, including waiting for a free one
+    """
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            pool_stats.record((time.perf_counter() - started) * 1000, timed_out)
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedNullPool(TimedPoolMixin, NullPool):
+    pass
+
+
+def engine_options(config):
+    """
+    :param config: app config with the DB_* settings
+    :return: (dict) create_engine keyword arguments for SQLALCHEMY_ENGINE_OPTIONS
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'postgresql':
+        # sqlite is left to Flask-SQLAlchemy's own pool choice
+        return {}
+    mode = config['DB_POOL_MODE']
+    if mode not in POOL_MODES:
+        raise ValueError(f"DB_POOL_MODE must be one of {', '.join(POOL_MODES)}, not {mode!r}")
+    timeouts = {name: int(ms) for name, ms in [('statement_timeout', config['DB_STATEMENT_TIMEOUT_MS']),
+                                               ('lock_timeout', config['DB_LOCK_TIMEOUT_MS'])] if ms}
+    # executemany() inserts (bulk show creation, seeding without COPY) are sent as multi row VALUES
+    # statements instead of one round trip per row
+    batching = {'executemany_mode': 'values'} if url.get_driver_name() == 'psycopg2' else {}
+    if mode == 'transaction':
+        # pgbouncer pools, holding our own idle connections would just pin its server connections
+        options = {'poolclass': TimedNullPool, **batching}
+        if timeouts:
+            options['execution_options'] = {'local_timeouts': timeouts}
+        return options
+    options = {
+        **batching,
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if timeouts:
+        options['connect_args'] = {'options': ' '.join(f'-c {name}={ms}' for name, ms in timeouts.items())}
+    return options
+
+
+def init_engine_config(app):
+    """
+    Fills SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings, call before db.init_app. Options set
+    explicitly in the config win.
+    """
+    for key, default in [('DB_POOL_MODE', 'session'), ('DB_POOL_SIZE', 5), ('DB_MAX_OVERFLOW', 10),
+                         ('DB_POOL_TIMEOUT', 10), ('DB_POOL_RECYCLE', 1800), ('DB_POOL_PRE_PING', True),
+                         ('DB_STATEMENT_TIMEOUT_MS', 0), ('DB_LOCK_TIMEOUT_MS', 0)]:
+        app.config.setdefault(key, default)
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    if not event.contains(Engine, 'begin', _set_local_timeouts):
+        event.listen(Engine, 'begin', _set_local_timeouts)
+
+
+def _set_local_timeouts(conn):
+    timeouts = conn.get_execution_options().get('local_timeouts')
+    if timeouts and conn.dialect.name == 'postgresql':
+        conn.execute('; '.join(f'SET LOCAL {name} = {int(ms)}' for name, ms in timeouts.items()))
+
+
+def pool_status(engine):
+    """
+    :param engine: db engine
+    :return: (dict) pool occupancy, saturation (checked out/ capacity) and checkout wait stats
+    """
+    pool = engine.pool
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        # max_overflow -1 means no limit, there is no saturation to report then
+        capacity = pool.size() + pool._max_overflow if pool._max_overflow >= 0 else None
+        checked_out = pool.checkedout()
+        status.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_out': checked_out,
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'saturation': round(checked_out / capacity, 3) if capacity else None,
+        })
+    if isinstance(pool, TimedPoolMixin):
+        status['checkout'] = pool_stats.as_dict()
+    return status
+
+
+class utcnow(FunctionElement):
+    """
+    Current time of the db, the start of the transaction on postgres
+    """
+    type = DateTime(timezone=True)
+    name = 'utcnow'
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'sqlite')
+def _sqlite_utcnow(element, compiler, **kw):
+    # CURRENT_TIMESTAMP has no fractional seconds there
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
@@ -0,0 +1,161 @@
+"""
+Partial updates of venues and artists with change detection and optimistic concurrency.
+
+Each venue/ artist row carries a version, bumped by every edit that changes something. An edit reads
+the row's editable columns (one narrow select by primary key, no ORM load), keeps the submitted values
+that differ from the stored ones and updates only those columns, with
+
+    UPDATE ... SET <changed columns>, version = version + 1, updated_at = now()
+    WHERE id = :id AND version = :read_version
+
+An editor sends back the version its form was rendered with. When the row was edited since, the edit
+fails with StaleEdit instead of overwriting the other change, and so does an edit racing another one
+between its read and its write. An edit changing nothing writes nothing and keeps the version.
+
+apply_edit returns a ChangeSet of {column: (old, new)}, from which cache_tags picks the cache tags
+to invalidate: the row's own, plus those of the listings showing one of the changed columns.
+"""
+from collections import namedtuple
+
+from sqlalchemy import Boolean, Float, Integer, String, and_, select
+
+from database import utcnow
+
+# columns an edit may change, per table
+EDITABLE_COLUMNS = {
+    'venues': ('name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link', 'website',
+               'seeking_talent', 'seeking_description', 'latitude', 'longitude'),
+    'artists': ('name', 'city', 'state', 'phone', 'image_link', 'facebook_link', 'website', 'seeking_venue',
+                'seeking_description'),
+}
+# bounds of the numeric columns, per name
+VALUE_RANGES = {'latitude': (-90, 90), 'longitude': (-180, 180)}
+TRUE_VALUES = ('y', 'yes', 'true', 'on', '1')
+FALSE_VALUES = ('', 'n', 'no', 'false', 'off', '0')
+
+
+class StaleEdit(Exception):
+    """
+    The row was edited since the editor read it
+    """
+    def __init__(self, current_version):
+        super().__init__(f'edited meanwhile, now at version {current_version}')
+        self.current_version = current_version
+
+
+class ChangeSet(namedtuple('ChangeSet', ['table', 'id', 'version', 'changes'])):
+    """
+    Outcome of an edit: the row's version after it and the changes as {name: (old, new)}, empty when
+    nothing changed
+    """
+    __slots__ = ()
+
+    def as_dict(self):
+        return {'id': self.id, 'version': self.version,
+                'changes': {name: {'old': old, 'new': new} for name, (old, new) in self.changes.items()}}
+
+
+def coerce(column, value):
+    """
+    Converts a submitted value, e.g. a form string, to the column's python type
+    :raises ValueError: when it doesn't fit the column
+    """
+    if value is None:
+        if not column.nullable:
+            raise ValueError(f'{column.name} is required')
+        return None
+    if isinstance(column.type, Boolean):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in TRUE_VALUES + FALSE_VALUES:
+            return value.strip().lower() in TRUE_VALUES
+        raise ValueError(f'{column.name} must be a boolean')
+    if isinstance(column.type, Integer):
+        return int(value)
+    if isinstance(column.type, Float):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{column.name} must be a number')
+        low, high = VALUE_RANGES.get(column.name, (value, value))
+        # also refuses nan
+        if not low <= value <= high:
+            raise ValueError(f'{column.name} must be between {low} and {high}')
+        return value
+    if isinstance(column.type, String):
+        if not isinstance(value, str):
+            raise ValueError(f'{column.name} must be a string')
+        if column.type.length is not None and len(value) > column.type.length:
+            raise ValueError(f'{column.name} is longer than {column.type.length} characters')
+    return value
+
+
+def editable_values(connection, table, row_id):
+    """
+    :param connection: db session or connection
+    :param table: venues or artists table
+    :return: (dict) id, version and the editable columns of the row, None when it doesn't exist
+    """
+    columns = [table.c.id, table.c.version] + [table.c[name] for name in EDITABLE_COLUMNS[table.name]]
+    row = connection.execute(select(columns).where(table.c.id == row_id)).first()
+    return dict(row) if row is not None else None
+
+
+def apply_edit(connection, table, row_id, submitted, expected_version=None, extra_changes=None, derived=None):
+    """
+    Updates the columns whose submitted value differs from the stored one, in the caller's transaction
+    :param connection: db session or connection
+    :param table: venues or artists table
+    :param row_id: id of the edited row
+    :param submitted: name -> submitted value, names other than the editable columns are ignored
+    :param expected_version: version the editor read, None skips the check (last write wins)
+    :param extra_changes: name -> (old, new) changed outside of the row (e.g. genres), they bump its version too
+    :param derived: callable(current values, changes) -> name -> new value of the editable columns following
+                    from the changes, e.g. a venue's coordinates from its city
+    :return: ChangeSet, None when the row doesn't exist
+    :raises StaleEdit: when the row's version isn't expected_version, or it changed before the update
+    :raises ValueError: when a submitted value doesn't fit its column
+    """
+    current = editable_values(connection, table, row_id)
+    if current is None:
+        return None
+    if expected_version is not None and current['version'] != expected_version:
+        raise StaleEdit(current['version'])
+    changes = {}
+    for name in EDITABLE_COLUMNS[table.name]:
+        if name not in submitted:
+            continue
+        value = coerce(table.c[name], submitted[name])
+        # an empty field submitted for a column that was never set isn't a change
+        if value != current[name] and not (value == '' and current[name] is None):
+            changes[name] = (current[name], value)
+    changes.update(extra_changes or {})
+    if derived is not None and changes:
+        changes.update((name, (current[name], value)) for name, value in derived(current, changes).items()
+                       if value != current[name])
+    if not changes:
+        return ChangeSet(table.name, row_id, current['version'], {})
+    values = {name: new for name, (_, new) in changes.items() if name in table.c}
+    values['version'] = table.c.version + 1
+    if 'updated_at' in table.c:
+        values['updated_at'] = utcnow()
+    result = connection.execute(table.update()
+                                .where(and_(table.c.id == row_id, table.c.version == current['version']))
+                                .values(values))
+    if result.rowcount != 1:
+        # another edit committed between our read and this update
+        raise StaleEdit(current['version'] + 1)
+    return ChangeSet(table.name, row_id, current['version'] + 1, changes)
+
+
+def cache_tags(change_set, row_tag, listings):
+    """
+    :param change_set: ChangeSet of an edit
+    :param row_tag: tag of the row's own pages, e.g. 'venue:3'
+    :param listings: tag -> names of the changed values the tagged pages show
+    :return: (list) tags to invalidate, none when nothing changed
+    """
+    if not change_set.changes:
+        return []
+    changed = set(change_set.changes)
+    return [row_tag] + [tag for tag, names in listings.items() if changed & set(names)]
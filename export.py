@@ -0,0 +1,261 @@
+"""
+Streaming exports of venues, artists and shows as CSV or JSON Lines, served by GET /api/v1/export/<table>
+and registered on the app as the `flask export` command group.
+
+    flask export shows --output shows.jsonl.gz
+    flask export venues --format csv --updated-since 2035-01-01T00:00:00Z
+
+Rows are read through a server-side cursor (stream_results, a named cursor on postgres) EXPORT_BATCH_SIZE
+at a time and written out as each batch is read, so memory stays flat however many rows are exported. The
+genres/ availability windows of a batch of venues/ artists are read with one query per batch. The whole
+export reads from one transaction, on postgres a REPEATABLE READ snapshot, so it is consistent even while
+the tables change.
+
+Records carry the fields `flask seed` reads, an export can be loaded into another db with it. The
+computed show counters are left out, seeding recounts them.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date
+
+import click
+import dateutil.parser
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, select
+
+from booking import as_utc
+
+export_cli = AppGroup('export', help='Stream venues, artists and shows out as CSV or JSON Lines.')
+
+DEFAULT_BATCH_SIZE = 5000
+TABLES = ('venues', 'artists', 'shows')
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+# kept up to date by show_counters.py, not data
+DERIVED_COLUMNS = ('upcoming_shows_count', 'past_shows_count', 'next_show_at')
+GENRE_ASSOCIATIONS = {'venues': ('venue_genres', 'venue_id'), 'artists': ('artist_genres', 'artist_id')}
+
+
+def exported_columns(table):
+    """
+    :return: (list) the columns of the table an export record carries
+    """
+    return [column for column in table.c if column.name not in DERIVED_COLUMNS]
+
+
+def timestamp_column(table):
+    """
+    :return: the column updated_since filters the table on, None when it has none
+    """
+    return table.c.get('updated_at', table.c.get('created_at'))
+
+
+def export_query(metadata, table_name, updated_since=None):
+    """
+    :param updated_since: datetime, only rows changed since are exported. Naive values are taken as utc
+    :return: select of the table's exported columns, in id order
+    :raises ValueError: when the table can't be filtered on updated_since
+    """
+    table = metadata.tables[table_name]
+    query = select(exported_columns(table)).order_by(table.c.id)
+    if updated_since is not None:
+        column = timestamp_column(table)
+        if column is None:
+            raise ValueError(f'{table_name} have no timestamp to filter on updated_since')
+        updated_since = as_utc(updated_since)
+        # naive timestamp columns hold utc times
+        query = query.where(column >= (updated_since if column.type.timezone else updated_since.replace(tzinfo=None)))
+    return query
+
+
+def _related(connection, metadata, table_name, ids):
+    """
+    :return: (dict) id -> {'genres': [...], 'availability': [...]} for a batch of venues/ artists
+    """
+    association_name, owner_key = GENRE_ASSOCIATIONS[table_name]
+    association = metadata.tables[association_name]
+    genres = metadata.tables['genres']
+    related = {row_id: {'genres': []} for row_id in ids}
+    for row_id, name in connection.execute(
+            select([association.c[owner_key], genres.c.name])
+            .select_from(association.join(genres, genres.c.id == association.c.genre_id))
+            .where(association.c[owner_key].in_(ids)).order_by(genres.c.name)):
+        related[row_id]['genres'].append(name)
+    if table_name == 'artists':
+        windows = metadata.tables['artist_availability']
+        for record in related.values():
+            record['availability'] = []
+        for artist_id, starts_at, ends_at in connection.execute(
+                select([windows.c.artist_id, windows.c.starts_at, windows.c.ends_at])
+                .where(windows.c.artist_id.in_(ids)).order_by(windows.c.starts_at)):
+            related[artist_id]['availability'].append({'starts_at': as_utc(starts_at), 'ends_at': as_utc(ends_at)})
+    return related
+
+
+def to_records(connection, metadata, table_name, rows):
+    """
+    Turns rows of an export_query into export records, with the genres/ availability of venues/ artists
+    :param rows: rows of one table, read on connection
+    :return: (list) record dicts
+    """
+    if not rows:
+        return []
+    table = metadata.tables[table_name]
+    records = [dict(row) for row in rows]
+    # sqlite drops the offset of timezone aware columns, they hold utc
+    aware_columns = [name for name in records[0]
+                     if isinstance(table.c[name].type, DateTime) and table.c[name].type.timezone]
+    for record in records:
+        record.update((name, as_utc(record[name])) for name in aware_columns if record[name] is not None)
+    if table_name in GENRE_ASSOCIATIONS:
+        related = _related(connection, metadata, table_name, [record['id'] for record in records])
+        for record in records:
+            record.update(related[record['id']])
+    return records
+
+
+def export_records(engine, metadata, query, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Streams the rows of an export_query
+    :param engine: engine to read from, a connection of it is held until the generator is exhausted or closed
+    :return: generator of lists of record dicts, one list per batch
+    """
+    table_name = query.froms[0].name
+    with engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection = connection.execution_options(isolation_level='REPEATABLE READ')
+        with connection.begin():
+            # rows stay on the server until fetched, a batch at a time
+            result = connection.execution_options(stream_results=True).execute(query)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield to_records(connection, metadata, table_name, rows)
+
+
+def _value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def csv_value(value):
+    """
+    Flattens a value into a CSV field, lists are joined with ',' the way `flask seed` splits genres and
+    availability windows are written as ISO 8601 intervals, start/end
+    """
+    if isinstance(value, list):
+        return ','.join(f"{_value(item['starts_at'])}/{_value(item['ends_at'])}" if isinstance(item, dict) else item
+                        for item in value)
+    return '' if value is None else _value(value)
+
+
+def encode(batches, fmt):
+    """
+    :param batches: lists of record dicts, from export_records
+    :param fmt: 'csv' or 'ndjson'
+    :return: generator of str chunks, one per batch. The CSV header comes with the first batch
+    """
+    header = None
+    for records in batches:
+        buffer = io.StringIO()
+        if fmt == 'csv':
+            writer = csv.writer(buffer)
+            if header is None:
+                header = list(records[0])
+                writer.writerow(header)
+            writer.writerows([csv_value(record[name]) for name in header] for record in records)
+        else:
+            for record in records:
+                buffer.write(json.dumps(record, default=_value))
+                buffer.write('\n')
+        yield buffer.getvalue()
+
+
+def gzipped(chunks):
+    """
+    Compresses str chunks into one gzip stream as they come
+    :return: generator of bytes
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        # flushed per chunk so the client gets each batch as it's read
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_chunks(engine, metadata, table_name, fmt, updated_since=None, batch_size=DEFAULT_BATCH_SIZE,
+                  gzip=False):
+    """
+    Streams one table as CSV or JSON Lines
+    :raises ValueError: right away, not when iterated, when updated_since can't be applied to the table
+    :return: generator of bytes
+    """
+    query = export_query(metadata, table_name, updated_since)
+    chunks = encode(export_records(engine, metadata, query, batch_size), fmt)
+    return gzipped(chunks) if gzip else (chunk.encode() for chunk in chunks)
+
+
+def parse_updated_since(value):
+    """
+    :param value: ISO 8601 datetime string, or None
+    :raises ValueError: when it isn't one
+    """
+    return dateutil.parser.isoparse(value) if value else None
+
+
+format_option = click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default=None,
+                             help='Defaults to the output file extension, else ndjson.')
+output_option = click.option('--output', default='-', show_default=True,
+                             help='File to write, gzipped when it ends with .gz. - writes to stdout.')
+updated_since_option = click.option('--updated-since', default=None,
+                                    help='Only rows changed since this ISO 8601 datetime.')
+batch_size_option = click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+                                 help='Rows read per fetch.')
+
+
+def write_export(table_name, fmt, output, updated_since, batch_size):
+    db = current_app.extensions['sqlalchemy'].db
+    name = output[:-3] if output.endswith('.gz') else output
+    fmt = fmt or ('csv' if name.endswith('.csv') else 'ndjson')
+    try:
+        chunks = export_chunks(db.engine, db.metadata, table_name, fmt, parse_updated_since(updated_since),
+                               batch_size, gzip=output.endswith('.gz'))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--updated-since')
+    with click.open_file(output, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+@export_cli.command('venues')
+@format_option
+@output_option
+@updated_since_option
+@batch_size_option
+def export_venues(fmt, output, updated_since, batch_size):
+    """Export venues as CSV or JSON Lines."""
+    write_export('venues', fmt, output, updated_since, batch_size)
+
+
+@export_cli.command('artists')
+@format_option
+@output_option
+@updated_since_option
+@batch_size_option
+def export_artists(fmt, output, updated_since, batch_size):
+    """Export artists as CSV or JSON Lines."""
+    write_export('artists', fmt, output, updated_since, batch_size)
+
+
+@export_cli.command('shows')
+@format_option
+@output_option
+@updated_since_option
+@batch_size_option
+def export_shows(fmt, output, updated_since, batch_size):
+    """Export shows as CSV or JSON Lines."""
+    write_export('shows', fmt, output, updated_since, batch_size)
@@ -13,6 +13,11 @@ def test():
         abort("Aborted at user request.")
 
 
+def benchmark(tiers='1k'):
+    # route latency/ statement counts, results land in benchmarks/results/
+    local("python -m benchmarks.suite --tiers {}".format(tiers))
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
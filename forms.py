@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, NumberRange
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -15,6 +15,12 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # booking.MAX_SHOW_DURATION is 24 hours
+    duration_minutes = IntegerField(
+        'duration_minutes',
+        validators=[Optional(), NumberRange(min=1, max=24 * 60)],
+        default=120
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -215,10 +221,10 @@ class ArtistForm(Form):
         ]
     )
     available_from = DateTimeField(
-        'available_from'
+        'available_from', validators=[Optional()]
     )
     available_to = DateTimeField(
-        'available_to'
+        'available_to', validators=[Optional()]
     )
     facebook_link = StringField(
         # TODO implement enum restriction
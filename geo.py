@@ -0,0 +1,211 @@
+"""
+Venue coordinates and the "venues near" search, served by /venues/search (location and radius fields) and
+GET /api/v1/venues/near, and registered on the app as the `flask geo` command group.
+
+    GET /api/v1/venues/near?location=San Francisco, CA&radius_km=25
+    GET /api/v1/venues/near?location=37.77,-122.42&radius_km=5&genre=Jazz
+
+Addresses are free text, so venues are geocoded from their city and state with an offline gazetteer
+(GAZETTEER_PATH, a CSV of city, state, latitude, longitude). A venue gets the coordinates of its city
+unless it's given its own, through the API or an import. `flask geo geocode` fills in the venues created
+before, or whose city the gazetteer didn't know then.
+
+On postgres with the earthdistance extension venues are indexed by ll_to_earth(latitude, longitude) with
+GiST (migration c6a4f19e2b73). The radius is an earth_box containment and the results come nearest first
+from the same index scan, the cube <-> distance ordering points like the great circle distance does.
+Without it the query filters on the bounding box of the circle, served by the (latitude, longitude) index,
+and orders by the equirectangular approximation of the distance, no trigonometry needed in the db. The
+distances returned are computed here with the haversine formula, which also drops the box's corners.
+"""
+import csv
+import math
+from functools import lru_cache
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, func, select
+
+from database import utcnow
+from search import parse_city_state
+
+geo_cli = AppGroup('geo', help='Geocode venues.')
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# engine url -> whether earthdistance is installed, checked once per engine
+_earthdistance_support = {}
+
+
+class InvalidLocation(ValueError):
+    """
+    The location is neither coordinates nor a place the gazetteer knows
+    """
+
+
+def place_key(city, state):
+    return ' '.join(city.split()).lower(), state.strip().lower()
+
+
+@lru_cache(maxsize=4)
+def load_gazetteer(path):
+    """
+    :param path: CSV file with city, state, latitude and longitude columns
+    :return: (dict) place_key -> (latitude, longitude)
+    """
+    with open(path, newline='') as f:
+        return {place_key(row['city'], row['state']): (float(row['latitude']), float(row['longitude']))
+                for row in csv.DictReader(f)}
+
+
+def geocode(gazetteer, city, state):
+    """
+    :param gazetteer: from load_gazetteer
+    :return: (latitude, longitude) of the city, None when the gazetteer doesn't know it
+    """
+    if not city or not state:
+        return None
+    return gazetteer.get(place_key(city, state))
+
+
+def check_coordinates(latitude, longitude):
+    """
+    :raises InvalidLocation: when they are out of range, or not numbers
+    """
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise InvalidLocation(f'coordinates out of range: {latitude}, {longitude}')
+
+
+def parse_location(text, gazetteer):
+    """
+    :param text: 'latitude, longitude' or 'city, state' text from the search form
+    :param gazetteer: from load_gazetteer
+    :return: (latitude, longitude)
+    :raises InvalidLocation: when the text is neither
+    """
+    place = parse_city_state(text or '')
+    if place is None:
+        raise InvalidLocation("expected 'city, state' or 'latitude, longitude'")
+    try:
+        latitude, longitude = float(place[0]), float(place[1])
+    except ValueError:
+        coordinates = geocode(gazetteer, *place)
+        if coordinates is None:
+            raise InvalidLocation(f'unknown place: {place[0]}, {place[1]}')
+        return coordinates
+    check_coordinates(latitude, longitude)
+    return latitude, longitude
+
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+    """
+    :return: (float) great circle distance between the two points
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (latitude, longitude, other_latitude, other_longitude))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    :return: (min_latitude, max_latitude, min_longitude, max_longitude) enclosing the circle. Near the poles
+             and across the antimeridian it spans every longitude
+    """
+    delta = radius_km / KM_PER_DEGREE
+    min_latitude, max_latitude = latitude - delta, latitude + delta
+    if min_latitude <= -90 or max_latitude >= 90:
+        return max(min_latitude, -90), min(max_latitude, 90), -180, 180
+    # the circle's widest point isn't on its center's parallel
+    delta = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)))))
+    if longitude - delta < -180 or longitude + delta > 180:
+        return min_latitude, max_latitude, -180, 180
+    return min_latitude, max_latitude, longitude - delta, longitude + delta
+
+
+def earthdistance_available(session):
+    """
+    :param session: db session
+    :return: (bool) True when the bound db is postgres with earthdistance installed
+    """
+    engine = session.get_bind()
+    key = str(engine.url)
+    if key not in _earthdistance_support:
+        available = False
+        if engine.dialect.name == 'postgresql':
+            available = session.execute(
+                "SELECT 1 FROM pg_extension WHERE extname = 'earthdistance'").scalar() is not None
+        _earthdistance_support[key] = available
+    return _earthdistance_support[key]
+
+
+def nearby_query(session, model, latitude, longitude, radius_km, genre=None, limit=50, use_earthdistance=None):
+    """
+    Builds the query of the venues around a point, nearest first. Without earthdistance it may return rows
+    just outside the radius, check them with distance_km
+    :param session: db session
+    :param model: Venue
+    :param radius_km: max distance
+    :param genre: only rows tagged with this genre name
+    :param limit: max results
+    :param use_earthdistance: force the earthdistance (True) or bounding box (False) path, None to detect
+    :return: query of model rows
+    """
+    if use_earthdistance is None:
+        use_earthdistance = earthdistance_available(session)
+    query = session.query(model)
+    if use_earthdistance:
+        origin = func.ll_to_earth(latitude, longitude)
+        point = func.ll_to_earth(model.latitude, model.longitude)
+        radius_m = radius_km * 1000
+        query = query.filter(func.earth_box(origin, radius_m).op('@>')(point),
+                             func.earth_distance(origin, point) <= radius_m)
+        distance = point.op('<->')(origin)
+    else:
+        min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, radius_km)
+        query = query.filter(model.latitude.between(min_latitude, max_latitude),
+                             model.longitude.between(min_longitude, max_longitude))
+        # squared, in degrees of latitude
+        scale = math.cos(math.radians(latitude))
+        distance = (model.latitude - latitude) * (model.latitude - latitude) + \
+            (model.longitude - longitude) * (model.longitude - longitude) * (scale * scale)
+    if genre:
+        query = query.filter(model.genres.any(name=genre))
+    return query.order_by(distance, model.id).limit(limit)
+
+
+def geocode_venues(engine, venues, gazetteer):
+    """
+    Sets the coordinates of the venues that have none from their city, one transaction per city. Each
+    geocoded venue counts as edited, see edits.py
+    :param engine: engine to write with
+    :param venues: venues table
+    :return: (int) venues geocoded, (int) venues left without coordinates
+    """
+    with engine.connect() as connection:
+        places = connection.execute(select([venues.c.city, venues.c.state, func.count()])
+                                    .where(venues.c.latitude.is_(None))
+                                    .group_by(venues.c.city, venues.c.state)).fetchall()
+    geocoded = unknown = 0
+    for city, state, count in places:
+        coordinates = geocode(gazetteer, city, state)
+        if coordinates is None:
+            unknown += count
+            continue
+        with engine.begin() as connection:
+            geocoded += connection.execute(
+                venues.update()
+                .where(and_(venues.c.city == city, venues.c.state == state, venues.c.latitude.is_(None)))
+                .values(latitude=coordinates[0], longitude=coordinates[1], version=venues.c.version + 1,
+                        updated_at=utcnow())).rowcount
+    return geocoded, unknown
+
+
+@geo_cli.command('geocode')
+@click.option('--gazetteer', 'path', default=None, help='City coordinates CSV, defaults to GAZETTEER_PATH.')
+def geocode_command(path):
+    """Set the coordinates of the venues that have none from their city and state."""
+    db = current_app.extensions['sqlalchemy'].db
+    gazetteer = load_gazetteer(path or current_app.config['GAZETTEER_PATH'])
+    geocoded, unknown = geocode_venues(db.engine, db.metadata.tables['venues'], gazetteer)
+    click.echo(f'{geocoded} venues geocoded, {unknown} in places the gazetteer does not know')
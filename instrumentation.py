@@ -0,0 +1,147 @@
+"""
+Request scoped SQL/ template instrumentation.
+
+SQLAlchemy engine events time every statement and Flask hooks attribute them to the request's
+route, along with the template render time. Statements slower than SLOW_QUERY_THRESHOLD_MS are
+logged. Per route totals and the slowest statements are kept in memory and served by the
+/metrics endpoint. Each response also gets a Server-Timing header with its db and template time.
+"""
+import heapq
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask.signals import before_render_template, signals_available, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class RouteStats:
+    def __init__(self, keep_slowest):
+        self.keep_slowest = keep_slowest
+        self.requests = 0
+        self.statements = 0
+        self.max_statements = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.total_ms = 0.0
+        # min heap of (duration_ms, statement), the slowest keep_slowest statements seen
+        self.slowest = []
+
+    def add_statement(self, duration_ms, statement):
+        entry = (duration_ms, statement)
+        if len(self.slowest) < self.keep_slowest:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def as_dict(self):
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'statements': self.statements,
+            'avg_statements': self.statements / requests,
+            'max_statements': self.max_statements,
+            'db_ms': round(self.db_ms, 3),
+            'avg_db_ms': round(self.db_ms / requests, 3),
+            'avg_template_ms': round(self.template_ms / requests, 3),
+            'avg_total_ms': round(self.total_ms / requests, 3),
+            'slowest': [{'ms': round(duration_ms, 3), 'statement': statement}
+                        for duration_ms, statement in sorted(self.slowest, reverse=True)],
+        }
+
+
+class RequestMetrics:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.routes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Hooks into the app and every engine (listening on the Engine class also covers engines created later)
+        """
+        app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 200)
+        app.config.setdefault('METRICS_SLOWEST_STATEMENTS', 5)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        if signals_available:
+            before_render_template.connect(_before_render_template, app)
+            template_rendered.connect(_template_rendered, app)
+        else:
+            app.logger.info('blinker is not installed, template render time is not measured')
+        app.extensions['request_metrics'] = self
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_statements = []
+        g.metrics_db_ms = 0.0
+        g.metrics_template_ms = 0.0
+
+    def _after_request(self, response):
+        if 'metrics_started' not in g:
+            return response
+        total_ms = (time.perf_counter() - g.metrics_started) * 1000
+        # unmatched urls share one bucket so 404 scans can't grow the table
+        route = request.endpoint or '<unmatched>'
+        with self._lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats(current_app.config['METRICS_SLOWEST_STATEMENTS'])
+            stats.requests += 1
+            stats.statements += len(g.metrics_statements)
+            stats.max_statements = max(stats.max_statements, len(g.metrics_statements))
+            stats.db_ms += g.metrics_db_ms
+            stats.template_ms += g.metrics_template_ms
+            stats.total_ms += total_ms
+            for duration_ms, statement in g.metrics_statements:
+                stats.add_statement(duration_ms, statement)
+        response.headers['Server-Timing'] = (f'db;dur={g.metrics_db_ms:.1f}, tpl;dur={g.metrics_template_ms:.1f}, '
+                                             f'total;dur={total_ms:.1f}')
+        response.headers['X-SQL-Count'] = str(len(g.metrics_statements))
+        return response
+
+    def snapshot(self):
+        """
+        :return: (dict) per route stats
+        """
+        with self._lock:
+            return {route: stats.as_dict() for route, stats in sorted(self.routes.items())}
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started:
+        return
+    duration_ms = (time.perf_counter() - started.pop()) * 1000
+    if not has_app_context():
+        return
+    metrics = g.get('metrics_statements') if has_request_context() else None
+    if metrics is not None:
+        metrics.append((duration_ms, statement))
+        g.metrics_db_ms += duration_ms
+    if duration_ms >= current_app.config.get('SLOW_QUERY_THRESHOLD_MS', 200):
+        route = request.endpoint if has_request_context() else '-'
+        current_app.logger.warning(f'Slow query [{route}] {duration_ms:.1f}ms: {statement} {parameters!r:.500}')
+
+
+def _before_render_template(sender, template, context, **extra):
+    if has_request_context() and 'metrics_started' in g:
+        g.metrics_template_started = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra):
+    if has_request_context() and 'metrics_template_started' in g:
+        g.metrics_template_ms += (time.perf_counter() - g.pop('metrics_template_started')) * 1000
@@ -0,0 +1,230 @@
+"""
+Background jobs for work too large to finish within a request.
+
+A handler submits a job (a function and its arguments) and answers 202 with the job id right away.
+A pool of JOB_WORKERS threads in the same process runs the job in an app context, and the job's
+state (queued, running, done with its result, failed with its error) is kept in a job store for
+GET /api/v1/jobs/<id>. With JOB_WORKERS = 0 jobs run inline on submit instead, e.g. for tests.
+
+The store is in process by default, so only the process that accepted a job can report on it. With
+JOB_STORE_PATH set, job state is kept in that SQLite file instead, which every worker process on the
+host can read and which outlives restarts. Jobs still run in the process that accepted them: a
+queued/ running job whose process is gone is reported as failed. Finished jobs are forgotten
+JOB_RESULT_TTL seconds after they end.
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+
+from flask import current_app
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+FINISHED = (DONE, FAILED)
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class MemoryJobStore:
+    """
+    In process job store
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def prune(self, before):
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job['status'] in FINISHED and job['finished_at'] < before]:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """
+    Job store in a SQLite file shared by the processes of a host. Results are stored as json.
+    """
+    COLUMNS = ('id', 'kind', 'status', 'owner', 'total', 'created_at', 'started_at', 'finished_at', 'result', 'error')
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, '
+                'owner TEXT, total INTEGER, created_at REAL NOT NULL, started_at REAL, finished_at REAL, '
+                'result TEXT, error TEXT)')
+
+    @contextmanager
+    def _connect(self):
+        # a connection per call, they are cheap and can't be shared across threads
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create(self, job):
+        job = dict(job, result=json.dumps(job.get('result'), default=_json_default))
+        with self._connect() as connection:
+            connection.execute(f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) "
+                               f"VALUES ({', '.join('?' for _ in self.COLUMNS)})",
+                               [job.get(column) for column in self.COLUMNS])
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'], default=_json_default)
+        with self._connect() as connection:
+            connection.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                               [*fields.values(), job_id])
+
+    def get(self, job_id):
+        with self._connect() as connection:
+            row = connection.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", [job_id]).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def prune(self, before):
+        with self._connect() as connection:
+            connection.execute(f"DELETE FROM jobs WHERE status IN ('{DONE}', '{FAILED}') AND finished_at < ?", [before])
+
+
+def _owner():
+    # host:pid of the process running a job, read per job since workers fork after import
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _owner_gone(owner):
+    """
+    :return: (bool) True when owner is a process of this host that no longer runs
+    """
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+class JobQueue:
+    """
+    Runs submitted jobs on a thread pool and keeps their state in the job store
+    """
+    def __init__(self, app=None):
+        self.store = None
+        self.result_ttl = 24 * 3600
+        self._workers = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._counts = {'submitted': 0, 'done': 0, 'failed': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOB_WORKERS', 2)
+        app.config.setdefault('JOB_STORE_PATH', '')
+        app.config.setdefault('JOB_RESULT_TTL', 24 * 3600)
+        self._workers = app.config['JOB_WORKERS']
+        self.result_ttl = app.config['JOB_RESULT_TTL']
+        path = app.config['JOB_STORE_PATH']
+        self.store = SQLiteJobStore(path) if path else MemoryJobStore()
+        app.extensions['job_queue'] = self
+
+    def submit(self, kind, func, *args, total=None):
+        """
+        Queues func(*args) to run in an app context of the current app
+        :param kind: job type reported with its status, e.g. 'create_shows'
+        :param func: callable returning the job's result, json-able
+        :param total: optional size of the job (e.g. number of items) reported with its status
+        :return: (dict) the queued job
+        """
+        now = time.time()
+        self.store.prune(now - self.result_ttl)
+        job = {'id': uuid.uuid4().hex, 'kind': kind, 'status': QUEUED, 'owner': _owner(), 'total': total,
+               'created_at': now, 'started_at': None, 'finished_at': None, 'result': None, 'error': None}
+        self.store.create(job)
+        with self._lock:
+            self._counts['submitted'] += 1
+        app = current_app._get_current_object()
+        if self._workers <= 0:
+            self._run(app, job, func, args)
+        else:
+            with self._lock:
+                if self._executor is None:
+                    # threads are started on the first job, not by every process importing the app
+                    self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='job')
+            self._executor.submit(self._run, app, job, func, args)
+        return self.get(job['id'])
+
+    def _run(self, app, job, func, args):
+        self.store.update(job['id'], status=RUNNING, started_at=time.time())
+        try:
+            with app.app_context():
+                result = func(*args)
+        except Exception as e:
+            logging.error(f"Error in [job {job['kind']} {job['id']}]>>>> Reason: {str(e)}")
+            self.store.update(job['id'], status=FAILED, error=str(e), finished_at=time.time())
+            status = FAILED
+        else:
+            self.store.update(job['id'], status=DONE, result=result, finished_at=time.time())
+            status = DONE
+        with self._lock:
+            self._counts[status] += 1
+
+    def get(self, job_id):
+        """
+        :return: (dict) the job's state, None when unknown or pruned
+        """
+        job = self.store.get(job_id)
+        if job is not None and job['status'] not in FINISHED and _owner_gone(job['owner']):
+            job.update(status=FAILED, error='interrupted, the process running it stopped')
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        counts['workers'] = self._workers
+        counts['pending'] = counts['submitted'] - counts['done'] - counts['failed']
+        return counts
+
+    def shutdown(self, wait=True):
+        """
+        Waits for the running jobs, e.g. before an orderly exit
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
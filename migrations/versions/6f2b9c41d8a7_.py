@@ -0,0 +1,32 @@
+"""add indexes for hot filter and sort columns
+
+Revision ID: 6f2b9c41d8a7
+Revises: 0065c311e0f5
+Create Date: 2026-10-18 10:12:41.208113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f2b9c41d8a7'
+down_revision = '0065c311e0f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_venues_state_city_id', 'venues', ['state', 'city', 'id'], unique=False)
+    op.create_index('ix_venues_created_at_id', 'venues', ['created_at', 'id'], unique=False)
+    op.create_index('ix_artists_created_at_id', 'artists', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artists_created_at_id', table_name='artists')
+    op.drop_index('ix_venues_created_at_id', table_name='venues')
+    op.drop_index('ix_venues_state_city_id', table_name='venues')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
@@ -0,0 +1,43 @@
+"""trigram search indexes on name, city and state
+
+Revision ID: 9d4e1a7c3b52
+Revises: 6f2b9c41d8a7
+Create Date: 2026-10-18 11:02:17.530842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4e1a7c3b52'
+down_revision = '6f2b9c41d8a7'
+branch_labels = None
+depends_on = None
+
+TRIGRAM_INDEXES = [
+    ('venues', 'name'), ('venues', 'city'), ('venues', 'state'),
+    ('artists', 'name'), ('artists', 'city'), ('artists', 'state'),
+]
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    # builds without pg_trgm keep the LIKE search path, see search.py
+    available = bind.execute(sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar()
+    if available is None:
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in TRIGRAM_INDEXES:
+        op.create_index(f'ix_{table}_{column}_trgm', table, [column], unique=False,
+                        postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    for table, column in TRIGRAM_INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS ix_{table}_{column}_trgm')
@@ -0,0 +1,64 @@
+"""updated_at on venues, artists and shows, tombstones of deleted rows
+
+Revision ID: a5d81f4c7e93
+Revises: f3c9a6d2b8e4
+Create Date: 2026-10-18 18:02:47.915230
+
+Existing rows are stamped with the time of the migration, a consumer of the change feed starting from
+before it gets them all. On postgres 11+ the columns are added without rewriting the tables.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5d81f4c7e93'
+down_revision = 'f3c9a6d2b8e4'
+branch_labels = None
+depends_on = None
+
+TABLES = ('venues', 'artists', 'shows')
+# database.utcnow
+NOW = {'postgresql': 'CURRENT_TIMESTAMP', 'sqlite': "(strftime('%Y-%m-%d %H:%M:%f000', 'now'))"}
+
+
+def upgrade():
+    bind = op.get_bind()
+    now = sa.text(NOW.get(bind.dialect.name, 'CURRENT_TIMESTAMP'))
+    for table in TABLES:
+        column = sa.Column('updated_at', sa.DateTime(timezone=True), server_default=now, nullable=False)
+        if bind.dialect.name == 'sqlite':
+            # sqlite can't add a column with a non constant default in place
+            with op.batch_alter_table(table, recreate='always') as batch_op:
+                batch_op.add_column(column)
+                if table == 'shows':
+                    # the recreated table doesn't carry over the reflected CHECK constraints
+                    batch_op.create_check_constraint('ck_shows_end_after_start', 'end_time > start_time')
+        else:
+            # propagates to the shows partitions
+            op.add_column(table, column)
+        op.create_index(f'ix_{table}_updated_at_id', table, ['updated_at', 'id'], unique=False)
+
+    op.create_table('tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('table_name', sa.String(length=20), nullable=False),
+        sa.Column('row_id', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(timezone=True), server_default=now, nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstones_deleted_at_id', 'tombstones', ['deleted_at', 'id'], unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    op.drop_index('ix_tombstones_deleted_at_id', table_name='tombstones')
+    op.drop_table('tombstones')
+    for table in reversed(TABLES):
+        op.drop_index(f'ix_{table}_updated_at_id', table_name=table)
+        if bind.dialect.name == 'sqlite':
+            with op.batch_alter_table(table, recreate='always') as batch_op:
+                batch_op.drop_column('updated_at')
+                if table == 'shows':
+                    batch_op.create_check_constraint('ck_shows_end_after_start', 'end_time > start_time')
+        else:
+            op.drop_column(table, 'updated_at')
@@ -0,0 +1,75 @@
+"""normalize genres into a lookup table with venue/ artist association tables
+
+Revision ID: b71c3e58a0d4
+Revises: 9d4e1a7c3b52
+Create Date: 2026-10-18 12:24:05.913377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71c3e58a0d4'
+down_revision = '9d4e1a7c3b52'
+branch_labels = None
+depends_on = None
+
+# (entity table, association table, owner key)
+OWNERS = [('venues', 'venue_genres', 'venue_id'), ('artists', 'artist_genres', 'artist_id')]
+
+
+def upgrade():
+    genres = op.create_table('genres',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=120), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    for table, association, owner_key in OWNERS:
+        op.create_table(association,
+            sa.Column(owner_key, sa.Integer(), nullable=False),
+            sa.Column('genre_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['genre_id'], ['genres.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint([owner_key], [f'{table}.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint(owner_key, 'genre_id')
+        )
+        op.create_index(f'ix_{association}_genre_id_{owner_key}', association, ['genre_id', owner_key], unique=False)
+
+    # data migration: split the comma joined strings into rows
+    bind = op.get_bind()
+    owner_genres = {}
+    for table, association, owner_key in OWNERS:
+        rows = bind.execute(sa.text(f'SELECT id, genres FROM {table} WHERE genres IS NOT NULL')).fetchall()
+        owner_genres[table] = [(row.id, list(dict.fromkeys(
+            name.strip() for name in row.genres.split(',') if name.strip()))) for row in rows]
+    names = sorted({name for rows in owner_genres.values() for _, row_names in rows for name in row_names})
+    if names:
+        op.bulk_insert(genres, [{'name': name} for name in names])
+    genre_ids = {row.name: row.id for row in bind.execute(sa.text('SELECT id, name FROM genres'))}
+    for table, association, owner_key in OWNERS:
+        association_table = sa.table(association, sa.column(owner_key), sa.column('genre_id'))
+        rows = [{owner_key: owner_id, 'genre_id': genre_ids[name]}
+                for owner_id, row_names in owner_genres[table] for name in row_names]
+        if rows:
+            op.bulk_insert(association_table, rows)
+        op.drop_column(table, 'genres')
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table, association, owner_key in OWNERS:
+        op.add_column(table, sa.Column('genres', sa.String(length=120), nullable=True))
+        rows = bind.execute(sa.text(
+            f'SELECT a.{owner_key} AS owner_id, g.name FROM {association} a '
+            f'JOIN genres g ON g.id = a.genre_id ORDER BY a.{owner_key}, g.name')).fetchall()
+        joined = {}
+        for row in rows:
+            joined.setdefault(row.owner_id, []).append(row.name)
+        for owner_id, row_names in joined.items():
+            # the old column silently truncated past 120 characters, do it explicitly here
+            bind.execute(sa.text(f'UPDATE {table} SET genres = :genres WHERE id = :id'),
+                         genres=','.join(row_names)[:120], id=owner_id)
+        op.drop_index(f'ix_{association}_genre_id_{owner_key}', table_name=association)
+        op.drop_table(association)
+    op.drop_table('genres')
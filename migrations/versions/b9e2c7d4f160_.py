@@ -0,0 +1,56 @@
+"""created_at set by the db, as timestamptz
+
+Revision ID: b9e2c7d4f160
+Revises: a5d81f4c7e93
+Create Date: 2026-10-18 18:41:09.337582
+
+created_at used to default to the time the app process imported its models, so every row a process
+inserted got the same, too early timestamp. The existing values are taken as utc and repaired into
+a running max in id order: a row created after another (a higher serial id) is stamped no earlier
+than it. That can't recover the true times, but the recent listings come out in insertion order
+again. The change of type rewrites venues and artists on postgres.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e2c7d4f160'
+down_revision = 'a5d81f4c7e93'
+branch_labels = None
+depends_on = None
+
+TABLES = ('venues', 'artists')
+# database.utcnow
+NOW = {'postgresql': 'CURRENT_TIMESTAMP', 'sqlite': "(strftime('%Y-%m-%d %H:%M:%f000', 'now'))"}
+
+
+def upgrade():
+    bind = op.get_bind()
+    now = sa.text(NOW.get(bind.dialect.name, 'CURRENT_TIMESTAMP'))
+    for table in TABLES:
+        if bind.dialect.name == 'postgresql':
+            op.alter_column(table, 'created_at', type_=sa.DateTime(timezone=True), server_default=now,
+                            existing_nullable=False, postgresql_using="created_at AT TIME ZONE 'UTC'")
+            # data migration: running max of created_at in id order
+            op.execute(f'UPDATE {table} SET created_at = repaired.created_at '
+                       f'FROM (SELECT id, max(created_at) OVER (ORDER BY id) AS created_at FROM {table}) repaired '
+                       f'WHERE {table}.id = repaired.id AND {table}.created_at < repaired.created_at')
+        else:
+            with op.batch_alter_table(table, recreate='always') as batch_op:
+                batch_op.alter_column('created_at', type_=sa.DateTime(timezone=True), server_default=now,
+                                      existing_nullable=False)
+            op.execute(f'UPDATE {table} SET created_at = (SELECT max(earlier.created_at) FROM {table} earlier '
+                       f'WHERE earlier.id <= {table}.id)')
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table in TABLES:
+        if bind.dialect.name == 'postgresql':
+            op.alter_column(table, 'created_at', type_=sa.DateTime(), server_default=None,
+                            existing_nullable=False, postgresql_using="created_at AT TIME ZONE 'UTC'")
+        else:
+            with op.batch_alter_table(table, recreate='always') as batch_op:
+                batch_op.alter_column('created_at', type_=sa.DateTime(), server_default=None,
+                                      existing_nullable=False)
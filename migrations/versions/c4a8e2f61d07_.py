@@ -0,0 +1,44 @@
+"""upcoming/ past show counters on venues and artists
+
+Revision ID: c4a8e2f61d07
+Revises: b71c3e58a0d4
+Create Date: 2026-10-18 14:41:52.208317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e2f61d07'
+down_revision = 'b71c3e58a0d4'
+branch_labels = None
+depends_on = None
+
+# counted table, its key on shows
+OWNERS = [('venues', 'venue_id'), ('artists', 'artist_id')]
+
+
+def upgrade():
+    for table, owner_key in OWNERS:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('next_show_at', sa.DateTime(timezone=True), nullable=True))
+        op.create_index(f'ix_{table}_next_show_at', table, ['next_show_at'], unique=False)
+        # data migration: count the existing shows
+        op.execute(
+            f'UPDATE {table} SET '
+            f'upcoming_shows_count = (SELECT count(*) FROM shows WHERE shows.{owner_key} = {table}.id '
+            f'AND shows.start_time > CURRENT_TIMESTAMP), '
+            f'past_shows_count = (SELECT count(*) FROM shows WHERE shows.{owner_key} = {table}.id '
+            f'AND shows.start_time <= CURRENT_TIMESTAMP), '
+            f'next_show_at = (SELECT min(shows.start_time) FROM shows WHERE shows.{owner_key} = {table}.id '
+            f'AND shows.start_time > CURRENT_TIMESTAMP)')
+
+
+def downgrade():
+    for table, _ in OWNERS:
+        op.drop_index(f'ix_{table}_next_show_at', table_name=table)
+        op.drop_column(table, 'next_show_at')
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
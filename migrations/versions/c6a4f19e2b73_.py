@@ -0,0 +1,44 @@
+"""venue coordinates and the venues near search indexes
+
+Revision ID: c6a4f19e2b73
+Revises: b9e2c7d4f160
+Create Date: 2026-10-18 20:12:44.816203
+
+Venues get a latitude and longitude, filled in by `flask geo geocode` for the existing ones. On postgres
+builds shipping earthdistance (contrib, with cube) they are also indexed as ll_to_earth points with GiST,
+which geo.nearby_query uses when the extension is installed. The (latitude, longitude) index serves its
+bounding box query everywhere else.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6a4f19e2b73'
+down_revision = 'b9e2c7d4f160'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venues', sa.Column('longitude', sa.Float(), nullable=True))
+    op.create_index('ix_venues_latitude_longitude', 'venues', ['latitude', 'longitude'], unique=False)
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    available = bind.execute(sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'earthdistance'")).scalar()
+    if available is None:
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS cube')
+    op.execute('CREATE EXTENSION IF NOT EXISTS earthdistance')
+    op.execute('CREATE INDEX ix_venues_earth ON venues USING gist (ll_to_earth(latitude, longitude))')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_venues_earth')
+    op.drop_index('ix_venues_latitude_longitude', table_name='venues')
+    with op.batch_alter_table('venues') as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
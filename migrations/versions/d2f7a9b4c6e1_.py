@@ -0,0 +1,98 @@
+"""partition shows by range of start_time
+
+Revision ID: d2f7a9b4c6e1
+Revises: c4a8e2f61d07
+Create Date: 2026-10-18 15:32:40.117925
+
+Postgres only. The rows are copied into the new partitioned table while the old one is locked, so
+run it in a maintenance window on large tables. Shows without a start_time, which were never listed
+anywhere, are not carried over since the partition key can't be null.
+"""
+from datetime import datetime
+
+from alembic import op
+from dateutil.relativedelta import relativedelta
+import pytz
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f7a9b4c6e1'
+down_revision = 'c4a8e2f61d07'
+branch_labels = None
+depends_on = None
+
+# monthly partitions for every month holding shows, plus the coming MONTHS_AHEAD months.
+# `flask shows-partitions create` takes over from there
+MONTHS_AHEAD = 12
+
+
+def create_partition(lower):
+    upper = lower + relativedelta(months=1)
+    op.execute(f"CREATE TABLE shows_p{lower:%Y_%m} PARTITION OF shows "
+               f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')")
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.rename_table('shows', 'shows_unpartitioned')
+    op.execute('ALTER INDEX shows_pkey RENAME TO shows_unpartitioned_pkey')
+    op.create_table('shows',
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('shows_id_seq')"), nullable=False),
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('start_time', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ondelete='CASCADE'),
+        # unique constraints of a partitioned table have to include the partition key
+        sa.PrimaryKeyConstraint('id', 'start_time', name='shows_pkey'),
+        postgresql_partition_by='RANGE (start_time)'
+    )
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+    op.execute('CREATE TABLE shows_default PARTITION OF shows DEFAULT')
+
+    this_month = datetime.now(pytz.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    months = {this_month + relativedelta(months=offset) for offset in range(MONTHS_AHEAD + 1)}
+    rows = bind.execute(sa.text(
+        "SELECT DISTINCT date_trunc('month', start_time AT TIME ZONE 'UTC') AS month FROM shows_unpartitioned "
+        "WHERE start_time IS NOT NULL AND start_time < :until"), until=max(months) + relativedelta(months=1))
+    months.update(pytz.utc.localize(row.month) for row in rows)
+    for month in sorted(months):
+        create_partition(month)
+
+    op.execute('INSERT INTO shows (id, artist_id, venue_id, start_time) '
+               'SELECT id, artist_id, venue_id, start_time FROM shows_unpartitioned WHERE start_time IS NOT NULL')
+    # keep the id sequence, it belonged to the old table
+    op.execute('ALTER SEQUENCE shows_id_seq OWNED BY shows.id')
+    op.drop_table('shows_unpartitioned')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    op.rename_table('shows', 'shows_partitioned')
+    op.execute('ALTER INDEX shows_pkey RENAME TO shows_partitioned_pkey')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows_partitioned')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows_partitioned')
+    op.create_table('shows',
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('shows_id_seq')"), nullable=False),
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('start_time', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', name='shows_pkey')
+    )
+    op.execute('INSERT INTO shows (id, artist_id, venue_id, start_time) '
+               'SELECT id, artist_id, venue_id, start_time FROM shows_partitioned')
+    op.execute('ALTER SEQUENCE shows_id_seq OWNED BY shows.id')
+    # detached/ archived partitions are no longer part of shows_partitioned and are left alone
+    op.drop_table('shows_partitioned')
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
@@ -0,0 +1,39 @@
+"""venues city and state not null
+
+Revision ID: d83f5b2a6c19
+Revises: c6a4f19e2b73
+Create Date: 2026-10-18 21:40:09.527318
+
+/venues keyset paginates on (state, city, id), a row comparison against a NULL is never true, so the
+pages stopped at the first venue without a state or city. The venue forms always required both, the
+venues which got a NULL through the API or an import get an empty string instead, counting as an edit
+so the change feed reports them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd83f5b2a6c19'
+down_revision = 'c6a4f19e2b73'
+branch_labels = None
+depends_on = None
+
+# database.utcnow
+NOW = {'postgresql': 'CURRENT_TIMESTAMP', 'sqlite': "strftime('%Y-%m-%d %H:%M:%f000', 'now')"}
+
+
+def upgrade():
+    now = NOW.get(op.get_bind().dialect.name, 'CURRENT_TIMESTAMP')
+    # data migration
+    op.execute(f"UPDATE venues SET state = coalesce(state, ''), city = coalesce(city, ''), "
+               f"version = version + 1, updated_at = {now} WHERE state IS NULL OR city IS NULL")
+    with op.batch_alter_table('venues') as batch_op:
+        batch_op.alter_column('state', existing_type=sa.String(length=120), nullable=False)
+        batch_op.alter_column('city', existing_type=sa.String(length=120), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('venues') as batch_op:
+        batch_op.alter_column('city', existing_type=sa.String(length=120), nullable=True)
+        batch_op.alter_column('state', existing_type=sa.String(length=120), nullable=True)
@@ -0,0 +1,91 @@
+"""show end times and artist availability windows
+
+Revision ID: e8b3d5a1f9c2
+Revises: d2f7a9b4c6e1
+Create Date: 2026-10-18 16:20:05.481736
+
+Existing shows get the default two hour duration, those without a start_time (never listed anywhere,
+postgres dropped them in d2f7a9b4c6e1) are deleted. The single available_from/ available_to window of
+each artist becomes its first artist_availability row, the downgrade keeps the earliest window only.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3d5a1f9c2'
+down_revision = 'd2f7a9b4c6e1'
+branch_labels = None
+depends_on = None
+
+# booking.DEFAULT_SHOW_DURATION
+DEFAULT_DURATION_MINUTES = 120
+# booking.MAX_SHOW_DURATION, check_bookings finds overlapping shows only when they are no longer
+MAX_DURATION_HOURS = 24
+
+
+def upgrade():
+    bind = op.get_bind()
+    is_postgres = bind.dialect.name == 'postgresql'
+    op.add_column('shows', sa.Column('end_time', sa.DateTime(timezone=True), nullable=True))
+    # data migration: default duration for the existing shows
+    if is_postgres:
+        op.execute(f"UPDATE shows SET end_time = start_time + interval '{DEFAULT_DURATION_MINUTES} minutes'")
+        # both propagate to the partitions
+        op.alter_column('shows', 'end_time', nullable=False)
+        op.create_check_constraint('ck_shows_end_after_start', 'shows', 'end_time > start_time')
+        op.create_check_constraint('ck_shows_max_duration', 'shows',
+                                   f"end_time <= start_time + interval '{MAX_DURATION_HOURS} hours'")
+    else:
+        # shows without a start_time can't get an end_time, d2f7a9b4c6e1 leaves them out on postgres
+        op.execute('DELETE FROM shows WHERE start_time IS NULL')
+        op.execute(f"UPDATE shows SET end_time = datetime(start_time, '+{DEFAULT_DURATION_MINUTES} minutes')")
+        with op.batch_alter_table('shows', recreate='always') as batch_op:
+            batch_op.alter_column('end_time', existing_type=sa.DateTime(timezone=True), nullable=False)
+            batch_op.create_check_constraint('ck_shows_end_after_start', 'end_time > start_time')
+
+    op.create_table('artist_availability',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('starts_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('ends_at', sa.DateTime(timezone=True), nullable=False),
+        sa.CheckConstraint('ends_at > starts_at', name='ck_artist_availability_ends_after_start'),
+        sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_artist_availability_artist_id_starts_at', 'artist_availability',
+                    ['artist_id', 'starts_at'], unique=False)
+    # data migration: the naive window columns held utc times
+    starts_at, ends_at = (("available_from AT TIME ZONE 'UTC'", "available_to AT TIME ZONE 'UTC'") if is_postgres
+                          else ('available_from', 'available_to'))
+    op.execute(f'INSERT INTO artist_availability (artist_id, starts_at, ends_at) '
+               f'SELECT id, {starts_at}, {ends_at} FROM artists '
+               f'WHERE available_from IS NOT NULL AND available_to > available_from')
+    with op.batch_alter_table('artists') as batch_op:
+        batch_op.drop_column('available_to')
+        batch_op.drop_column('available_from')
+
+
+def downgrade():
+    bind = op.get_bind()
+    is_postgres = bind.dialect.name == 'postgresql'
+    with op.batch_alter_table('artists') as batch_op:
+        batch_op.add_column(sa.Column('available_from', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('available_to', sa.DateTime(), nullable=True))
+    earliest = ('SELECT {column} FROM artist_availability a WHERE a.artist_id = artists.id '
+                'ORDER BY a.starts_at LIMIT 1')
+    if is_postgres:
+        earliest = earliest.replace('{column}', "{column} AT TIME ZONE 'UTC'")
+    op.execute(f"UPDATE artists SET available_from = ({earliest.format(column='a.starts_at')}), "
+               f"available_to = ({earliest.format(column='a.ends_at')})")
+    op.drop_index('ix_artist_availability_artist_id_starts_at', table_name='artist_availability')
+    op.drop_table('artist_availability')
+
+    if is_postgres:
+        op.drop_constraint('ck_shows_max_duration', 'shows', type_='check')
+        op.drop_constraint('ck_shows_end_after_start', 'shows', type_='check')
+        op.drop_column('shows', 'end_time')
+    else:
+        # the recreated table doesn't carry over the reflected CHECK constraints
+        with op.batch_alter_table('shows', recreate='always') as batch_op:
+            batch_op.drop_column('end_time')
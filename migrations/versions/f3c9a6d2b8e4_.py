@@ -0,0 +1,29 @@
+"""edit versions of venues and artists
+
+Revision ID: f3c9a6d2b8e4
+Revises: e8b3d5a1f9c2
+Create Date: 2026-10-18 17:05:12.603418
+
+Existing rows start at version 1. On postgres 11+ a column with a constant default is added without
+rewriting the table.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9a6d2b8e4'
+down_revision = 'e8b3d5a1f9c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venues', 'artists'):
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in ('artists', 'venues'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
@@ -0,0 +1,348 @@
+"""
+Output cache for rendered pages and template fragments.
+
+Pages decorated with @cached_page keep their rendered html keyed by url. Each entry records the
+data versions it was rendered from: one counter per tag ('venues', 'shows', 'venue:3', ...),
+bumped by the write handlers right after their commit. An entry is fresh while its versions match
+the current counters and it is younger than OUTPUT_CACHE_TTL.
+
+A stale entry (versions bumped or TTL passed) is never rebuilt by more than one request at a time:
+the first one takes a short lived rebuild lock and renders, the others are served the stale html
+meanwhile, for at most OUTPUT_CACHE_STALE_TTL past the TTL. Only when there is nothing to serve
+(cold cache, or a client that must read its own writes) do they wait for the rebuild instead.
+
+Fragments rendered through `{% call cache_fragment(name, *parts) %}` are kept in process, keyed by
+the values they are rendered from, so a page re-rendered after one new show reuses every other tile.
+
+The backend is in process by default. With OUTPUT_CACHE_URL=redis://... pages and data versions are
+shared by every worker, any client with redis-py's get/ set/ mget/ incr/ delete (e.g. fakeredis) can
+be passed to RedisBackend too. Counters are stored without expiry, use a volatile-* eviction policy.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, g, request, session
+from markupsafe import Markup
+
+from routing import STICKY_COOKIE
+
+VERSION_PREFIX = 'version:'
+LOCK_PREFIX = 'lock:'
+# seconds between checks while waiting for another request's rebuild
+WAIT_INTERVAL = 0.02
+
+
+class MemoryBackend:
+    """
+    In process backend, least recently used entries go first once maxsize is reached. Counters
+    are kept apart and never evicted.
+    """
+    def __init__(self, maxsize=1024, clock=time.time):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, value)
+        self._entries = OrderedDict()
+        self._counters = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key, value, ttl):
+        """
+        Sets key only when it is missing
+        :return: (bool) True when it was set
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self._clock():
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counters(self, keys):
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _set(self, key, value, ttl):
+        self._entries.pop(key, None)
+        self._entries[key] = (self._clock() + ttl, value)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class RedisBackend:
+    """
+    Redis backend shared by every worker. Values are stored as json. Errors are logged and treated
+    as misses, so a redis outage makes pages render as if uncached instead of failing.
+    """
+    def __init__(self, client, prefix='fyyur:'):
+        """
+        :param client: redis-py compatible client
+        :param prefix: prepended to every key
+        """
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('OUTPUT_CACHE_URL points at redis but the redis package is not installed, '
+                               'pip install redis')
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception as e:
+            logging.error(f"Error in [RedisBackend.get]>>>> Reason: {str(e)}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(self.prefix + key, json.dumps(value), px=max(int(ttl * 1000), 1))
+        except Exception as e:
+            logging.error(f"Error in [RedisBackend.set]>>>> Reason: {str(e)}")
+
+    def add(self, key, value, ttl):
+        try:
+            return bool(self.client.set(self.prefix + key, json.dumps(value), px=max(int(ttl * 1000), 1), nx=True))
+        except Exception as e:
+            # render rather than wait on a lock nobody can release
+            logging.error(f"Error in [RedisBackend.add]>>>> Reason: {str(e)}")
+            return True
+
+    def delete(self, key):
+        try:
+            self.client.delete(self.prefix + key)
+        except Exception as e:
+            logging.error(f"Error in [RedisBackend.delete]>>>> Reason: {str(e)}")
+
+    def incr(self, key):
+        try:
+            return self.client.incr(self.prefix + key)
+        except Exception as e:
+            logging.error(f"Error in [RedisBackend.incr]>>>> Reason: {str(e)}")
+            return None
+
+    def counters(self, keys):
+        try:
+            values = self.client.mget([self.prefix + key for key in keys])
+        except Exception as e:
+            logging.error(f"Error in [RedisBackend.counters]>>>> Reason: {str(e)}")
+            return [None] * len(keys)
+        return [int(value) if value is not None else 0 for value in values]
+
+
+class OutputCache:
+    def __init__(self, backend=None, app=None, clock=time.time):
+        """
+        :param backend: page/ counter backend, defaults to the one OUTPUT_CACHE_URL selects
+        :param clock: time source, wall clock seconds as entries may be shared between hosts
+        """
+        self.backend = backend
+        self.fragments = MemoryBackend()
+        self.ttl = 60
+        self.stale_ttl = 30
+        self.lock_timeout = 10
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.counts = {'hits': 0, 'stale_hits': 0, 'waits': 0, 'renders': 0, 'bypasses': 0, 'bumps': 0,
+                       'fragment_hits': 0, 'fragment_renders': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('OUTPUT_CACHE_URL', '')
+        app.config.setdefault('OUTPUT_CACHE_TTL', 60)
+        app.config.setdefault('OUTPUT_CACHE_STALE_TTL', 30)
+        app.config.setdefault('OUTPUT_CACHE_LOCK_TIMEOUT', 10)
+        app.config.setdefault('OUTPUT_CACHE_SIZE', 1024)
+        app.config.setdefault('OUTPUT_CACHE_FRAGMENT_SIZE', 10000)
+        self.ttl = app.config['OUTPUT_CACHE_TTL']
+        self.stale_ttl = app.config['OUTPUT_CACHE_STALE_TTL']
+        self.lock_timeout = app.config['OUTPUT_CACHE_LOCK_TIMEOUT']
+        url = app.config['OUTPUT_CACHE_URL']
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            self.backend = RedisBackend.from_url(url)
+        elif self.backend is None or isinstance(self.backend, MemoryBackend):
+            self.backend = MemoryBackend(app.config['OUTPUT_CACHE_SIZE'])
+        self.fragments = MemoryBackend(app.config['OUTPUT_CACHE_FRAGMENT_SIZE'])
+        app.add_template_global(self.fragment, 'cache_fragment')
+        app.extensions['output_cache'] = self
+
+    def versions(self, tags):
+        """
+        :param tags: data tags the output is built from
+        :return: (str) current version of each tag, e.g. 'shows=4,venues=12'. None when unknown
+        """
+        tags = sorted(tags)
+        values = self.backend.counters([VERSION_PREFIX + tag for tag in tags])
+        if any(value is None for value in values):
+            return None
+        return ','.join(f'{tag}={value}' for tag, value in zip(tags, values))
+
+    def bump(self, *tags):
+        """
+        Moves the data version of every tag forward, output rendered from the old versions turns stale
+        """
+        for tag in tags:
+            self.backend.incr(VERSION_PREFIX + tag)
+        self._count('bumps', len(tags))
+
+    def get_or_render(self, key, versions, render, allow_stale=True):
+        """
+        Returns the cached output for key, rendering it when stale or missing. Only one request at a
+        time renders a key, the others are served the stale output or wait for the render.
+        :param key: cache key
+        :param versions: data versions the output is rendered from, see versions()
+        :param render: no argument callable returning the output as str
+        :param allow_stale: False makes the request wait for a fresh render instead of serving stale output
+        :return: (str) output
+        """
+        if self.ttl <= 0 or versions is None:
+            self._count('bypasses')
+            return render()
+        entry = self.backend.get(key)
+        if self._fresh(entry, versions):
+            self._count('hits')
+            return entry['body']
+        lock_key = LOCK_PREFIX + key
+        locked = self.backend.add(lock_key, 1, self.lock_timeout)
+        if not locked:
+            if entry is not None and allow_stale:
+                self._count('stale_hits')
+                return entry['body']
+            self._count('waits')
+            entry = self._wait(key, lock_key, versions)
+            if entry is not None:
+                self._count('hits')
+                return entry['body']
+        self._count('renders')
+        try:
+            body = str(render())
+            self.backend.set(key, {'versions': versions, 'at': self._clock(), 'body': body},
+                             self.ttl + self.stale_ttl)
+        finally:
+            if locked:
+                self.backend.delete(lock_key)
+        return body
+
+    def fragment(self, name, *parts, caller):
+        """
+        Template global caching the body of a call block, keyed by name and the values it renders:
+        {% call cache_fragment('show-tile', show.id, show.start_time) %}...{% endcall %}
+        """
+        key = (name,) + parts
+        try:
+            hash(key)
+        except TypeError:
+            key = (name, repr(parts))
+        body = self.fragments.get(key)
+        if body is None:
+            self._count('fragment_renders')
+            body = Markup(caller())
+            self.fragments.set(key, body, self.ttl)
+        else:
+            self._count('fragment_hits')
+        return body
+
+    def clear(self):
+        if isinstance(self.backend, MemoryBackend):
+            self.backend.clear()
+        self.fragments.clear()
+
+    def stats(self):
+        """
+        :return: (dict) hit/ stale/ render counters and the backend in use
+        """
+        with self._lock:
+            counts = dict(self.counts)
+        lookups = counts['hits'] + counts['stale_hits'] + counts['renders']
+        counts.update({
+            'hit_ratio': (counts['hits'] + counts['stale_hits']) / lookups if lookups else 0.0,
+            'backend': type(self.backend).__name__,
+            'fragments': len(self.fragments),
+            'ttl': self.ttl,
+            'stale_ttl': self.stale_ttl,
+        })
+        return counts
+
+    def _fresh(self, entry, versions):
+        return (entry is not None and entry['versions'] == versions
+                and self._clock() - entry['at'] < self.ttl)
+
+    def _wait(self, key, lock_key, versions):
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            entry = self.backend.get(key)
+            if self._fresh(entry, versions):
+                return entry
+            if self.backend.get(lock_key) is None:
+                # the render failed or was done from older versions, render it here
+                return None
+        return None
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+
+def cached_page(*tags):
+    """
+    Caches the html of a GET view per url, until any of the tags' data versions is bumped
+    :param tags: data tags the page is built from
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = current_app.extensions['output_cache']
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                # flashed messages are part of the layout, such a page is one user's
+                return view(*args, **kwargs)
+            versions = cache.versions(tags)
+            # the view data cache keys on these too, so a page is never rendered from older data
+            g.page_versions = versions
+            # a client reading its own writes (see routing.py) must not get the stale page
+            allow_stale = not request.cookies.get(STICKY_COOKIE, type=float, default=0) > time.time()
+            body = cache.get_or_render(f'page:{request.full_path}', versions, lambda: view(*args, **kwargs),
+                                       allow_stale=allow_stale)
+            return Response(body, mimetype='text/html')
+        return wrapper
+    return decorator
@@ -0,0 +1,113 @@
+import base64
+import json
+from datetime import datetime
+
+import dateutil.parser
+from sqlalchemy import literal, tuple_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values, direction):
+    """
+    Serializes the sort key of a boundary row into an opaque url safe token
+    :param values: sort key values of the row
+    :param direction: 'next' or 'prev'
+    :return: (str) cursor
+    """
+    payload = {'d': direction, 'k': [value.isoformat() if isinstance(value, datetime) else value for value in values]}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor, sort_columns):
+    """
+    Reverse of encode_cursor, datetime keys are parsed back based on the column type
+    :param cursor: token built by encode_cursor
+    :param sort_columns: the columns the cursor was built for
+    :return: (list)values, (str)direction
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        values, direction = payload['k'], payload['d']
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f'Malformed cursor: {e}')
+    if direction not in ('next', 'prev') or len(values) != len(sort_columns):
+        raise InvalidCursor('Cursor does not match this listing')
+    return [decode_value(column, value) for column, value in zip(sort_columns, values)], direction
+
+
+def decode_value(column, value):
+    """
+    :return: the cursor value as the column's python type, datetimes are parsed back
+    :raises InvalidCursor: when it isn't of that type
+    """
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime:
+        try:
+            return dateutil.parser.isoparse(value)
+        except (ValueError, TypeError, OverflowError) as e:
+            raise InvalidCursor(f'Malformed cursor: {e}')
+    if python_type is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    # bool is an int, only take it for boolean columns
+    if not isinstance(value, python_type) or isinstance(value, bool) != (python_type is bool):
+        raise InvalidCursor(f'Cursor value for {column.name} is not a {python_type.__name__}')
+    return value
+
+
+def keyset_page(query, sort_columns, cursor=None, per_page=20, descending=False):
+    """
+    Fetches one page of query using keyset pagination instead of OFFSET, so each page costs the same
+    no matter how deep it is. The sort columns must be a unique key (end them with the primary key).
+    :param query: query to paginate, must not be ordered yet
+    :param sort_columns: columns making up the sort key
+    :param cursor: token from a previous page, None for the first page
+    :param per_page: page size
+    :param descending: sort direction of the whole key
+    :return: (dict) with items, next_cursor and prev_cursor
+    """
+    key = tuple_(*sort_columns)
+    direction = 'next'
+    if cursor:
+        values, direction = decode_cursor(cursor, sort_columns)
+        boundary = tuple_(*[literal(value, column.type) for column, value in zip(sort_columns, values)])
+        # the row comparison is spelled out on the leading column too, which the planner can use
+        # for index ranges and to skip partitions (shows are partitioned on start_time)
+        leading, leading_value = sort_columns[0], literal(values[0], sort_columns[0].type)
+        # going forward on a descending listing (or backwards on an ascending one) means smaller keys
+        if descending == (direction == 'next'):
+            query = query.filter(key < boundary)
+            if values[0] is not None:
+                query = query.filter(leading <= leading_value)
+        else:
+            query = query.filter(key > boundary)
+            if values[0] is not None:
+                query = query.filter(leading >= leading_value)
+    # a 'prev' page is read in the opposite order so the LIMIT picks the rows right before the boundary
+    order_desc = descending == (direction == 'next')
+    query = query.order_by(*[column.desc() if order_desc else column.asc() for column in sort_columns])
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    def row_key(row):
+        return [getattr(row, column.key) for column in sort_columns]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if direction == 'next':
+            next_cursor = encode_cursor(row_key(rows[-1]), 'next') if has_more else None
+            prev_cursor = encode_cursor(row_key(rows[0]), 'prev') if cursor else None
+        else:
+            next_cursor = encode_cursor(row_key(rows[-1]), 'next')
+            prev_cursor = encode_cursor(row_key(rows[0]), 'prev') if has_more else None
+    return {'items': rows, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
@@ -0,0 +1,251 @@
+"""
+Range partitioning of the shows table by start_time, postgres only.
+
+Migration d2f7a9b4c6e1 turns shows into a table partitioned by RANGE (start_time) with one partition
+per SHOWS_PARTITION_INTERVAL ('month' or 'year') plus shows_default, which catches shows outside of
+every range so an insert never fails for lack of a partition. Queries bounded on start_time (upcoming
+shows, the /shows keyset) only scan the partitions they can match.
+
+    flask shows-partitions list
+    flask shows-partitions create [--ahead 12]
+    flask shows-partitions archive --before 2020-01-01 [--schema archive | --drop]
+
+`create` adds the partitions for the next SHOWS_PARTITIONS_AHEAD intervals, run it on a schedule
+(e.g. daily from cron, `flask bootstrap` runs it too). A new partition is built as a standalone table,
+filled with the matching rows of shows_default and then attached, which only takes a SHARE UPDATE
+EXCLUSIVE lock on shows, so reads and writes of the other partitions carry on meanwhile.
+
+`archive` detaches the partitions ending before a date, then moves them to another schema (they stay
+queryable there, e.g. for a pg_dump) or drops them. Postgres can't detach CONCURRENTLY while shows_default
+exists, so the detach briefly locks shows. Each partition is detached, its shows get tombstones (the
+change feed reports them as deleted) and it is moved/ dropped in one transaction.
+"""
+import re
+from datetime import datetime
+
+import click
+import dateutil.parser
+import pytz
+from dateutil.relativedelta import relativedelta
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import CheckConstraint, MetaData, PrimaryKeyConstraint, text
+
+from booking import MAX_SHOW_DURATION
+
+shows_partitions_cli = AppGroup('shows-partitions', help='Manage the range partitions of the shows table.')
+
+PARENT = 'shows'
+DEFAULT_PARTITION = 'shows_default'
+INTERVALS = {'month': relativedelta(months=1), 'year': relativedelta(years=1)}
+
+PARTITIONS_SQL = text(
+    'SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound FROM pg_inherits i '
+    'JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:parent AS regclass)')
+RANGE_BOUND = re.compile(r"FOR VALUES FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def interval_start(moment, interval):
+    """
+    :param moment: aware datetime
+    :param interval: 'month' or 'year'
+    :return: (datetime) utc start of the month/ year moment falls in
+    """
+    moment = moment.astimezone(pytz.utc)
+    start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return start.replace(month=1) if interval == 'year' else start
+
+
+def partition_name(start, interval):
+    return f'{PARENT}_p{start:%Y}' if interval == 'year' else f'{PARENT}_p{start:%Y_%m}'
+
+
+def is_partitioned(connection):
+    """
+    :return: (bool) True when shows is a partitioned table, False elsewhere (e.g. sqlite, before the migration)
+    """
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.oid = to_regclass(:parent)"), parent=PARENT).scalar() is not None
+
+
+def has_default_partition(connection):
+    return connection.execute(text(
+        'SELECT partdefid <> 0 FROM pg_partitioned_table WHERE partrelid = to_regclass(:parent)'),
+        parent=PARENT).scalar()
+
+
+def list_partitions(connection):
+    """
+    :return: (list) (name, lower, upper) of the range partitions ordered by range, shows_default left out
+    """
+    partitions = []
+    for row in connection.execute(PARTITIONS_SQL, parent=PARENT):
+        match = RANGE_BOUND.match(row.bound)
+        if match:
+            lower, upper = (dateutil.parser.parse(value).astimezone(pytz.utc) for value in match.groups())
+            partitions.append((row.name, lower, upper))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(connection, name, lower, upper):
+    """
+    Adds the [lower, upper) partition, moving the rows shows_default holds for that range into it first
+    :param connection: connection in a transaction
+    """
+    # partition bounds have to be literals
+    lower_literal, upper_literal = (f"'{bound.isoformat()}'" for bound in (lower, upper))
+    # ATTACH requires the CHECK constraints of the parent on the partition
+    connection.execute(text(f'CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    connection.execute(text(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE start_time >= :lower AND start_time < :upper '
+        f'RETURNING *) INSERT INTO {name} SELECT * FROM moved'), lower=lower, upper=upper)
+    # lets ATTACH skip scanning the new partition to validate its rows
+    connection.execute(text(f'ALTER TABLE {name} ADD CONSTRAINT {name}_range '
+                            f'CHECK (start_time >= {lower_literal} AND start_time < {upper_literal})'))
+    connection.execute(text(f'ALTER TABLE {PARENT} ATTACH PARTITION {name} '
+                            f'FOR VALUES FROM ({lower_literal}) TO ({upper_literal})'))
+    connection.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT {name}_range'))
+
+
+def partitioned_table(table):
+    """
+    :param table: the shows Table of the models
+    :return: copy of it declared as the partitioned parent, whose primary key has to include start_time
+    """
+    metadata = MetaData()
+    for referred in {foreign_key.column.table for foreign_key in table.foreign_keys}:
+        referred.tometadata(metadata)
+    parent = table.tometadata(metadata)
+    parent.append_constraint(PrimaryKeyConstraint('id', 'start_time', name=f'{PARENT}_pkey'))
+    parent.c.id.autoincrement = True
+    parent.dialect_options['postgresql']['partition_by'] = 'RANGE (start_time)'
+    # postgres only like the table itself, migration e8b3d5a1f9c2 adds it the same way
+    hours = int(MAX_SHOW_DURATION.total_seconds() // 3600)
+    parent.append_constraint(CheckConstraint(f"end_time <= start_time + interval '{hours} hours'",
+                                             name='ck_shows_max_duration'))
+    return parent
+
+
+def create_partitioned_shows(connection, table, interval='month', ahead=12):
+    """
+    Replaces the still empty shows table of a freshly created schema with the partitioned one
+    :param connection: connection in a transaction
+    :param table: the shows Table of the models
+    """
+    connection.execute(text(f'DROP TABLE {PARENT}'))
+    partitioned_table(table).create(connection)
+    connection.execute(text(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT'))
+    ensure_partitions(connection, interval, ahead)
+
+
+def ensure_partitions(connection, interval='month', ahead=12, now=None):
+    """
+    Creates the missing partitions from the end of the last one (or the current interval) up to
+    `ahead` intervals from now
+    :param connection: connection in a transaction
+    :param interval: 'month' or 'year', the size of the new partitions
+    :param ahead: number of future intervals to cover
+    :return: (list) names of the created partitions
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"SHOWS_PARTITION_INTERVAL must be one of {', '.join(INTERVALS)}, not {interval!r}")
+    if not is_partitioned(connection):
+        return []
+    if now is None:
+        now = datetime.now(pytz.utc)
+    partitions = list_partitions(connection)
+    lower = partitions[-1][2] if partitions else interval_start(now, interval)
+    until = interval_start(now, interval) + INTERVALS[interval] * (ahead + 1)
+    created = []
+    while lower < until:
+        # a partition following one of another interval (e.g. after switching to 'year') is cut short
+        # at the next interval boundary so later ones line up
+        upper = min(interval_start(lower, interval) + INTERVALS[interval], until)
+        name = partition_name(lower, interval)
+        create_partition(connection, name, lower, upper)
+        created.append(name)
+        lower = upper
+    return created
+
+
+def archive_partitions(engine, before, schema=None):
+    """
+    Detaches the partitions whose whole range ends before `before`
+    :param engine: db engine
+    :param before: aware datetime
+    :param schema: schema the detached partitions are moved to, None drops them
+    :return: (list) names of the archived partitions
+    """
+    with engine.connect() as connection:
+        if not is_partitioned(connection):
+            return []
+        partitions = [name for name, _, upper in list_partitions(connection) if upper <= before]
+        # refused while the table has a default partition
+        concurrently = connection.dialect.server_version_info >= (14,) and not has_default_partition(connection)
+    if schema and partitions:
+        with engine.begin() as connection:
+            connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS {schema}'))
+    archived = []
+    for name in partitions:
+        if concurrently:
+            # can't run inside a transaction block
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.execute(text(f'ALTER TABLE {PARENT} DETACH PARTITION {name} CONCURRENTLY'))
+        with engine.begin() as connection:
+            if not concurrently:
+                connection.execute(text(f'ALTER TABLE {PARENT} DETACH PARTITION {name}'))
+            # the shows left the table, the change feed reports them as deleted
+            connection.execute(text(f"INSERT INTO tombstones (table_name, row_id) SELECT '{PARENT}', id FROM {name}"))
+            if schema:
+                connection.execute(text(f'ALTER TABLE {name} SET SCHEMA {schema}'))
+            else:
+                connection.execute(text(f'DROP TABLE {name}'))
+        archived.append(name)
+    return archived
+
+
+def get_engine():
+    return current_app.extensions['sqlalchemy'].db.engine
+
+
+@shows_partitions_cli.command('list')
+def list_command():
+    """Show the partitions of the shows table and their row counts."""
+    with get_engine().connect() as connection:
+        if not is_partitioned(connection):
+            raise click.ClickException('shows is not partitioned, partitioning needs postgres and `flask db upgrade`')
+        for name, lower, upper in list_partitions(connection):
+            rows = connection.execute(text(f'SELECT count(*) FROM {name}')).scalar()
+            click.echo(f'{name:<20} {lower:%Y-%m-%d} .. {upper:%Y-%m-%d} {rows:>10} rows')
+        rows = connection.execute(text(f'SELECT count(*) FROM {DEFAULT_PARTITION}')).scalar()
+        click.echo(f"{DEFAULT_PARTITION:<20} {'out of range':<24} {rows:>10} rows")
+
+
+@shows_partitions_cli.command('create')
+@click.option('--ahead', type=int, default=None, help='Future intervals to cover, defaults to SHOWS_PARTITIONS_AHEAD.')
+def create_command(ahead):
+    """Create the partitions for the coming months/ years."""
+    config = current_app.config
+    with get_engine().begin() as connection:
+        if not is_partitioned(connection):
+            raise click.ClickException('shows is not partitioned, partitioning needs postgres and `flask db upgrade`')
+        created = ensure_partitions(connection, config['SHOWS_PARTITION_INTERVAL'],
+                                    config['SHOWS_PARTITIONS_AHEAD'] if ahead is None else ahead)
+    click.echo(f"created {', '.join(created)}" if created else 'no partition missing')
+
+
+@shows_partitions_cli.command('archive')
+@click.option('--before', required=True, type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Archive the partitions ending on or before this date.')
+@click.option('--schema', default='archive', show_default=True, help='Schema the detached partitions go to.')
+@click.option('--drop', is_flag=True, help='Drop the detached partitions instead of keeping them.')
+def archive_command(before, schema, drop):
+    """Detach old partitions of the shows table."""
+    archived = archive_partitions(get_engine(), pytz.utc.localize(before), schema=None if drop else schema)
+    if not archived:
+        click.echo('no partition ends before that date')
+    for name in archived:
+        click.echo(f'dropped {name}' if drop else f'moved {name} to {schema}.{name}')
@@ -0,0 +1,156 @@
+"""
+Read replica routing.
+
+When SQLALCHEMY_BINDS has a 'replica' entry, reads made while handling GET/ HEAD/ OPTIONS requests
+go to the replica and everything else goes to the primary. A view can pin its route with
+@use_primary (e.g. edit forms, which must not show stale values) or @use_replica (e.g. the POST
+search forms, which only read). Flushes and UPDATE/ DELETE/ INSERT statements always go to the
+primary, as does anything outside of a request (CLI, migrations, seeding).
+
+After a request commits, the client gets a short lived cookie and its next requests read from the
+primary for REPLICA_STICKY_SECONDS, so the redirect after a submission shows what was just written.
+The replica's lag is checked every REPLICA_LAG_CHECK_INTERVAL seconds, reads fall back to the
+primary while it lags more than REPLICA_MAX_LAG_SECONDS or can't be reached.
+"""
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm, text
+from sqlalchemy.sql.dml import UpdateBase
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_COOKIE = 'primary_until'
+REPLICA_BIND = 'replica'
+
+# 0 when the replica has replayed everything it received, otherwise the age of the last replayed transaction
+REPLICA_LAG_SQL = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+
+
+def use_primary(view):
+    """
+    Routes every query of the view to the primary
+    """
+    view.db_route = 'primary'
+    return view
+
+
+def use_replica(view):
+    """
+    Lets the reads of a non GET view go to the replica, writes still go to the primary
+    """
+    view.db_route = 'replica'
+    return view
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        if (not self._flushing and not isinstance(clause, UpdateBase)
+                and has_request_context() and g.get('db_route') == 'replica'):
+            router = self.app.extensions.get('replica_router')
+            engine = router.replica_engine() if router is not None else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if has_request_context():
+        g.db_committed = True
+
+
+class ReplicaRouter:
+    def __init__(self, db, app=None):
+        self.db = db
+        self._lock = threading.Lock()
+        # engine url -> (checked_at, lag seconds or None when the check failed)
+        self._lag = {}
+        self.counts = {'replica': 0, 'primary': 0, 'sticky': 0, 'lag_fallback': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REPLICA_MAX_LAG_SECONDS', 5)
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+        app.config.setdefault('REPLICA_LAG_CHECK_INTERVAL', 5)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.extensions['replica_router'] = self
+
+    def _before_request(self):
+        view = current_app.view_functions.get(request.endpoint)
+        route = getattr(view, 'db_route', None) or ('replica' if request.method in SAFE_METHODS else 'primary')
+        if route == 'replica' and not (current_app.config.get('SQLALCHEMY_BINDS') or {}).get(REPLICA_BIND):
+            route = 'primary'
+        elif route == 'replica' and request.cookies.get(STICKY_COOKIE, type=float, default=0) > time.time():
+            # read your own writes
+            route = 'primary'
+            self._count('sticky')
+        g.db_route = route
+        self._count(route)
+
+    def _after_request(self, response):
+        if g.get('db_committed'):
+            sticky_seconds = current_app.config['REPLICA_STICKY_SECONDS']
+            response.set_cookie(STICKY_COOKIE, str(int(time.time() + sticky_seconds)), max_age=sticky_seconds,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def replica_engine(self):
+        """
+        :return: the replica engine, or None when reads should go to the primary instead
+        """
+        engine = self.db.get_engine(current_app, bind=REPLICA_BIND)
+        lag = self.replica_lag(engine)
+        if lag is None or lag > current_app.config['REPLICA_MAX_LAG_SECONDS']:
+            if not g.get('db_lag_fallback'):
+                g.db_lag_fallback = True
+                self._count('lag_fallback')
+            return None
+        return engine
+
+    def replica_lag(self, engine):
+        """
+        :return: replication lag in seconds, cached for REPLICA_LAG_CHECK_INTERVAL, None when unreachable
+        """
+        key = str(engine.url)
+        now = time.monotonic()
+        with self._lock:
+            checked = self._lag.get(key)
+            if checked is not None and now - checked[0] < current_app.config['REPLICA_LAG_CHECK_INTERVAL']:
+                return checked[1]
+            # other threads keep using the previous value while this one checks
+            self._lag[key] = (now, checked[1] if checked is not None else 0.0)
+        lag = 0.0
+        if engine.dialect.name == 'postgresql':
+            try:
+                with engine.connect() as connection:
+                    lag = float(connection.execute(REPLICA_LAG_SQL).scalar() or 0)
+            except Exception as e:
+                logging.error(f"Error in [replica_lag]>>>> Reason: {str(e)}")
+                lag = None
+        with self._lock:
+            self._lag[key] = (time.monotonic(), lag)
+        return lag
+
+    def stats(self):
+        """
+        :return: (dict) requests routed to each side and the last measured lag per replica
+        """
+        with self._lock:
+            return {'requests': dict(self.counts),
+                    'lag_seconds': {key.split('@')[-1]: lag for key, (_, lag) in self._lag.items()}}
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
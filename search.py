@@ -0,0 +1,79 @@
+"""
+Name and city/state search for venues and artists.
+
+When the pg_trgm extension is installed the matches are ranked by trigram similarity and the
+ILIKE filter is served by the *_trgm GIN indexes (see migration 9d4e1a7c3b52). Without it we fall
+back to the plain ILIKE scan ordered by name.
+"""
+from sqlalchemy import and_, func
+
+# engine url -> whether pg_trgm is installed, checked once per engine
+_trigram_support = {}
+
+
+def trigram_available(session):
+    """
+    :param session: db session
+    :return: (bool) True when the bound db is postgres with pg_trgm installed
+    """
+    engine = session.get_bind()
+    key = str(engine.url)
+    if key not in _trigram_support:
+        available = False
+        if engine.dialect.name == 'postgresql':
+            available = session.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").scalar() is not None
+        _trigram_support[key] = available
+    return _trigram_support[key]
+
+
+def parse_city_state(city_state_text):
+    """
+    :param city_state_text: 'city, state' text from the search form
+    :return: (city, state) or None when the text is not in that shape
+    """
+    result = city_state_text.split(',')
+    if len(result) != 2:
+        return None
+    return result[0].strip(), result[1].strip()
+
+
+def contains(column, text):
+    """
+    Case insensitive substring match, LIKE wildcards typed by the user are matched literally
+    """
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return column.ilike(f'%{escaped}%', escape='\\')
+
+
+def search_query(session, model, search_term, city_state_text='', genre=None, limit=50, use_trigram=None):
+    """
+    Builds the ranked search query on model (Venue or Artist). The search term matches on name,
+    when it is empty 'city, state' text matches on city and state instead.
+    :param session: db session
+    :param model: Venue or Artist
+    :param search_term: name search text
+    :param city_state_text: 'city, state' search text
+    :param genre: only rows tagged with this genre name
+    :param limit: max results
+    :param use_trigram: force the trigram (True) or LIKE (False) path, None to detect
+    :return: query of model rows, best match first
+    """
+    if use_trigram is None:
+        use_trigram = trigram_available(session)
+    city_state = None if search_term else parse_city_state(city_state_text)
+    if city_state is not None:
+        city, state = city_state
+        clause = and_(contains(model.city, city), contains(model.state, state))
+        rank = func.similarity(model.city, city) + func.similarity(model.state, state)
+    else:
+        search_term = search_term or ''
+        clause = contains(model.name, search_term)
+        rank = func.similarity(model.name, search_term)
+    query = session.query(model).filter(clause)
+    if genre:
+        query = query.filter(model.genres.any(name=genre))
+    if use_trigram:
+        query = query.order_by(rank.desc(), model.id)
+    else:
+        query = query.order_by(model.name, model.id)
+    return query.limit(limit)
@@ -0,0 +1,416 @@
+"""
+Bulk seeding and data import, registered on the app as the `flask seed` command group.
+
+    flask seed venues fixtures/venues.jsonl
+    flask seed artists fixtures/artists.jsonl
+    flask seed shows fixtures/shows.jsonl
+    flask seed synthetic --venues 10000 --artists 10000 --shows 1000000
+
+Files are streamed as CSV or JSON Lines (picked by extension) and written in batches, with
+COPY on postgres and executemany elsewhere. Each batch is its own transaction. Ids are
+allocated here instead of by the db, so genre links and show references don't have to be
+read back. Don't run an import while the app is also inserting into the same table.
+`flask export` writes files in the same formats.
+"""
+import csv
+import io
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+import click
+import dateutil.parser
+import pytz
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from booking import DEFAULT_SHOW_DURATION, InvalidProposal, check_duration
+from geo import geocode, load_gazetteer
+from show_counters import OWNER_KEYS, refresh_show_counters
+
+seed_cli = AppGroup('seed', help='Bulk load venues, artists and shows.')
+
+DEFAULT_BATCH_SIZE = 5000
+GENRE_ASSOCIATIONS = {'venues': ('venue_genres', 'venue_id'), 'artists': ('artist_genres', 'artist_id')}
+COUNTER_COLUMNS = ('upcoming_shows_count', 'past_shows_count', 'next_show_at')
+
+
+def get_db():
+    return current_app.extensions['sqlalchemy'].db
+
+
+def read_records(path):
+    """
+    Streams records from a .csv file (header row required) or a .jsonl/ .ndjson file
+    :param path: file path
+    :return: generator of dicts
+    """
+    if path.endswith('.csv'):
+        with open(path, newline='') as f:
+            for record in csv.DictReader(f):
+                # csv has no lists, genres are given as "Jazz,Folk" and availability windows as
+                # ISO 8601 intervals, "2035-01-01T00:00:00+00:00/2035-02-01T00:00:00+00:00,..."
+                for key in ('genres', 'availability'):
+                    if record.get(key):
+                        record[key] = record[key].split(',')
+                yield {key: (value if value != '' else None) for key, value in record.items()}
+    elif path.endswith('.jsonl') or path.endswith('.ndjson'):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise click.BadParameter(f'{path}: expected a .csv, .jsonl or .ndjson file')
+
+
+def parse_datetime(value):
+    if isinstance(value, str):
+        return dateutil.parser.isoparse(value)
+    return value
+
+
+def parse_boolean(value):
+    # csv fields are strings
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 't', 'yes', 'y', '1')
+    return value
+
+
+def parse_window(window):
+    """
+    :param window: {'starts_at': ..., 'ends_at': ...} or an ISO 8601 interval string "start/end"
+    :return: (dict) starts_at and ends_at datetimes
+    """
+    if isinstance(window, str):
+        starts_at, _, ends_at = window.partition('/')
+        window = {'starts_at': starts_at, 'ends_at': ends_at}
+    return {'starts_at': parse_datetime(window['starts_at']), 'ends_at': parse_datetime(window['ends_at'])}
+
+
+def batched(records, size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+class BulkLoader:
+    """
+    Writes batches of rows into one table, reporting throughput as it goes
+    """
+    def __init__(self, table_name, batch_size=DEFAULT_BATCH_SIZE, use_copy=None):
+        self.db = get_db()
+        self.table = self.db.metadata.tables[table_name]
+        self.batch_size = batch_size
+        if use_copy is None:
+            use_copy = self.db.engine.dialect.name == 'postgresql'
+        self.use_copy = use_copy
+        self.next_id = self.db.session.execute(text(f'SELECT coalesce(max(id), 0) + 1 FROM {table_name}')).scalar()
+        self.db.session.close()
+        self.rows = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+
+    def allocate_id(self):
+        allocated = self.next_id
+        self.next_id += 1
+        return allocated
+
+    def load(self, rows, connection):
+        """
+        Inserts one batch of rows on connection
+        :param rows: dicts keyed by column name, all rows share the same keys
+        """
+        if not rows:
+            return
+        if self.use_copy:
+            copy_rows(connection, self.table.name, rows)
+        else:
+            connection.execute(self.table.insert(), rows)
+        self.rows += len(rows)
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0
+        skipped = f', {self.skipped} skipped' if self.skipped else ''
+        prefix = 'done' if final else '...'
+        click.echo(f'{prefix} {self.table.name}: {self.rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/s){skipped}')
+
+    def finish(self):
+        if self.db.engine.dialect.name == 'postgresql':
+            # ids were assigned here, move the serial sequence past them
+            self.db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{self.table.name}', 'id'), "
+                f"(SELECT coalesce(max(id), 1) FROM {self.table.name}))"))
+            self.db.session.commit()
+        self.report(final=True)
+
+
+def copy_rows(connection, table_name, rows):
+    """
+    Streams rows through postgres COPY, much faster than INSERT for large batches
+    """
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if row[column] is None else
+                         row[column].isoformat() if isinstance(row[column], datetime) else row[column]
+                         for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+def genre_ids(connection, names, known):
+    """
+    Resolves genre names to ids, inserting the missing ones
+    :param names: genre names used by the batch
+    :param known: name -> id cache shared across batches, updated in place
+    """
+    genres = get_db().metadata.tables['genres']
+    missing = sorted(set(names) - known.keys())
+    if missing:
+        for row in connection.execute(genres.select().where(genres.c.name.in_(missing))):
+            known[row.name] = row.id
+        missing = [name for name in missing if name not in known]
+        if missing:
+            connection.execute(genres.insert(), [{'name': name} for name in missing])
+            for row in connection.execute(genres.select().where(genres.c.name.in_(missing))):
+                known[row.name] = row.id
+    return known
+
+
+def leave_to_server_defaults(rows, names):
+    """
+    Drops the columns with a server default (created_at, updated_at, version) that no row of a batch
+    sets, the db fills them in instead of python computing a value per row. A batch setting some of
+    them gets the same values the db would use for the rows that don't.
+    :param rows: dicts of one batch, all with the same keys
+    :param names: names of the columns with a server default
+    """
+    now = datetime.now(pytz.utc)
+    for name in names:
+        if all(row[name] is None for row in rows):
+            for row in rows:
+                del row[name]
+        else:
+            for row in rows:
+                if row[name] is None:
+                    row[name] = 1 if name == 'version' else now
+
+
+def load_entities(table_name, records, batch_size, use_copy=None, name_ids=None):
+    """
+    Loads venues or artists, with their genres
+    :param table_name: 'venues' or 'artists'
+    :param records: iterable of dicts, unknown keys are ignored
+    :param name_ids: optional dict filled with name -> id for resolving show references
+    :return: BulkLoader with the counters
+    """
+    loader = BulkLoader(table_name, batch_size, use_copy)
+    db = loader.db
+    # the counters are left to their server defaults, load_shows counts them
+    columns = [column.name for column in loader.table.columns if column.name not in COUNTER_COLUMNS]
+    server_defaults = [column.name for column in loader.table.columns
+                       if column.server_default is not None and column.name in columns]
+    datetime_columns = [column.name for column in loader.table.columns
+                        if isinstance(column.type, db.DateTime) and column.name in columns]
+    boolean_columns = [column.name for column in loader.table.columns if isinstance(column.type, db.Boolean)]
+    float_columns = [column.name for column in loader.table.columns if isinstance(column.type, db.Float)]
+    # e.g. a venue's city and state, missing ones load as empty strings
+    required_text_columns = [column.name for column in loader.table.columns
+                             if isinstance(column.type, db.String) and not column.nullable]
+    # venues without coordinates get those of their city, see geo.py
+    gazetteer = load_gazetteer(current_app.config['GAZETTEER_PATH']) if 'latitude' in columns else None
+    association_name, owner_key = GENRE_ASSOCIATIONS[table_name]
+    association = db.metadata.tables[association_name]
+    availability = db.metadata.tables['artist_availability']
+    known_genres = {}
+    for batch in batched(records, batch_size):
+        rows = []
+        links = []
+        windows = []
+        for record in batch:
+            row = {column: record.get(column) for column in columns}
+            for column in datetime_columns:
+                row[column] = parse_datetime(row[column])
+            for column in boolean_columns:
+                row[column] = parse_boolean(row[column])
+            for column in float_columns:
+                row[column] = float(row[column]) if row[column] is not None else None
+            for column in required_text_columns:
+                if row[column] is None:
+                    row[column] = ''
+            if gazetteer is not None and row['latitude'] is None:
+                row['latitude'], row['longitude'] = geocode(gazetteer, row['city'], row['state']) or (None, None)
+            row['id'] = int(row['id']) if row['id'] else loader.allocate_id()
+            rows.append(row)
+            links.extend((row['id'], name.strip()) for name in record.get('genres') or [] if name.strip())
+            # an artist's available_from/ available_to become its availability window
+            if table_name == 'artists' and record.get('available_from') and record.get('available_to'):
+                windows.append({'artist_id': row['id'], 'starts_at': parse_datetime(record['available_from']),
+                                'ends_at': parse_datetime(record['available_to'])})
+            if table_name == 'artists':
+                windows.extend(dict(parse_window(window), artist_id=row['id'])
+                               for window in record.get('availability') or [])
+            if name_ids is not None:
+                name_ids.setdefault(row['name'], row['id'])
+        loader.next_id = max(loader.next_id, max(row['id'] for row in rows) + 1)
+        leave_to_server_defaults(rows, server_defaults)
+        with db.engine.begin() as connection:
+            loader.load(rows, connection)
+            if links:
+                genre_ids(connection, [name for _, name in links], known_genres)
+                connection.execute(association.insert(), [
+                    {owner_key: owner_id, 'genre_id': known_genres[name]} for owner_id, name in set(links)])
+            if windows:
+                connection.execute(availability.insert(), windows)
+        loader.report()
+    loader.finish()
+    return loader
+
+
+def existing_name_ids(table_name):
+    db = get_db()
+    rows = db.session.execute(text(f'SELECT name, min(id) AS id FROM {table_name} GROUP BY name'))
+    name_ids = {row.name: row.id for row in rows}
+    db.session.close()
+    return name_ids
+
+
+def load_shows(records, batch_size, use_copy=None, venue_ids=None, artist_ids=None):
+    """
+    Loads shows, a record references its venue/ artist by venue_id/ artist_id or by
+    venue_name/ artist_name. Records with unknown references are skipped. A show ends at its
+    end_time, or duration_minutes after it starts, or DEFAULT_SHOW_DURATION after it starts. Shows
+    lasting longer than booking.MAX_SHOW_DURATION (or not at all) are skipped too.
+    :param venue_ids: name -> id, read from the db when not given
+    :param artist_ids: name -> id, read from the db when not given
+    :return: BulkLoader with the counters
+    """
+    loader = BulkLoader('shows', batch_size, use_copy)
+    if venue_ids is None:
+        venue_ids = existing_name_ids('venues')
+    if artist_ids is None:
+        artist_ids = existing_name_ids('artists')
+    for batch in batched(records, batch_size):
+        rows = []
+        for record in batch:
+            venue_id = record.get('venue_id') or venue_ids.get(record.get('venue_name'))
+            artist_id = record.get('artist_id') or artist_ids.get(record.get('artist_name'))
+            if venue_id is None or artist_id is None or not record.get('start_time'):
+                loader.skipped += 1
+                continue
+            start_time = parse_datetime(record['start_time'])
+            if record.get('end_time'):
+                end_time = parse_datetime(record['end_time'])
+            elif record.get('duration_minutes'):
+                end_time = start_time + timedelta(minutes=int(record['duration_minutes']))
+            else:
+                end_time = start_time + DEFAULT_SHOW_DURATION
+            try:
+                # a longer show would be missed by the booking checks
+                check_duration(start_time, end_time)
+            except InvalidProposal:
+                loader.skipped += 1
+                continue
+            rows.append({'id': int(record['id']) if record.get('id') else loader.allocate_id(),
+                         'venue_id': int(venue_id), 'artist_id': int(artist_id), 'start_time': start_time,
+                         'end_time': end_time})
+        if rows:
+            loader.next_id = max(loader.next_id, max(row['id'] for row in rows) + 1)
+            with loader.db.engine.begin() as connection:
+                loader.load(rows, connection)
+                # recount the batch's venues/ artists in its transaction, see show_counters.py
+                for table_name, owner_key in OWNER_KEYS.items():
+                    refresh_show_counters(connection, loader.db.metadata.tables[table_name],
+                                          ids={row[owner_key] for row in rows})
+        loader.report()
+    loader.finish()
+    return loader
+
+
+batch_size_option = click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+                                  help='Rows per insert batch/ transaction.')
+copy_option = click.option('--copy/--no-copy', 'use_copy', default=None,
+                           help='Force COPY on or off, defaults to COPY on postgres.')
+
+
+@seed_cli.command('venues')
+@click.argument('path')
+@batch_size_option
+@copy_option
+def seed_venues(path, batch_size, use_copy):
+    """Import venues from a CSV or JSON Lines file."""
+    load_entities('venues', read_records(path), batch_size, use_copy)
+
+
+@seed_cli.command('artists')
+@click.argument('path')
+@batch_size_option
+@copy_option
+def seed_artists(path, batch_size, use_copy):
+    """Import artists from a CSV or JSON Lines file."""
+    load_entities('artists', read_records(path), batch_size, use_copy)
+
+
+@seed_cli.command('shows')
+@click.argument('path')
+@batch_size_option
+@copy_option
+def seed_shows(path, batch_size, use_copy):
+    """Import shows from a CSV or JSON Lines file."""
+    load_shows(read_records(path), batch_size, use_copy)
+
+
+@seed_cli.command('synthetic')
+@click.option('--venues', 'num_venues', default=1000, show_default=True)
+@click.option('--artists', 'num_artists', default=1000, show_default=True)
+@click.option('--shows', 'num_shows', default=100000, show_default=True)
+@click.option('--areas', default=200, show_default=True, help='Distinct (city, state) pairs.')
+@click.option('--seed', 'random_seed', default=0, show_default=True)
+@batch_size_option
+@copy_option
+def seed_synthetic(num_venues, num_artists, num_shows, areas, random_seed, batch_size, use_copy):
+    """Generate synthetic venues, artists and shows for load tests and benchmarks."""
+    rng = random.Random(random_seed)
+    genres = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop',
+              'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae',
+              'Rock n Roll', 'Soul', 'Other']
+    states = ['CA', 'NY', 'TX', 'WA', 'IL', 'FL', 'MA', 'CO', 'OR', 'GA']
+    # venues are scattered around a center per area, drawn apart so the rest of the data stays the same
+    geo_rng = random.Random(f'{random_seed}-geo')
+    centers = [(geo_rng.uniform(25, 49), geo_rng.uniform(-124, -67)) for _ in range(areas)]
+
+    def entities(kind, count):
+        for i in range(count):
+            area = rng.randrange(areas)
+            entity = {'name': f'{kind} {i}', 'city': f'City {area}', 'state': states[area % len(states)],
+                      'phone': f'{rng.randrange(100, 1000)}-555-{rng.randrange(1000, 10000)}',
+                      'genres': rng.sample(genres, rng.randint(1, 3))}
+            if kind == 'Venue':
+                entity['latitude'] = centers[area][0] + geo_rng.gauss(0, 0.1)
+                entity['longitude'] = centers[area][1] + geo_rng.gauss(0, 0.1)
+            yield entity
+
+    venue_ids = {}
+    artist_ids = {}
+    load_entities('venues', entities('Venue', num_venues), batch_size, use_copy, name_ids=venue_ids)
+    load_entities('artists', entities('Artist', num_artists), batch_size, use_copy, name_ids=artist_ids)
+    venue_id_list = list(venue_ids.values())
+    artist_id_list = list(artist_ids.values())
+    now = datetime.now(pytz.utc).replace(minute=0, second=0, microsecond=0)
+
+    def shows():
+        for _ in range(num_shows):
+            # two years back to one year ahead
+            yield {'venue_id': rng.choice(venue_id_list), 'artist_id': rng.choice(artist_id_list),
+                   'start_time': now + timedelta(hours=rng.randrange(-2 * 365 * 24, 365 * 24))}
+
+    load_shows(shows(), batch_size, use_copy, venue_ids=venue_ids, artist_ids=artist_ids)
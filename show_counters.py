@@ -0,0 +1,120 @@
+"""
+Upcoming/ past show counters kept on the venues and artists rows.
+
+Each venue/ artist row carries upcoming_shows_count, past_shows_count and next_show_at, the start
+of its earliest upcoming show. Inserting a show bumps its venue's and artist's counters in the same
+transaction (count_new_show), deleting shows recounts the rows they belonged to
+(refresh_show_counters with ids).
+
+Shows roll from upcoming to past as time passes. A row's counters are exact until its next_show_at
+is reached, so readers go through upcoming_shows_count(), which counts the shows of such rows live and
+reads the stored counter for all the others. `flask show-counters refresh`, run on a schedule
+(e.g. every few minutes from cron), recounts the rows whose next_show_at has passed, which keeps the
+live counting down to the rows that rolled over since its last run.
+"""
+from datetime import datetime
+
+import click
+import pytz
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, case, func, or_, select
+
+show_counters_cli = AppGroup('show-counters', help='Maintain the upcoming/ past show counters.')
+
+# counted table -> its key on shows
+OWNER_KEYS = {'venues': 'venue_id', 'artists': 'artist_id'}
+
+
+def _shows(table):
+    return table.metadata.tables['shows']
+
+
+def _owner_key(table):
+    return _shows(table).c[OWNER_KEYS[table.name]]
+
+
+def upcoming_shows_count(table, now=None):
+    """
+    Upcoming show count of each row, exact whether or not the counters were refreshed since a show started
+    :param table: venues or artists table
+    :param now: reference timestamp, defaults to current utc time
+    :return: column expression
+    """
+    if now is None:
+        now = datetime.now(pytz.utc)
+    shows = _shows(table)
+    live_count = select([func.count(shows.c.id)])\
+        .where(and_(_owner_key(table) == table.c.id, shows.c.start_time > now)).as_scalar()
+    return case([(table.c.next_show_at <= now, live_count)], else_=table.c.upcoming_shows_count)
+
+
+def count_new_show(connection, table, owner_id, start_time, now=None):
+    """
+    Adds a just inserted show to its venue's or artist's counters, in the caller's transaction.
+    The increment is applied to the row as locked, concurrent inserts don't lose counts.
+    :param connection: db session or connection
+    :param table: venues or artists table
+    :param owner_id: venue/ artist id of the show
+    :param start_time: (datetime) start of the show
+    :param now: reference timestamp, defaults to current utc time
+    """
+    if now is None:
+        now = datetime.now(pytz.utc)
+    if start_time.tzinfo is None:
+        start_time = pytz.utc.localize(start_time)
+    if start_time > now:
+        values = {
+            'upcoming_shows_count': table.c.upcoming_shows_count + 1,
+            'next_show_at': case([(or_(table.c.next_show_at.is_(None), table.c.next_show_at > start_time),
+                                   start_time)], else_=table.c.next_show_at),
+        }
+    else:
+        values = {'past_shows_count': table.c.past_shows_count + 1}
+    connection.execute(table.update().where(table.c.id == owner_id).values(values))
+
+
+def refresh_show_counters(connection, table, ids=None, now=None, rolled_over_only=True):
+    """
+    Recounts the counters from the shows table
+    :param connection: db session or connection
+    :param table: venues or artists table
+    :param ids: only these rows, e.g. the ones that lost shows
+    :param now: reference timestamp, defaults to current utc time
+    :param rolled_over_only: without ids, only the rows whose next show has started. False recounts every row
+    :return: (int) rows updated
+    """
+    if now is None:
+        now = datetime.now(pytz.utc)
+    shows = _shows(table)
+    owned = _owner_key(table) == table.c.id
+
+    def count(clause):
+        return select([func.count(shows.c.id)]).where(and_(owned, clause)).as_scalar()
+
+    statement = table.update().values({
+        'upcoming_shows_count': count(shows.c.start_time > now),
+        'past_shows_count': count(shows.c.start_time <= now),
+        'next_show_at': select([func.min(shows.c.start_time)]).where(and_(owned, shows.c.start_time > now)).as_scalar(),
+    })
+    if ids is not None:
+        ids = list(ids)
+        if not ids:
+            return 0
+        statement = statement.where(table.c.id.in_(ids))
+    elif rolled_over_only:
+        statement = statement.where(table.c.next_show_at <= now)
+    return connection.execute(statement).rowcount
+
+
+@show_counters_cli.command('refresh')
+@click.option('--all', 'everything', is_flag=True, help='Recount every row instead of the rolled over ones.')
+def refresh_command(everything):
+    """Move started shows from the upcoming to the past counters."""
+    db = current_app.extensions['sqlalchemy'].db
+    now = datetime.now(pytz.utc)
+    with db.engine.begin() as connection:
+        for table_name in OWNER_KEYS:
+            updated = refresh_show_counters(connection, db.metadata.tables[table_name], now=now,
+                                            rolled_over_only=not everything)
+            click.echo(f'{table_name}: {updated} rows recounted')